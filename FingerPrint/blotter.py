@@ -7,7 +7,7 @@
 #
 
 from datetime import datetime
-import subprocess, logging
+import logging
 import os
 #TODO remove shlex for python 2.4
 import shlex
@@ -29,7 +29,7 @@ if "any" not in dir(__builtins__):
 from .swirl import Swirl, SwirlFile
 from . import sergeant, utils
 from FingerPrint.plugins import PluginManager
-from FingerPrint.utils import getOutputAsList
+from FingerPrint.packages import getPackageBackend
 
 import FingerPrint.syscalltracer
 
@@ -59,12 +59,27 @@ class Blotter:
     :type execCmd: string
     :param execCmd: a command line which should be launched and dynamically
                     traced to create a swirl.
+
+    :type jobs: int
+    :param jobs: the number of processes used to analyse the files and
+                 their dependencies (see
+                 :meth:`FingerPrint.plugins.PluginManager.prefetch`)
+
+    :type hashAlgorithm: string
+    :param hashAlgorithm: the hashlib algorithm used for the checksums, if
+                          None :data:`FingerPrint.swirl.defaultHashAlgorithm`
+
+    :type elfDigest: string
+    :param elfDigest: how the ELF files are checksummed ("file" or
+                      "sections"), if None
+                      :data:`FingerPrint.swirl.defaultElfDigest`
     """
 
-    def __init__(self, name, fileList, processIDs, execCmd):
+    def __init__(self, name, fileList, processIDs, execCmd, jobs = 1,
+                hashAlgorithm = None, elfDigest = None):
         """give a file list and a name construct a swirl into memory """
         self._detectedPackageManager()
-        self.swirl = Swirl(name, datetime.now())
+        self.swirl = Swirl(name, datetime.now(), hashAlgorithm, elfDigest)
         if execCmd :
             self.swirl.cmdLine = execCmd
         # 
@@ -73,6 +88,8 @@ class Blotter:
         # '/bin/bash' : ['/lib/x86_64-linux-gnu/libnss_files-2.15.so',
         # '/lib/x86_64-linux-gnu/libnss_nis-2.15.so']}
 
+        # statistics of the tracer (see getTracerStatistics)
+        self.tracerStatistics = None
         if execCmd :
             self._straceCmd(execCmd)
 
@@ -99,6 +116,7 @@ class Blotter:
                 return os.path.normpath(os.getcwd() + '/' + path)
         fileList = [ norm_path(f) for f in fileList ]
         fileList = fileList + list(dynamicDependecies.keys())
+        PluginManager.prefetch(fileList, jobs)
         # add all the fileList to the swirl and figure out all their static libraries
         for binPath in fileList:
             if os.path.isfile(binPath):
@@ -175,15 +193,58 @@ class Blotter:
                             swirlFile.openedFiles[execFile].append(swirlOpenedFile)
         self.swirl.ldconf_paths = self._get_ldconf_paths()
         # get hash and package name for each swirlFile
-        for swf in self.swirl.swirlFiles:
-            #let's skip relative path
-            if swf.path[0] != '$' and os.path.exists(swf.path):
-                swf.md5sum = sergeant.getHash(swf.path, swf.type)
-                #TODO make this code nicer
-                if sergeant.is_special_folder( swf.path ) :
-                    swf.package = None
-                else:
-                    swf.package = self._getPackage(swf.path)
+        #let's skip relative path
+        swirlFiles = [swf for swf in self.swirl.swirlFiles
+                if swf.path[0] != '$' and os.path.exists(swf.path)]
+        self._setHashes(swirlFiles, jobs)
+        for swf in swirlFiles:
+            #TODO make this code nicer
+            if sergeant.is_special_folder( swf.path ) :
+                swf.package = None
+            else:
+                swf.package = self._getPackage(swf.path)
+
+
+    def _setHashes(self, swirlFiles, jobs):
+        """
+        set the md5sum of the given swirlFiles using the hashAlgorithm and
+        the elfDigest of the swirl, checksums missing from the metadata cache are computed
+        with a pool of threads. The ELF files which are already prelinked
+        are checksummed with their sections and added to the
+        sectionDigests of the swirl.
+
+        :type swirlFiles: list
+        :param swirlFiles: a list of :class:`FingerPrint.swirl.SwirlFile`
+
+        :type jobs: int
+        :param jobs: the number of threads, if less than 2 the default of
+                     :func:`FingerPrint.sergeant.getHashes` is used
+        """
+        # the cache must be used only from this thread
+        cache = PluginManager.metaCache
+        toHash = []
+        for swf in swirlFiles:
+            swf.md5sum = None
+            if swf.type == 'ELF' and self.swirl.elfDigest == "file" and \
+                    sergeant.isPrelinked(swf.path):
+                # its whole file checksum depends on the prelink of this host
+                self.swirl.sectionDigests.add(swf.path)
+            elfDigest = self.swirl.getElfDigest(swf.path)
+            kind = sergeant.getHashKind(self.swirl, swf.type, elfDigest)
+            if cache:
+                swf.md5sum = cache.get(swf.path, kind)
+            if swf.md5sum is None:
+                toHash.append((swf, elfDigest, kind))
+        width = None
+        if jobs and jobs > 1:
+            width = jobs
+        hashes = sergeant.getHashes([(swf.path, swf.type, elfDigest)
+                for (swf, elfDigest, kind) in toHash], width,
+                self.swirl.hashAlgorithm)
+        for ((swf, elfDigest, kind), md5sum) in zip(toHash, hashes):
+            swf.md5sum = md5sum
+            if cache and md5sum is not None:
+                cache.set(swf.path, kind, md5sum)
 
 
     def getSwirl(self):
@@ -196,6 +257,15 @@ class Blotter:
         """
         return self.swirl 
 
+    def getTracerStatistics(self):
+        """
+        return the statistics of the tracer which run the execCmd
+
+        :rtype: :class:`FingerPrint.syscalltracer.TracerStatistics`
+        :return: the statistics or None if no command was traced
+        """
+        return self.tracerStatistics
+
 
     #TODO add a way to detach from executed programm
     def _straceCmd(self, execcmd):
@@ -203,6 +273,7 @@ class Blotter:
         it adds all the dependency to the dynamicDependecies dictionary
         """
         tracer = FingerPrint.syscalltracer.SyscallTracer()
+        self.tracerStatistics = tracer.statistics
         #TODO check for errors
         execcmd = shlex.split(execcmd)
         try:
@@ -218,11 +289,11 @@ class Blotter:
 
         this list is gathered from what you have in /etc/ld.so.conf"""
         return_paths = []
-	ldconf_cmd = "ldconfig"
-	if not utils.which(ldconf_cmd) :
+        ldconf_cmd = "ldconfig"
+        if not utils.which(ldconf_cmd) :
             ldconf_cmd = "/sbin/ldconfig"
-	if not utils.which(ldconf_cmd) :
-	    logger.error("Unable to find ldconfig. You need ldconfig in you PATH to properly run fingerprint.")
+        if not utils.which(ldconf_cmd) :
+            logger.error("Unable to find ldconfig. You need ldconfig in you PATH to properly run fingerprint.")
         (output, retcode) = utils.getOutputAsList([ldconf_cmd, "-v"])
         #default_paths = ["/lib", "/usr/lib"]
 
@@ -235,76 +306,9 @@ class Blotter:
 
     #
     # package manager related suff
-    # TODO move into their own class
     #
     def _detectedPackageManager(self):
-        """ set the proper _getPackage*(self, path)
-        function to handle rpm or dpkg based on /etc/issue content"""
-        #rpm based OSes
-        rpmOSs = ["red hat", "fedora", "suse", "centos", "scientific linux"]
-        #dpkg based OSes
-        dpkgOSs = ["debian",  "ubuntu"]
-
-	if os.path.exists('/etc/issue.net'):
-            f=open('/etc/issue.net')
-            issues=f.read()
-            f.close()
-            if any(os in issues.lower() for os in rpmOSs):
-                self._getPackage = self._getPackageRpm
-		return
-            elif any(os in issues.lower() for os in dpkgOSs):
-                self._getPackage = self._getPackageDpkg
-		return
-        if not '_getPackage' in dir(self):
-            #we could not detect the pakcage manager
-            self._getPackage = lambda  p : None
-
-
-    def _getPackageDpkg(self, path):
-        """given a path it return the package which provide that 
-        path if if finds one only debian system"""
-        cmd1 = ['dpkg', '-S']
-        cmd2 = ['dpkg-query', '--show', "-f=${Package}\ ${Version}\ ${Architecture}", ]
-        try:
-            (package, returncode) = getOutputAsList(cmd1 + [path])
-        except subprocess.CalledProcessError:
-            #package not found
-            return None
-        except OSError:
-            #cmd not found
-            return None
-        if returncode != 0 or len(package[0]) == 0:
-            #the file is not tracked
-            return None
-        packageName = package[0].split(':')[0]
-        try:
-            (package, returncode) = getOutputAsList(cmd2 + [packageName])
-            if returncode != 0:
-                return None
-            return package[0]
-        except subprocess.CalledProcessError:
-            #package not found
-            return None
-        except OSError:
-            #cmd not found
-            return None
-
-    def _getPackageRpm(self, path):
-        """given a path it return the package which provide that 
-        path if if finds one
-        only rpm based system"""
-        cmd = ['rpm', '-qf']
-        try:
-            (package, returncode) = getOutputAsList(cmd + [path])
-            if returncode != 0:
-                return None
-            return package[0]
-        except subprocess.CalledProcessError:
-            #package not found
-            return None
-        except OSError:
-            #cmd not found
-            return None
-        
-
-
+        """ set the proper _getPackage(self, path) function using the
+        package backend of this system (rpm or dpkg based on /etc/issue
+        content), see :mod:`FingerPrint.packages`"""
+        self._getPackage = getPackageBackend().getPackage
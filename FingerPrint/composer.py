@@ -14,6 +14,7 @@ import tarfile
 import platform, glob
 
 from . import sergeant, utils
+from FingerPrint.packages import getPackageBackend
 
 #
 # compatibility with python2.4
@@ -31,6 +32,24 @@ def_swirl_path = os.path.join(def_base_dir, "output.swirl")
 logger = logging.getLogger('fingerprint')
 
 
+def _checkDigest(swirl, swf, path):
+    """
+    verify that path has the checksum recorded for swf, using the
+    algorithm of the swirl, and log a warning if it does not
+
+    :rtype: bool
+    :return: True if the checksum matches
+    """
+    digest = sergeant.checksumFile(path, swirl.hashAlgorithm, swf.type,
+            swirl.getElfDigest(swf.path))
+    if digest != swf.md5sum:
+        logger.warning("File %s changed since the swirl creation (%s %s "
+                "expected %s)" % (swf.path, swirl.hashAlgorithm, digest,
+                swf.md5sum))
+        return False
+    return True
+
+
 # let's skip vairous private files which should not be archived
 specialFile = ["id_rsa", "id_rsa.pub", "id_dsa", "id_dsa.pub", "known_hosts", ".Xauthority"]
 
@@ -99,8 +118,10 @@ class Archiver:
                     if not os.path.exists(dest_path_dir):
                         os.mkdir(dest_path_dir)
                     shutil.copy2(swf.path, dest_path_dir)
-                    if sergeant.prelink :
+                    if sergeant.prelink and swf.type == 'ELF' and \
+                            sergeant.isPrelinked(dest_path_full):
                         utils.getOutputAsList([sergeant.prelink, "-u", dest_path_full])
+                    _checkDigest(self.sergeant.swirl, swf, dest_path_full)
             #for i in swf.links:
             #    new_link = os.path.join(temp_path, os.path.basename(i))
             #    if not os.path.exists( new_link ):
@@ -144,8 +165,8 @@ class Roller:
         """ """
         self.archive_filename = archive_filename
         self.roll_name = roll_name
-        import yum
-        self.yb = yum.YumBase()
+        # used to search the yum repositories (results are memoised)
+        self.packageBackend = getPackageBackend("rpm")
 
 
     def make_roll(self, fingerprint_base_path, use_remapping = False):
@@ -220,6 +241,7 @@ class Roller:
 		# if the file is not in the archive do not go on
                 logger.debug("File " + source_path + " is not present in the archive")
                 continue
+            _checkDigest(self.swirl, swf, source_path)
             # if use_remapping = true swf must be executable 
             # if use_remapping = false just follow the first swf.path.startswith("/home/")
             if swf.path.startswith("/home/"):
@@ -515,7 +537,7 @@ class Roller:
             if '(GLIBC_PRIVATE)' in dep:
                 # glibc_private is not tracked in the rpm database so skip it
                 continue
-            matches = self.yb.searchPackageProvides( [dep] )
+            matches = self.packageBackend.getRepositoryProviders( dep )
             if len(matches) > 0:
                 for rpm in matches:
                     if all([ i not in rpm.name for i in excludeRPMs ]):
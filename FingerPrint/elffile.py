@@ -0,0 +1,591 @@
+#!/usr/bin/python
+#
+# LC
+#
+# minimal pure python reader for the ELF file format, it reads only
+# the dynamic linking information needed by fingerprint
+#
+
+import os
+import struct
+import hashlib
+
+
+"""This module reads the dynamic section of ELF objects without relying on
+external programs (objdump, ldd, file). Specs:
+http://www.sco.com/developers/gabi/latest/contents.html
+https://refspecs.linuxfoundation.org/LSB_5.0.0/LSB-Core-generic/LSB-Core-generic/symversion.html
+"""
+
+ELFMAG = b'\x7fELF'
+
+ELFCLASS32 = 1
+ELFCLASS64 = 2
+
+ELFDATA2LSB = 1
+ELFDATA2MSB = 2
+
+ET_EXEC = 2
+ET_DYN = 3
+
+EM_386 = 3
+EM_X86_64 = 62
+EM_AARCH64 = 183
+
+PT_LOAD = 1
+PT_DYNAMIC = 2
+PT_INTERP = 3
+
+PF_X = 0x1
+
+DT_NULL = 0
+DT_NEEDED = 1
+DT_STRTAB = 5
+DT_STRSZ = 10
+DT_SONAME = 14
+DT_RPATH = 15
+DT_RUNPATH = 29
+DT_VERDEF = 0x6ffffffc
+DT_VERDEFNUM = 0x6ffffffd
+DT_VERNEED = 0x6ffffffe
+DT_VERNEEDNUM = 0x6fffffff
+
+SHT_PROGBITS = 1
+SHT_RELA = 4
+SHT_NOTE = 7
+SHT_REL = 9
+SHT_DYNSYM = 11
+
+SHF_WRITE = 0x1
+SHF_ALLOC = 0x2
+
+SHN_XINDEX = 0xffff
+
+# section added by prelink with the information needed by prelink -u
+PRELINK_UNDO = ".gnu.prelink_undo"
+
+# sections whose content can be modified by prelink even if they are not
+# writable (relocations, dynamic symbols and strings, prelink own sections)
+_unstableSectionPrefixes = (".gnu.", ".rel", ".dyn")
+
+# sections with the stubs which jump through the GOT to the imported functions
+_pltSections = (".plt", ".plt.sec", ".plt.got")
+
+# size of the blocks read by ElfFile.getStableDigest
+_digestChunkSize = 1024 * 1024
+
+# default loader used by ldd when a shared object does not have a PT_INTERP
+defaultLoaders = {
+    (EM_X86_64, ELFCLASS64): "ld-linux-x86-64.so.2",
+    (EM_386, ELFCLASS32): "ld-linux.so.2",
+    (EM_AARCH64, ELFCLASS64): "ld-linux-aarch64.so.1",
+}
+
+
+class ElfFormatError(Exception):
+    """
+    raised when a file is not a valid ELF object
+    """
+    pass
+
+
+class ElfFile(object):
+    """
+    It reads the ELF header, the program headers and the dynamic section
+    of an ELF object. Both 32 and 64 bit objects and both endianness are
+    supported.
+
+    :type fileName: string
+    :param fileName: the path to the ELF file to read
+
+    :raise ElfFormatError: if the file is not an ELF object
+    """
+
+    def __init__(self, fileName):
+        self.fileName = fileName
+        # program interpreter (PT_INTERP) or None
+        self.interpreter = None
+        # list of DT_NEEDED sonames
+        self.needed = []
+        self.soname = None
+        self.rpath = None
+        self.runpath = None
+        # dictionary soname -> list of required versions (DT_VERNEED)
+        self.versionNeeds = {}
+        # list of defined versions (DT_VERDEF), the first one is the base
+        self.versionDefinitions = []
+        self._segments = []
+        self._dynstr = None
+        fd = open(fileName, 'rb')
+        try:
+            self._fd = fd
+            self._readHeader()
+            self._readProgramHeaders()
+            self._readDynamic()
+        finally:
+            # the object must be picklable (see FingerPrint.metacache)
+            self._fd = None
+            self._dynstr = None
+            fd.close()
+
+    def is64bits(self):
+        """
+        :rtype: bool
+        :return: True if this is a 64 bit object
+        """
+        return self.elfClass == ELFCLASS64
+
+    def is32bits(self):
+        """
+        :rtype: bool
+        :return: True if this is a 32 bit object
+        """
+        return self.elfClass == ELFCLASS32
+
+    def isDynamic(self):
+        """
+        :rtype: bool
+        :return: True if this object has a dynamic section
+        """
+        return self._dynamic is not None
+
+    def getLoaderName(self):
+        """
+        return the soname of the dynamic loader which ldd would report for
+        this object: the PT_INTERP if present, otherwise the default loader
+        of the architecture for dynamic objects with DT_NEEDED entries
+
+        :rtype: string
+        :return: the loader soname or None for static objects
+        """
+        if self.interpreter:
+            return os.path.basename(self.interpreter)
+        if self.needed:
+            return defaultLoaders.get((self.machine, self.elfClass))
+        return None
+
+    def getSegments(self):
+        """
+        :rtype: list
+        :return: a list of tuples (vaddr, offset, filesz, flags) with the
+                 PT_LOAD segments in the program header table order
+        """
+        return list(self._segments)
+
+    def getSections(self):
+        """
+        read the section headers of this object
+
+        :rtype: list
+        :return: a list of tuples (name, type, flags, offset, size) in the
+                 same order of the section header table, an empty list if
+                 the object has no section headers
+        """
+        fd = open(self.fileName, 'rb')
+        try:
+            self._fd = fd
+            return [section[:5] for section in self._readSectionHeaders()]
+        finally:
+            self._fd = None
+            fd.close()
+
+    def isPrelinked(self):
+        """
+        :rtype: bool
+        :return: True if this object was modified by prelink
+        """
+        return any(section[0] == PRELINK_UNDO for section in self.getSections())
+
+    def getStableDigest(self, algorithm = "md5"):
+        """
+        compute a checksum of this object which does not change when the
+        object is prelinked: the content of the allocated read-only
+        PROGBITS and NOTE sections (code, read-only data, notes) is hashed
+        together with their names and with the dynamic linking metadata
+        that prelink does not modify (soname, needed libraries, RPATH,
+        RUNPATH, versions and the names of the dynamic symbols).
+
+        The sections which prelink relocates or rewrites are skipped:
+        writable data (.data, .init_array, .fini_array, GOT), the values
+        of the dynamic entries and symbols, the relocations and the
+        .gnu.* sections. A modification limited to those sections is not
+        detected. The same object gives the same digest on prelinked and
+        non-prelinked hosts.
+
+        :type algorithm: string
+        :param algorithm: the name of the hashlib algorithm to use
+
+        :rtype: string
+        :return: an hexadecimal representation of the checksum or None if
+                 the object has no section headers
+        """
+        fd = open(self.fileName, 'rb')
+        try:
+            self._fd = fd
+            sections = self._readSectionHeaders()
+            if not sections:
+                return None
+            md = hashlib.new(algorithm)
+            for section in sections:
+                (name, sh_type, sh_flags, sh_offset, sh_size) = section[:5]
+                if sh_type not in (SHT_PROGBITS, SHT_NOTE) or \
+                        not sh_flags & SHF_ALLOC or sh_flags & SHF_WRITE or \
+                        name.startswith(_unstableSectionPrefixes):
+                    continue
+                md.update(name.encode('utf-8') + b'\0' + struct.pack("<Q", sh_size))
+                fd.seek(sh_offset)
+                while sh_size > 0:
+                    chunk = fd.read(min(sh_size, _digestChunkSize))
+                    if not chunk:
+                        raise ElfFormatError("File %s is truncated" % self.fileName)
+                    md.update(chunk)
+                    sh_size -= len(chunk)
+            md.update(self._getStableMetadata(sections))
+            return md.hexdigest()
+        finally:
+            self._fd = None
+            fd.close()
+
+    def _getStableMetadata(self, sections):
+        """return the dynamic linking information hashed by
+        :meth:`getStableDigest` as a string of bytes"""
+        fields = [self.soname or '', self.rpath or '', self.runpath or '']
+        fields += self.needed
+        for soname in sorted(self.versionNeeds):
+            fields += [soname] + self.versionNeeds[soname]
+        fields += self.versionDefinitions
+        data = '\0'.join(fields).encode('utf-8') + b'\0'
+        # prelink changes the values of the dynamic symbols but never
+        # their names, types and bindings
+        if self.is64bits():
+            infoOffset = 4
+        else:
+            infoOffset = 12
+        for (name, sh_type, sh_flags, sh_offset, sh_size, sh_addr, sh_link,
+                sh_entsize) in sections:
+            if sh_type != SHT_DYNSYM or not sh_entsize or sh_link >= len(sections):
+                continue
+            strtab = sections[sh_link]
+            names = self._read(strtab[3], strtab[4])
+            symbols = self._read(sh_offset, sh_size)
+            for offset in range(0, len(symbols) - sh_entsize + 1, sh_entsize):
+                (st_name,) = self._unpack("I", symbols, offset)
+                end = names.find(b'\0', st_name)
+                if end < 0:
+                    end = len(names)
+                st_info = symbols[offset + infoOffset:offset + infoOffset + 1]
+                data += names[st_name:end] + st_info
+        return data
+
+    def getPltSymbols(self):
+        """
+        find the names of the functions imported through the procedure
+        linkage table: each PLT stub (.plt, .plt.sec and .plt.got) is decoded
+        to find the GOT slot it jumps through and the GOT slots are mapped to
+        symbols with the dynamic relocations. Only x86 objects are supported.
+
+        :rtype: dict
+        :return: a dictionary virtual address -> symbol name with the
+                 addresses of the PLT stubs (what a disassembler shows as
+                 open@plt) and of the GOT slots (used by code compiled with
+                 -fno-plt), an empty dictionary if the object has no section
+                 headers
+        """
+        if self.machine not in (EM_X86_64, EM_386):
+            return {}
+        fd = open(self.fileName, 'rb')
+        try:
+            self._fd = fd
+            sections = self._readSectionHeaders()
+            # GOT slot -> symbol name
+            symbols = {}
+            for section in sections:
+                if section[1] in (SHT_RELA, SHT_REL):
+                    symbols.update(self._readRelocations(section, sections))
+            gotBase = None
+            for section in sections:
+                if section[0] == ".got.plt":
+                    gotBase = section[5]
+            plt = {}
+            for (name, sh_type, sh_flags, sh_offset, sh_size, sh_addr, sh_link,
+                    sh_entsize) in sections:
+                if name not in _pltSections or sh_type != SHT_PROGBITS:
+                    continue
+                data = self._read(sh_offset, sh_size)
+                entrySize = sh_entsize or 16
+                for start in range(0, sh_size, entrySize):
+                    slot = self._getJumpSlot(data[start:start + entrySize],
+                            sh_addr + start, gotBase)
+                    if slot in symbols:
+                        plt[sh_addr + start] = symbols[slot]
+            symbols.update(plt)
+            return symbols
+        finally:
+            self._fd = None
+            fd.close()
+
+
+    def _read(self, offset, size):
+        """read size bytes at the given file offset"""
+        self._fd.seek(offset)
+        data = self._fd.read(size)
+        if len(data) != size:
+            raise ElfFormatError("File %s is truncated" % self.fileName)
+        return data
+
+    def _unpack(self, format, data, offset=0):
+        return struct.unpack_from(self._endian + format, data, offset)
+
+    def _readHeader(self):
+        """parse the ELF header"""
+        ident = self._fd.read(16)
+        if len(ident) != 16 or ident[0:4] != ELFMAG:
+            raise ElfFormatError("File %s is not an ELF file" % self.fileName)
+        self.elfClass = ident[4]
+        if ident[5] == ELFDATA2LSB:
+            self._endian = '<'
+        elif ident[5] == ELFDATA2MSB:
+            self._endian = '>'
+        else:
+            raise ElfFormatError("Unknown data encoding in %s" % self.fileName)
+        if self.elfClass == ELFCLASS64:
+            # e_type ... e_shstrndx
+            header = self._read(16, 48)
+            (self.type, self.machine, version, self.entry, self._phoff,
+                self._shoff, flags, ehsize, self._phentsize, self._phnum,
+                self._shentsize, self._shnum, self._shstrndx) = \
+                self._unpack("HHIQQQIHHHHHH", header)
+        elif self.elfClass == ELFCLASS32:
+            header = self._read(16, 36)
+            (self.type, self.machine, version, self.entry, self._phoff,
+                self._shoff, flags, ehsize, self._phentsize, self._phnum,
+                self._shentsize, self._shnum, self._shstrndx) = \
+                self._unpack("HHIIIIIHHHHHH", header)
+        else:
+            raise ElfFormatError("Unknown ELF class in %s" % self.fileName)
+
+    def _readProgramHeaders(self):
+        """parse the program headers looking for PT_LOAD, PT_INTERP and PT_DYNAMIC"""
+        self._dynamic = None
+        if not self._phoff or not self._phnum:
+            return
+        data = self._read(self._phoff, self._phentsize * self._phnum)
+        for i in range(self._phnum):
+            offset = i * self._phentsize
+            if self.is64bits():
+                (p_type, p_flags, p_offset, p_vaddr, p_paddr, p_filesz,
+                    p_memsz, p_align) = self._unpack("IIQQQQQQ", data, offset)
+            else:
+                (p_type, p_offset, p_vaddr, p_paddr, p_filesz,
+                    p_memsz, p_flags, p_align) = self._unpack("IIIIIIII", data, offset)
+            if p_type == PT_LOAD:
+                self._segments.append((p_vaddr, p_offset, p_filesz, p_flags))
+            elif p_type == PT_INTERP:
+                self.interpreter = self._read(p_offset, p_filesz).split(b'\0')[0].decode()
+            elif p_type == PT_DYNAMIC:
+                self._dynamic = (p_offset, p_filesz)
+
+    def _readSectionHeader(self, index):
+        """return the tuple (sh_name, sh_type, sh_flags, sh_offset, sh_size,
+        sh_link, sh_addr, sh_entsize) of the section header at index"""
+        if self.is64bits():
+            (sh_name, sh_type, sh_flags, sh_addr, sh_offset, sh_size, sh_link,
+                sh_info, sh_addralign, sh_entsize) = self._unpack("IIQQQQIIQQ",
+                    self._read(self._shoff + index * self._shentsize, 64))
+        else:
+            (sh_name, sh_type, sh_flags, sh_addr, sh_offset, sh_size, sh_link,
+                sh_info, sh_addralign, sh_entsize) = self._unpack("IIIIIIIIII",
+                    self._read(self._shoff + index * self._shentsize, 40))
+        return (sh_name, sh_type, sh_flags, sh_offset, sh_size, sh_link,
+                sh_addr, sh_entsize)
+
+    def _readSectionHeaders(self):
+        """parse the section header table, it returns the tuples of
+        :meth:`getSections` followed by sh_addr, sh_link and sh_entsize"""
+        if not self._shoff:
+            return []
+        shnum = self._shnum
+        shstrndx = self._shstrndx
+        if shnum == 0 or shstrndx == SHN_XINDEX:
+            # too many sections, the real values are in the first header
+            first = self._readSectionHeader(0)
+            if shnum == 0:
+                shnum = first[4]
+            if shstrndx == SHN_XINDEX:
+                shstrndx = first[5]
+        headers = [self._readSectionHeader(i) for i in range(shnum)]
+        names = b""
+        if shstrndx < shnum:
+            names = self._read(headers[shstrndx][3], headers[shstrndx][4])
+        sections = []
+        for (sh_name, sh_type, sh_flags, sh_offset, sh_size, sh_link, sh_addr,
+                sh_entsize) in headers:
+            end = names.find(b'\0', sh_name)
+            if end < 0:
+                end = len(names)
+            sections.append((names[sh_name:end].decode('utf-8', 'replace'),
+                sh_type, sh_flags, sh_offset, sh_size, sh_addr, sh_link, sh_entsize))
+        return sections
+
+    def _readRelocations(self, section, sections):
+        """return a dictionary r_offset -> symbol name of the relocations of
+        section which refer to a symbol of the dynamic symbol table"""
+        (name, sh_type, sh_flags, sh_offset, sh_size, sh_addr, sh_link,
+            sh_entsize) = section
+        if sh_link >= len(sections) or sections[sh_link][1] != SHT_DYNSYM:
+            return {}
+        symtab = sections[sh_link]
+        if symtab[6] >= len(sections):
+            return {}
+        strtab = sections[symtab[6]]
+        symbolData = self._read(symtab[3], symtab[4])
+        strings = self._read(strtab[3], strtab[4])
+        if self.is64bits():
+            (entryFormat, symbolSize, shift) = ("QQ", 24, 32)
+            entrySize = 24 if sh_type == SHT_RELA else 16
+        else:
+            (entryFormat, symbolSize, shift) = ("II", 16, 8)
+            entrySize = 12 if sh_type == SHT_RELA else 8
+        data = self._read(sh_offset, sh_size)
+        symbols = {}
+        for i in range(0, sh_size - entrySize + 1, entrySize):
+            (r_offset, r_info) = self._unpack(entryFormat, data, i)
+            index = r_info >> shift
+            if not index or (index + 1) * symbolSize > len(symbolData):
+                continue
+            # st_name is the first field of both Elf32_Sym and Elf64_Sym
+            st_name = self._unpack("I", symbolData, index * symbolSize)[0]
+            end = strings.find(b'\0', st_name)
+            if end < 0:
+                end = len(strings)
+            symbols[r_offset] = strings[st_name:end].decode('utf-8', 'replace')
+        return symbols
+
+    def _getJumpSlot(self, entry, address, gotBase):
+        """decode the indirect jmp of the PLT stub entry at address and
+        return the address of the GOT slot it jumps through or None"""
+        # jmp *disp32(%rip) on 64bit, jmp *abs32 on 32bit
+        # (possibly after endbr64 and bnd prefixes)
+        i = entry.find(b'\xff\x25')
+        if 0 <= i <= len(entry) - 6:
+            disp = struct.unpack_from("<i", entry, i + 2)[0]
+            if self.is64bits():
+                return address + i + 6 + disp
+            return disp & 0xffffffff
+        # jmp *disp32(%ebx) in position independent 32bit code, %ebx
+        # points to the .got.plt
+        i = entry.find(b'\xff\xa3')
+        if gotBase is not None and 0 <= i <= len(entry) - 6:
+            return (gotBase + struct.unpack_from("<i", entry, i + 2)[0]) & 0xffffffff
+        return None
+
+    def vaddrToOffset(self, vaddr):
+        """
+        translate a virtual address into a file offset using the PT_LOAD
+        segments
+
+        :type vaddr: int
+        :param vaddr: a virtual address as found in the dynamic section
+
+        :rtype: int
+        :return: the file offset or None if the address is not backed by the file
+        """
+        for (p_vaddr, p_offset, p_filesz, p_flags) in self._segments:
+            if p_vaddr <= vaddr < p_vaddr + p_filesz:
+                return vaddr - p_vaddr + p_offset
+        return None
+
+    def offsetToVaddr(self, offset):
+        """
+        translate a file offset into a virtual address using the PT_LOAD
+        segments (the inverse of :meth:`vaddrToOffset`)
+
+        :type offset: int
+        :param offset: a file offset
+
+        :rtype: int
+        :return: the virtual address or None if the offset is not loaded
+        """
+        for (p_vaddr, p_offset, p_filesz, p_flags) in self._segments:
+            if p_offset <= offset < p_offset + p_filesz:
+                return offset - p_offset + p_vaddr
+        return None
+
+    def _readDynamic(self):
+        """parse the dynamic section and the version sections it points to"""
+        if not self._dynamic:
+            return
+        (offset, size) = self._dynamic
+        data = self._read(offset, size)
+        if self.is64bits():
+            entryFormat, entrySize = "qQ", 16
+        else:
+            entryFormat, entrySize = "iI", 8
+        entries = []
+        tags = {}
+        for i in range(0, size - entrySize + 1, entrySize):
+            (tag, value) = self._unpack(entryFormat, data, i)
+            if tag == DT_NULL:
+                break
+            entries.append((tag, value))
+            tags.setdefault(tag, value)
+        strtab = self.vaddrToOffset(tags.get(DT_STRTAB, -1))
+        if strtab is None or DT_STRSZ not in tags:
+            return
+        self._dynstr = self._read(strtab, tags[DT_STRSZ])
+        for (tag, value) in entries:
+            if tag == DT_NEEDED:
+                self.needed.append(self._getString(value))
+            elif tag == DT_SONAME:
+                self.soname = self._getString(value)
+            elif tag == DT_RPATH:
+                self.rpath = self._getString(value)
+            elif tag == DT_RUNPATH:
+                self.runpath = self._getString(value)
+        if DT_VERNEED in tags:
+            self._readVersionNeeds(tags[DT_VERNEED], tags.get(DT_VERNEEDNUM, 0))
+        if DT_VERDEF in tags:
+            self._readVersionDefinitions(tags[DT_VERDEF], tags.get(DT_VERDEFNUM, 0))
+
+    def _getString(self, index):
+        """return the string at index in the dynamic string table"""
+        end = self._dynstr.find(b'\0', index)
+        if end < 0:
+            end = len(self._dynstr)
+        return self._dynstr[index:end].decode('utf-8', 'replace')
+
+    def _readVersionNeeds(self, vaddr, count):
+        """parse the Elf_Verneed entries (.gnu.version_r)"""
+        offset = self.vaddrToOffset(vaddr)
+        while offset is not None and count > 0:
+            (vn_version, vn_cnt, vn_file, vn_aux, vn_next) = \
+                self._unpack("HHIII", self._read(offset, 16))
+            versions = self.versionNeeds.setdefault(self._getString(vn_file), [])
+            auxOffset = offset + vn_aux
+            for i in range(vn_cnt):
+                (vna_hash, vna_flags, vna_other, vna_name, vna_next) = \
+                    self._unpack("IHHII", self._read(auxOffset, 16))
+                versions.append(self._getString(vna_name))
+                if not vna_next:
+                    break
+                auxOffset += vna_next
+            count -= 1
+            if not vn_next:
+                break
+            offset += vn_next
+
+    def _readVersionDefinitions(self, vaddr, count):
+        """parse the Elf_Verdef entries (.gnu.version_d)"""
+        offset = self.vaddrToOffset(vaddr)
+        while offset is not None and count > 0:
+            (vd_version, vd_flags, vd_ndx, vd_cnt, vd_hash, vd_aux, vd_next) = \
+                self._unpack("HHHHIII", self._read(offset, 20))
+            if vd_cnt > 0:
+                # the first aux entry is the name of the version, the
+                # others are its parents
+                (vda_name, vda_next) = self._unpack("II", self._read(offset + vd_aux, 8))
+                self.versionDefinitions.append(self._getString(vda_name))
+            count -= 1
+            if not vd_next:
+                break
+            offset += vd_next
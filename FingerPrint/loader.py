@@ -0,0 +1,329 @@
+#!/usr/bin/python
+#
+# LC
+#
+# emulates the lookups done by the dynamic loader when it searches for
+# shared libraries
+#
+
+import os
+import struct
+import logging
+
+from FingerPrint.utils import getOutputAsList
+
+logger = logging.getLogger('fingerprint')
+
+
+"""This module reads the /etc/ld.so.cache file generated by ldconfig
+(the format is described in glibc sysdeps/generic/dl-cache.h) and it
+indexes the directories where libraries are searched.
+"""
+
+# old format (libc5 and glibc < 2.32 compat section)
+_OLD_MAGIC = b"ld.so-1.7.0"
+# new format
+_NEW_MAGIC = b"glibc-ld.so.cache1.1"
+
+# ELF libraries types
+_FLAG_TYPE_MASK = 0x00ff
+_FLAG_ELF_TYPES = (0x0001, 0x0002, 0x0003)
+# architecture required by the library
+_FLAG_REQUIRED_MASK = 0xff00
+_FLAG_NONE = 0x0000
+_FLAG_X8664_LIB64 = 0x0300
+# keyword used by ldconfig -p for the flag above
+_LDCONFIG_X8664 = "x86-64"
+
+
+class LdSoCache(object):
+    """
+    In memory index of the loader cache. It maps each soname to the list of
+    (path, arch, hwcap) found in the cache, preserving the cache order. The
+    arch uses the same strings of :class:`FingerPrint.swirl.Arch`.
+
+    If the cache file can not be parsed it falls back to the output of
+    ``ldconfig -p``.
+
+    :type fileName: string
+    :param fileName: the path of the loader cache
+    """
+
+    def __init__(self, fileName = "/etc/ld.so.cache"):
+        self.fileName = fileName
+        self.libraries = {}
+        try:
+            f = open(fileName, 'rb')
+            data = f.read()
+            f.close()
+        except IOError:
+            data = b""
+        if not self._parse(data):
+            logger.debug("Unable to parse %s falling back to ldconfig -p" % fileName)
+            self._parseLdconfig()
+
+    def getPaths(self, soname, arch):
+        """
+        return all the paths of the libraries with the given soname and
+        architecture which do not require any special hardware capability
+
+        :type soname: string
+        :param soname: the soname of the library (e.g. libc.so.6)
+
+        :type arch: string
+        :param arch: the architecture (see :class:`FingerPrint.swirl.Arch`)
+
+        :rtype: list
+        :return: a list of paths in the same order of the cache
+        """
+        return [path for (path, libArch, hwcap) in self.libraries.get(soname, [])
+                if libArch == arch and not hwcap]
+
+    def _add(self, soname, path, arch, hwcap):
+        if soname not in self.libraries:
+            self.libraries[soname] = []
+        self.libraries[soname].append((path, arch, hwcap))
+
+    @staticmethod
+    def _getArch(flags):
+        """translate the cache flags into a swirl Arch string"""
+        if (flags & _FLAG_TYPE_MASK) not in _FLAG_ELF_TYPES:
+            return None
+        required = flags & _FLAG_REQUIRED_MASK
+        if required == _FLAG_X8664_LIB64:
+            return "x86_64"
+        elif required == _FLAG_NONE:
+            return "i386"
+        # other 64 bit ABIs (aarch64, ppc64, etc.), x32, arm hard float,
+        # etc. are not tracked by fingerprint
+        return None
+
+    def _parse(self, data):
+        """
+        parse the content of the cache file
+
+        :rtype: bool
+        :return: False if the format was not recognized
+        """
+        if data.startswith(_NEW_MAGIC):
+            return self._parseNew(data, 0)
+        if not data.startswith(_OLD_MAGIC) or len(data) < 16:
+            return False
+        (nlibs,) = struct.unpack_from("=I", data, 12)
+        oldEnd = 16 + nlibs * 12
+        # the new format follows the old one aligned to 8 bytes
+        newStart = (oldEnd + 7) & ~7
+        if data.startswith(_NEW_MAGIC, newStart):
+            return self._parseNew(data, newStart)
+        # only the old format, string offsets start after the entries
+        for i in range(nlibs):
+            (flags, key, value) = struct.unpack_from("=iII", data, 16 + i * 12)
+            arch = self._getArch(flags)
+            if arch:
+                self._add(self._getString(data, oldEnd + key),
+                          self._getString(data, oldEnd + value), arch, 0)
+        return True
+
+    def _parseNew(self, data, start):
+        """parse the new format which starts at the offset start"""
+        if len(data) < start + 48:
+            return False
+        endianFlag = struct.unpack_from("=B", data, start + 28)[0]
+        if endianFlag == 2:
+            endian = "<"
+        elif endianFlag == 3:
+            endian = ">"
+        else:
+            endian = "="
+        (nlibs, lenStrings) = struct.unpack_from(endian + "II", data, start + 20)
+        for i in range(nlibs):
+            (flags, key, value, osversion, hwcap) = \
+                    struct.unpack_from(endian + "iIIIQ", data, start + 48 + i * 24)
+            arch = self._getArch(flags)
+            if arch:
+                # strings offsets are relative to the beginning of the new header
+                self._add(self._getString(data, start + key),
+                          self._getString(data, start + value), arch, hwcap)
+        return True
+
+    @staticmethod
+    def _getString(data, offset):
+        end = data.find(b'\0', offset)
+        return data[offset:end].decode('utf-8', 'replace')
+
+    def _parseLdconfig(self, lines = None):
+        """
+        build the index from the output of ldconfig -p, e.g.:
+        libz.so.1 (libc6,x86-64, hwcap: 0x0000000000000004) => /lib64/libz.so.1
+
+        :type lines: list
+        :param lines: the lines printed by ldconfig -p, if None ldconfig
+                      is run
+        """
+        if lines is None:
+            lines = getOutputAsList(["/sbin/ldconfig", "-p"])[0]
+        for line in lines:
+            temp = line.split('=>')
+            if len(temp) != 2 or '(' not in temp[0]:
+                continue
+            (soname, flags) = temp[0].strip().split(' (', 1)
+            flags = [i.strip() for i in flags.rstrip(')').split(',')]
+            hwcap = 0
+            # the first flag is the library type (libc6, ELF, etc.), without
+            # an ABI keyword it is a 32 bit x86 library
+            arch = "i386"
+            for flag in flags[1:]:
+                if flag.startswith('hwcap:'):
+                    try:
+                        hwcap = int(flag.split(':')[1], 16)
+                    except ValueError:
+                        # glibc-hwcaps subdirectory e.g. hwcap: "x86-64-v3"
+                        hwcap = -1
+                elif ':' in flag:
+                    # OS ABI: Linux 2.6.32
+                    continue
+                elif flag == _LDCONFIG_X8664:
+                    arch = "x86_64"
+                else:
+                    # other ABIs (AArch64, x32, hard-float, etc.)
+                    arch = None
+            if arch:
+                self._add(soname, temp[1].strip(), arch, hwcap)
+
+
+class SearchPath(object):
+    """
+    Index of the content of the directories scanned when searching for a
+    library (system paths, RPATH and LD_LIBRARY_PATH). Each directory is
+    listed only once and its entry names are kept in a dictionary so that
+    searching a soname in any ordered list of directories does not touch
+    the file system again. Listing does not follow the symlinks, only the
+    candidates returned by :meth:`getPaths` are checked to be files.
+
+    Long running users (e.g. :func:`FingerPrint.sergeant.verifySwirls`)
+    call :meth:`invalidate` to drop the directories modified since they
+    were listed.
+    """
+
+    def __init__(self):
+        # directory -> (st_mtime_ns, {entry name: path})
+        self._directories = {}
+        # path -> True if it is a file (or a symlink to a file)
+        self._files = {}
+        # tuple of directories -> normalised tuple (see getKey)
+        self._keys = {}
+
+    def getKey(self, directories):
+        """
+        return the identity of a list of directories: two lists with the
+        same key give the same results with :meth:`getPaths`
+
+        :type directories: list
+        :param directories: a list of string with the directories to search
+
+        :rtype: tuple
+        :return: a tuple with the normalised directories in order of
+                 precedence without duplicates
+        """
+        directories = tuple(directories)
+        key = self._keys.get(directories)
+        if key is None:
+            key = []
+            visited = set()
+            for directory in directories:
+                directory = os.path.normpath(directory)
+                if directory not in visited:
+                    visited.add(directory)
+                    key.append(directory)
+            key = tuple(key)
+            self._keys[directories] = key
+        return key
+
+    def getPaths(self, soname, directories):
+        """
+        return the paths of the files named soname in the given directories
+
+        :type soname: string
+        :param soname: the file name to look for
+
+        :type directories: list
+        :param directories: a list of string with the directories to search
+                            in order of precedence (duplicates are ignored)
+
+        :rtype: list
+        :return: a list of paths in the same order of directories
+        """
+        returnList = []
+        for directory in self.getKey(directories):
+            path = self._getListing(directory).get(soname)
+            if path and self._isFile(path):
+                returnList.append(path)
+        return returnList
+
+    def _isFile(self, path):
+        """return True if path is a file, dangling symlinks and symlinks to
+        directories are not"""
+        if path not in self._files:
+            self._files[path] = os.path.isfile(path)
+        return self._files[path]
+
+    def _getListing(self, directory):
+        """return the {entry name: path} dictionary of the given directory"""
+        if directory in self._directories:
+            return self._directories[directory][1]
+        files = {}
+        mtime = None
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+            for entry in os.scandir(directory):
+                try:
+                    # d_type is enough, symlinks are checked by _isFile
+                    if not entry.is_dir(follow_symlinks = False):
+                        files[entry.name] = entry.path
+                except OSError:
+                    pass
+        except OSError:
+            # directories which do not exist are valid entries of a path
+            pass
+        self._directories[directory] = (mtime, files)
+        return files
+
+    def invalidate(self):
+        """
+        remove from the index all the directories whose modification time
+        changed since they were listed, they will be listed again at their
+        next lookup
+
+        :rtype: bool
+        :return: True if at least one directory was removed
+        """
+        removed = set()
+        for directory in list(self._directories.keys()):
+            try:
+                mtime = os.stat(directory).st_mtime_ns
+            except OSError:
+                mtime = None
+            if mtime != self._directories[directory][0]:
+                del self._directories[directory]
+                removed.add(directory)
+        if removed:
+            for path in list(self._files.keys()):
+                if os.path.dirname(path) in removed:
+                    del self._files[path]
+        return bool(removed)
+
+
+_ldSoCache = None
+
+def getLdSoCache():
+    """
+    return the LdSoCache of this system, the cache file is read only once
+    per process
+
+    :rtype: :class:`FingerPrint.loader.LdSoCache`
+    :return: the index of the loader cache
+    """
+    global _ldSoCache
+    if _ldSoCache is None:
+        _ldSoCache = LdSoCache()
+    return _ldSoCache
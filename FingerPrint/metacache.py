@@ -0,0 +1,372 @@
+#!/usr/bin/python
+#
+# LC
+#
+# persistent cache of the metadata extracted from the analysed files, it
+# is shared among different fingerprint runs
+#
+
+import os
+import time
+import pickle
+import logging
+
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+
+logger = logging.getLogger('fingerprint')
+
+
+"""This module implements an on disk cache (a sqlite database) of the
+information extracted from files (parsed ELF headers, checksums, etc.).
+Entries are keyed by (st_dev, st_ino, st_size, st_mtime_ns) of the file
+so that a modified file is analysed again. It also implements the
+checksum cache used by the integrity checks.
+"""
+
+
+# increase this number every time the format of the cached values changes
+# all the old entries will be dropped
+schemaVersion = 2
+
+
+def getDefaultFileName():
+    """
+    :rtype: string
+    :return: the path of the default cache file which is inside
+             $XDG_CACHE_HOME/fingerprint or ~/.cache/fingerprint
+    """
+    cacheHome = os.environ.get("XDG_CACHE_HOME",
+            os.path.join(os.path.expanduser("~"), ".cache"))
+    return os.path.join(cacheHome, "fingerprint", "metadata.sqlite")
+
+
+class MetaCache(object):
+    """
+    On disk cache of the files metadata. Values are pickled and stored in a
+    sqlite database which can be shared by several fingerprint processes
+    running concurrently. Writes are buffered and saved in a single
+    transaction with :meth:`flush`. When the database grows over maxEntries
+    the least recently used entries are evicted.
+
+    Errors accessing the database are logged and they disable the cache,
+    they never stop the analysis.
+
+    :type fileName: string
+    :param fileName: the path of the sqlite database, if None
+                     :func:`getDefaultFileName` is used
+
+    :type maxEntries: int
+    :param maxEntries: the maximum number of entries kept in the database
+    """
+
+    flushInterval = 1000
+    """number of pending writes which triggers a :meth:`flush`"""
+
+    def __init__(self, fileName = None, maxEntries = 200000):
+        if not fileName:
+            fileName = getDefaultFileName()
+        self.fileName = fileName
+        self.maxEntries = maxEntries
+        self.hits = 0
+        self.misses = 0
+        # (key, kind) -> pickled value
+        self._pending = {}
+        # keys of the entries read which need their access time updated
+        self._accessed = set()
+        # number of entries in the database, it is counted at the first
+        # flush and then kept up to date with the inserted entries
+        self._count = None
+        self._db = None
+        if sqlite3 is None:
+            logger.error("Python sqlite3 module not available, cache disabled")
+            return
+        try:
+            dirName = os.path.dirname(fileName)
+            if dirName and not os.path.isdir(dirName):
+                os.makedirs(dirName)
+            self._db = sqlite3.connect(fileName, timeout = 60)
+            self._createSchema()
+        except (sqlite3.Error, OSError) as e:
+            self._disable(e)
+
+    def _createSchema(self):
+        version = self._db.execute("PRAGMA user_version").fetchone()[0]
+        if version != schemaVersion:
+            self._db.execute("DROP TABLE IF EXISTS entries")
+        self._db.execute("CREATE TABLE IF NOT EXISTS entries ("
+                "dev INTEGER, ino INTEGER, size INTEGER, mtime INTEGER, "
+                "kind TEXT, value BLOB, atime REAL, "
+                "PRIMARY KEY (dev, ino, size, mtime, kind))")
+        self._db.execute("CREATE INDEX IF NOT EXISTS entries_atime ON entries (atime)")
+        self._db.execute("PRAGMA user_version = %d" % schemaVersion)
+        self._db.commit()
+
+    def _disable(self, error):
+        logger.error("Unable to use the cache file %s: %s" % (self.fileName, error))
+        if self._db:
+            try:
+                self._db.close()
+            except sqlite3.Error:
+                pass
+        self._db = None
+
+    def isEnabled(self):
+        """
+        :rtype: bool
+        :return: True if the cache database is usable
+        """
+        return self._db is not None
+
+    @staticmethod
+    def _getKey(fileName):
+        """return the cache key of the given file or None if it can not be stat"""
+        try:
+            st = os.stat(fileName)
+        except OSError:
+            return None
+        return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def get(self, fileName, kind):
+        """
+        return the cached value of kind for the given file
+
+        :type fileName: string
+        :param fileName: the path of the file
+
+        :type kind: string
+        :param kind: the type of metadata (e.g. 'ELF' or 'md5')
+
+        :rtype: object
+        :return: the cached value or None if it is not in the cache
+        """
+        if not self._db:
+            return None
+        key = self._getKey(fileName)
+        if key is None:
+            return None
+        data = self._pending.get((key, kind))
+        if data is None:
+            try:
+                row = self._db.execute("SELECT value FROM entries WHERE dev=? "
+                        "AND ino=? AND size=? AND mtime=? AND kind=?",
+                        key + (kind,)).fetchone()
+            except sqlite3.Error as e:
+                self._disable(e)
+                return None
+            if row is None:
+                self.misses += 1
+                return None
+            data = row[0]
+            self._accessed.add(key + (kind,))
+        try:
+            value = pickle.loads(data)
+        except Exception:
+            # corrupted or written by an incompatible version
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def set(self, fileName, kind, value):
+        """
+        store the value of kind for the given file, the value will be
+        written on disk at the next :meth:`flush`
+
+        :type fileName: string
+        :param fileName: the path of the file
+
+        :type kind: string
+        :param kind: the type of metadata (e.g. 'ELF' or 'md5')
+
+        :type value: object
+        :param value: any picklable object
+        """
+        if not self._db:
+            return
+        key = self._getKey(fileName)
+        if key is None:
+            return
+        self._pending[(key, kind)] = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        if len(self._pending) >= self.flushInterval:
+            self.flush()
+
+    def takePending(self):
+        """
+        remove and return the entries which have not been written yet, so
+        that another process can save them with :meth:`merge`. It is used
+        by the prefetching workers which should not write the shared
+        database concurrently.
+
+        :rtype: tuple
+        :return: a tuple with the dictionary of the pending values and the
+                 set of the accessed entries
+        """
+        pending = (self._pending, self._accessed)
+        self._pending = {}
+        self._accessed = set()
+        return pending
+
+    def merge(self, pending):
+        """
+        add to this cache the entries returned by :meth:`takePending` of
+        another cache, they will be written at the next :meth:`flush`.
+        Unlike :meth:`set` it never flushes by itself, so that the caller
+        can save all the merged entries in a single transaction
+
+        :type pending: tuple
+        :param pending: the value returned by :meth:`takePending`
+        """
+        if not self._db:
+            return
+        (values, accessed) = pending
+        self._pending.update(values)
+        self._accessed.update(accessed)
+
+    def flush(self):
+        """
+        write all the pending entries and the access times in a single
+        transaction and evict the least recently used entries if the
+        database is too big
+        """
+        if not self._db or not (self._pending or self._accessed):
+            return
+        now = time.time()
+        try:
+            with self._db:
+                if self._count is None:
+                    self._count = self._countEntries()
+                self._db.executemany("INSERT OR REPLACE INTO entries VALUES "
+                        "(?, ?, ?, ?, ?, ?, ?)",
+                        [key + (kind, data, now) for ((key, kind), data) in
+                            self._pending.items()])
+                self._db.executemany("UPDATE entries SET atime=? WHERE dev=? "
+                        "AND ino=? AND size=? AND mtime=? AND kind=?",
+                        [(now,) + key for key in self._accessed])
+                # replaced entries are counted twice, recount before evicting
+                self._count += len(self._pending)
+                if self._count > self.maxEntries:
+                    self._count = self._countEntries()
+                if self._count > self.maxEntries:
+                    self._db.execute("DELETE FROM entries WHERE rowid IN (SELECT "
+                            "rowid FROM entries ORDER BY atime LIMIT ?)",
+                            (self._count - self.maxEntries,))
+                    self._count = self.maxEntries
+        except sqlite3.Error as e:
+            self._disable(e)
+        self._pending = {}
+        self._accessed = set()
+
+    def _countEntries(self):
+        return self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def close(self):
+        """
+        flush the pending entries and close the database
+        """
+        self.flush()
+        if self._db:
+            logger.debug("Metadata cache %s: %d hits %d misses" %
+                    (self.fileName, self.hits, self.misses))
+            self._db.close()
+            self._db = None
+
+
+class HashCache(object):
+    """
+    Small cache of file checksums saved in a pickle next to a swirl file
+    (the sidecar). Each path is stored with its (st_ino, st_size,
+    st_mtime_ns, st_ctime_ns): if the file still has the same stat the
+    checksum is not computed again.
+
+    The sidecar is replaced atomically by :meth:`save` so concurrent
+    checks never read a partial file, errors reading or writing it are
+    only logged.
+
+    :type fileName: string
+    :param fileName: the path of the sidecar file
+    """
+
+    def __init__(self, fileName):
+        self.fileName = fileName
+        # path -> (kind, stat key, checksum)
+        self._hashes = {}
+        self._dirty = False
+        try:
+            f = open(fileName, 'rb')
+            try:
+                hashes = pickle.load(f)
+            finally:
+                f.close()
+            if isinstance(hashes, dict):
+                self._hashes = hashes
+        except IOError:
+            pass
+        except Exception as e:
+            logger.debug("Ignoring corrupted hash cache %s: %s" % (fileName, e))
+
+    @staticmethod
+    def getKey(path):
+        """
+        :rtype: tuple
+        :return: the stat key of path or None if it can not be stat
+        """
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return (st.st_ino, st.st_size, st.st_mtime_ns, st.st_ctime_ns)
+
+    def get(self, path, kind, key):
+        """
+        return the cached checksum of path
+
+        :type path: string
+        :param path: the path of the file
+
+        :type kind: string
+        :param kind: the type of checksum (algorithm and file type)
+
+        :type key: tuple
+        :param key: the current stat key of path (see :meth:`getKey`)
+
+        :rtype: string
+        :return: the checksum or None if the file changed
+        """
+        entry = self._hashes.get(path)
+        if key is None or entry is None or entry[0] != kind or entry[1] != key:
+            return None
+        return entry[2]
+
+    def set(self, path, kind, key, checksum):
+        """
+        store the checksum of path computed when its stat key was key
+        """
+        if key is None or checksum is None:
+            return
+        self._hashes[path] = (kind, key, checksum)
+        self._dirty = True
+
+    def save(self):
+        """
+        atomically replace the sidecar file if any checksum was added
+        """
+        if not self._dirty:
+            return
+        tmpName = "%s.%d.tmp" % (self.fileName, os.getpid())
+        try:
+            f = open(tmpName, 'wb')
+            try:
+                pickle.dump(self._hashes, f, pickle.HIGHEST_PROTOCOL)
+            finally:
+                f.close()
+            os.replace(tmpName, self.fileName)
+            self._dirty = False
+        except (IOError, OSError) as e:
+            logger.debug("Unable to save the hash cache %s: %s" % (self.fileName, e))
+            try:
+                os.remove(tmpName)
+            except OSError:
+                pass
@@ -0,0 +1,386 @@
+#!/usr/bin/python
+#
+# LC
+#
+# index of the library paths added by the environment modules and cache
+# of the modulefiles, they are built concurrently and saved on disk among
+# runs
+#
+
+import os
+import re
+import stat
+import pickle
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from FingerPrint.utils import getOutputAsList
+from FingerPrint.metacache import getDefaultFileName
+
+logger = logging.getLogger('fingerprint')
+
+
+"""This module runs the 'module' command line to find out which paths each
+environment module adds to the LD_LIBRARY_PATH. The 'module show' commands
+are run by a pool of threads and the result is saved in a pickle which is
+used until one of the MODULEPATH directories is modified. The output of
+'module display' of each modulefile is cached in the same way by
+:class:`ModulefileCache` (used by swirl-modules).
+"""
+
+
+moduleThreads = 8
+"""default number of 'module show' commands run concurrently"""
+
+# Tcl modules: prepend-path LD_LIBRARY_PATH /opt/foo/lib:/opt/bar/lib
+# Lmod: prepend_path("LD_LIBRARY_PATH","/opt/foo/lib")
+_libraryPathRe = re.compile(r'LD_LIBRARY_PATH\W*?[\s,]\s*["\']?([^"\'\s)]+)')
+
+# library with version either after or before .so
+_libVersionRes = [re.compile(r'\.so\.(\d+(\.\d+)*)$'), re.compile(r'-(\d+(\.\d+)*)\.so$')]
+
+
+def getDefaultCacheFileName():
+    """
+    :rtype: string
+    :return: the path of the default module index file which is in the
+             same directory of the metadata cache
+    """
+    return os.path.join(os.path.dirname(getDefaultFileName()), "modules.pickle")
+
+
+def getDefaultDisplayCacheFileName():
+    """
+    :rtype: string
+    :return: the path of the default :class:`ModulefileCache` file which is
+             in the same directory of the metadata cache
+    """
+    return os.path.join(os.path.dirname(getDefaultFileName()), "modulefiles.pickle")
+
+
+def libVersionMatch(name):
+    """
+    :type name: string
+    :param name: a library file name (e.g. libfoo.so.1.2 or libfoo-1.2.so)
+
+    :rtype: :class:`re.Match`
+    :return: the match of the version number of the library name (group
+             1) or None if the name does not contain a version
+    """
+    for versionRe in _libVersionRes:
+        match = versionRe.search(name)
+        if match:
+            return match
+    return None
+
+
+def versionKey(version):
+    """
+    :type version: string
+    :param version: a version made of numbers and dots
+
+    :rtype: tuple
+    :return: a tuple of integers which can be compared with other versions
+    """
+    return tuple([int(i) for i in version.split('.')])
+
+
+def _loadPickle(fileName):
+    """return the object saved in fileName or None if it can not be read"""
+    try:
+        f = open(fileName, 'rb')
+        try:
+            return pickle.load(f)
+        finally:
+            f.close()
+    except IOError:
+        return None
+    except Exception as e:
+        logger.debug("Ignoring corrupted cache %s: %s" % (fileName, e))
+        return None
+
+
+def _savePickle(fileName, data):
+    """atomically replace fileName with the pickle of data"""
+    tmpName = "%s.%d.tmp" % (fileName, os.getpid())
+    try:
+        dirName = os.path.dirname(fileName)
+        if dirName and not os.path.isdir(dirName):
+            os.makedirs(dirName)
+        f = open(tmpName, 'wb')
+        try:
+            pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+        finally:
+            f.close()
+        os.replace(tmpName, fileName)
+    except (IOError, OSError) as e:
+        logger.debug("Unable to save the cache %s: %s" % (fileName, e))
+        try:
+            os.remove(tmpName)
+        except OSError:
+            pass
+
+
+def parseLibraryPaths(lines):
+    """
+    extract the paths added to the LD_LIBRARY_PATH from the output of
+    'module show'
+
+    :type lines: list
+    :param lines: the lines printed by 'module show'
+
+    :rtype: list
+    :return: a list of paths in the order they were found
+    """
+    paths = []
+    for line in lines:
+        match = _libraryPathRe.search(line)
+        if match:
+            paths += [i.strip() for i in match.group(1).split(':') if i.strip()]
+    return paths
+
+
+class ModuleIndex(object):
+    """
+    Maps each available environment module to the list of paths it adds to
+    the LD_LIBRARY_PATH. The index is built with at most width concurrent
+    'module show' commands and it is saved in fileName. The saved index is
+    used as long as the MODULEPATH and the modification times of its
+    directories (and of their sub directories) do not change.
+
+    :type fileName: string
+    :param fileName: the path of the pickle with the index, if None
+                     :func:`getDefaultCacheFileName` is used
+
+    :type width: int
+    :param width: the number of threads, if None :data:`moduleThreads`
+    """
+
+    def __init__(self, fileName = None, width = None):
+        if not fileName:
+            fileName = getDefaultCacheFileName()
+        self.fileName = fileName
+        self.width = width or moduleThreads
+        # module name -> list of paths, None until getLibraryPaths
+        self._paths = None
+
+    @staticmethod
+    def getStamp():
+        """
+        :rtype: tuple
+        :return: the MODULEPATH and the (path, st_mtime_ns) of its
+                 directories and their sub directories, when the stamp
+                 changes the index must be built again
+        """
+        modulePath = os.environ.get("MODULEPATH", "")
+        mtimes = []
+        for directory in modulePath.split(':'):
+            if not directory:
+                continue
+            try:
+                mtimes.append((directory, os.stat(directory).st_mtime_ns))
+                for entry in os.scandir(directory):
+                    if entry.is_dir():
+                        mtimes.append((entry.path, entry.stat().st_mtime_ns))
+            except OSError:
+                mtimes.append((directory, None))
+        return (modulePath, tuple(mtimes))
+
+    def getLibraryPaths(self):
+        """
+        return the index loading it from disk or building it if needed
+
+        :rtype: dict
+        :return: a dictionary module name -> list of library paths (in the
+                 same order of 'module avail') or None if the 'module'
+                 command can not be run
+        """
+        if self._paths is not None:
+            return self._paths
+        stamp = self.getStamp()
+        self._paths = self._load(stamp)
+        if self._paths is None:
+            self._paths = self._build()
+            if self._paths is not None:
+                self._save(stamp)
+        return self._paths
+
+    def _load(self, stamp):
+        """return the saved index if its stamp is still valid"""
+        saved = _loadPickle(self.fileName)
+        if not isinstance(saved, tuple) or len(saved) != 2:
+            return None
+        (savedStamp, paths) = saved
+        if savedStamp != stamp:
+            logger.debug("Module index %s is out of date" % self.fileName)
+            return None
+        return paths
+
+    def _save(self, stamp):
+        """atomically replace the saved index"""
+        _savePickle(self.fileName, (stamp, self._paths))
+
+    @staticmethod
+    def _getModuleNames():
+        """return the list of available modules or None on failure"""
+        (output, retval) = getOutputAsList(["bash", "-c", "module -t avail 2>&1"])
+        if retval:
+            return None
+        names = []
+        for module in output:
+            # in the output there are some paths! remove them e.g. "/opt/module/blabla:"
+            if ':' in module:
+                continue
+            # remove (default)
+            module = module.split("(default)")[0].strip()
+            if module and module not in names:
+                names.append(module)
+        return names
+
+    @staticmethod
+    def _showModule(module):
+        """return the library paths added by module"""
+        # all module which depend on another module return 1 so the
+        # return value is ignored
+        (output, retval) = getOutputAsList(["bash", "-c",
+                "module show " + module + " 2>&1"])
+        return parseLibraryPaths(output)
+
+    def _build(self):
+        """run 'module show' on all the modules with a pool of threads"""
+        names = self._getModuleNames()
+        if names is None:
+            return None
+        logger.debug("Indexing %d modules" % len(names))
+        with ThreadPoolExecutor(self.width) as pool:
+            return dict(zip(names, pool.map(self._showModule, names)))
+
+
+
+class ModulefileCache(object):
+    """
+    Cache of the output of 'module display' of every modulefile found in
+    the MODULEPATH directories and of the listings of the directories the
+    modulefiles refer to. The modulefiles which are new or whose
+    modification time changed are displayed by width concurrent threads
+    and the cache is saved in fileName.
+
+    :type fileName: string
+    :param fileName: the path of the pickle with the cache, if None
+                     :func:`getDefaultDisplayCacheFileName` is used
+
+    :type width: int
+    :param width: the number of threads, if None :data:`moduleThreads`
+    """
+
+    def __init__(self, fileName = None, width = None):
+        if not fileName:
+            fileName = getDefaultDisplayCacheFileName()
+        self.fileName = fileName
+        self.width = width or moduleThreads
+        # module name -> (file path, st_mtime_ns, output of module display)
+        self._texts = {}
+        # directory -> (st_mtime_ns, list of file names)
+        self._directories = {}
+        saved = _loadPickle(fileName)
+        if isinstance(saved, tuple) and len(saved) == 2:
+            (self._texts, self._directories) = saved
+
+    @staticmethod
+    def getModulefiles():
+        """
+        :rtype: list
+        :return: the list of (module name, file path, st_mtime_ns) of the
+                 modulefiles found in the MODULEPATH directories, files
+                 which can not be stat (e.g. dangling symlinks) are skipped
+        """
+        modulefiles = []
+        for directory in os.environ.get("MODULEPATH", "").split(':'):
+            if not directory or not os.path.isdir(directory):
+                continue
+            for subdir in sorted(os.listdir(directory)):
+                subdirPath = os.path.join(directory, subdir)
+                if not os.path.isdir(subdirPath):
+                    continue
+                for fileName in sorted(os.listdir(subdirPath)):
+                    filePath = os.path.join(subdirPath, fileName)
+                    if fileName.startswith('.'):
+                        continue
+                    try:
+                        st = os.stat(filePath)
+                    except OSError as e:
+                        logger.debug("Skipping modulefile %s: %s" % (filePath, e))
+                        continue
+                    if stat.S_ISDIR(st.st_mode):
+                        continue
+                    modulefiles.append((subdir + '/' + fileName, filePath,
+                            st.st_mtime_ns))
+        return modulefiles
+
+    @staticmethod
+    def display(module):
+        """
+        :type module: string
+        :param module: the name of a modulefile
+
+        :rtype: string
+        :return: the output of 'module display' for the given modulefile
+        """
+        (output, retval) = getOutputAsList(["bash", "-c",
+                "module display " + module + " 2>&1"])
+        return '\n'.join(output)
+
+    def getTexts(self):
+        """
+        display the modulefiles which are not in the cache or which were
+        modified and save the cache
+
+        :rtype: dict
+        :return: a dictionary module name -> output of 'module display'
+                 for all the modulefiles of :meth:`getModulefiles`
+        """
+        modulefiles = self.getModulefiles()
+        toDisplay = [name for (name, filePath, mtime) in modulefiles
+                if self._texts.get(name, (None, None))[0:2] != (filePath, mtime)]
+        if toDisplay:
+            logger.debug("Displaying %d modulefiles" % len(toDisplay))
+        with ThreadPoolExecutor(self.width) as pool:
+            displayed = dict(zip(toDisplay, pool.map(self.display, toDisplay)))
+        texts = {}
+        for (name, filePath, mtime) in modulefiles:
+            if name in displayed:
+                texts[name] = (filePath, mtime, displayed[name])
+            else:
+                texts[name] = self._texts[name]
+        self._texts = texts
+        self.save()
+        return dict([(name, texts[name][2]) for name in texts])
+
+    def listDirectory(self, path):
+        """
+        :type path: string
+        :param path: a directory path
+
+        :rtype: list
+        :return: the file names inside the directory path or None if it
+                 does not exist, listings are cached by directory mtime
+        """
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if not stat.S_ISDIR(st.st_mode):
+            return None
+        cached = self._directories.get(path)
+        if cached and cached[0] == st.st_mtime_ns:
+            return cached[1]
+        try:
+            names = os.listdir(path)
+        except OSError:
+            return None
+        self._directories[path] = (st.st_mtime_ns, names)
+        return names
+
+    def save(self):
+        """atomically replace the saved cache"""
+        _savePickle(self.fileName, (self._texts, self._directories))
@@ -0,0 +1,222 @@
+#!/usr/bin/python
+#
+# LC
+#
+# find which installed package owns a file reading the package manager
+# database only once
+#
+
+import os
+import glob
+import logging
+
+from FingerPrint.utils import getOutputAsList
+
+logger = logging.getLogger('fingerprint')
+
+
+"""This module maps file paths to the installed packages which own them.
+Each backend loads the whole package database in memory the first time
+it is used, instead of running rpm -qf or dpkg -S for each file.
+"""
+
+
+class PackageBackend(object):
+    """
+    Base class of the package backends. Subclasses must implement
+    :meth:`_load` which fills :attr:`_owners`.
+    """
+
+    name = None
+    """the name of the package manager"""
+
+    def __init__(self):
+        # path -> package string, None until _load is called
+        self._owners = None
+
+    def getPackage(self, path):
+        """
+        return the package which owns the given path
+
+        :type path: string
+        :param path: an absolute path
+
+        :rtype: string
+        :return: a string with the package name, version and architecture
+                 in the format of the package manager or None if the path
+                 is not owned by any package
+        """
+        if self._owners is None:
+            self._owners = {}
+            self._load()
+            logger.debug("Loaded %d paths from the %s database" %
+                    (len(self._owners), self.name))
+        return self._owners.get(path)
+
+    def _load(self):
+        """load the whole package database in :attr:`_owners`"""
+        raise NotImplementedError()
+
+
+class DpkgBackend(PackageBackend):
+    """
+    It reads the dpkg database directly: the ``info/*.list`` files for the
+    content of each package and the ``status`` file for their versions.
+    Packages are returned as ``dpkg-query -f '${Package} ${Version}
+    ${Architecture}'`` would print them.
+
+    :type dpkgDir: string
+    :param dpkgDir: the dpkg database directory
+    """
+
+    name = "dpkg"
+
+    def __init__(self, dpkgDir = "/var/lib/dpkg"):
+        PackageBackend.__init__(self)
+        self.dpkgDir = dpkgDir
+
+    def _readStatus(self):
+        """
+        :rtype: dict
+        :return: a dictionary with the installed packages indexed by both
+                 name and name:architecture
+        """
+        packages = {}
+        try:
+            f = open(os.path.join(self.dpkgDir, "status"), errors = "replace")
+            content = f.read()
+            f.close()
+        except IOError as e:
+            logger.debug("Unable to read dpkg status: %s" % e)
+            return packages
+        for stanza in content.split("\n\n"):
+            fields = {}
+            for line in stanza.split("\n"):
+                if line and not line[0].isspace() and ':' in line:
+                    (key, value) = line.split(':', 1)
+                    fields[key] = value.strip()
+            if 'Package' not in fields or 'Version' not in fields or \
+                    not fields.get('Status', '').endswith(' installed'):
+                continue
+            package = "%s %s %s" % (fields['Package'], fields['Version'],
+                    fields.get('Architecture', ''))
+            # like dpkg-query the first one wins if only the name is given
+            packages.setdefault(fields['Package'], package)
+            packages[fields['Package'] + ':' + fields.get('Architecture', '')] = package
+        return packages
+
+    def _load(self):
+        packages = self._readStatus()
+        for listFile in sorted(glob.glob(os.path.join(self.dpkgDir, "info", "*.list"))):
+            packageName = os.path.basename(listFile)[:-len(".list")]
+            package = packages.get(packageName)
+            if not package:
+                continue
+            try:
+                f = open(listFile, errors = "replace")
+                for path in f:
+                    self._owners.setdefault(path.rstrip('\n'), package)
+                f.close()
+            except IOError as e:
+                logger.debug("Unable to read %s: %s" % (listFile, e))
+
+
+class RpmBackend(PackageBackend):
+    """
+    It dumps the file list of all the installed packages with a single rpm
+    query. Packages are returned as ``rpm -qf`` would print them
+    (name-version-release.arch).
+
+    The same backend is used by the :class:`FingerPrint.composer.Roller` to
+    search the packages available in the yum repositories.
+    """
+
+    name = "rpm"
+
+    _queryFormat = "[%{FILENAMES}\t%{NAME}-%{VERSION}-%{RELEASE}.%{ARCH}\n]"
+
+    def __init__(self):
+        PackageBackend.__init__(self)
+        self._yumBase = None
+        # dependency -> list of yum packages
+        self._providers = {}
+
+    def _load(self):
+        try:
+            (output, returncode) = getOutputAsList(["rpm", "-qa", "--qf",
+                    self._queryFormat])
+        except OSError as e:
+            logger.debug("Unable to run rpm: %s" % e)
+            return
+        for line in output:
+            if '\t' in line:
+                (path, package) = line.rsplit('\t', 1)
+                self._owners.setdefault(path, package)
+
+    def getRepositoryProviders(self, dependency):
+        """
+        search the packages of the enabled yum repositories which provide
+        the given dependency (a path or a rpm requirement). Results are
+        memoised.
+
+        :type dependency: string
+        :param dependency: a file path or a dependency name
+
+        :rtype: list
+        :return: a list of yum package objects
+        """
+        if dependency not in self._providers:
+            if self._yumBase is None:
+                import yum
+                self._yumBase = yum.YumBase()
+            self._providers[dependency] = \
+                self._yumBase.searchPackageProvides([dependency])
+        return self._providers[dependency]
+
+
+class NullBackend(PackageBackend):
+    """used when the package manager could not be detected"""
+
+    name = "none"
+
+    def _load(self):
+        pass
+
+
+# rpm based OSes
+_rpmOSs = ["red hat", "fedora", "suse", "centos", "scientific linux"]
+# dpkg based OSes
+_dpkgOSs = ["debian",  "ubuntu"]
+
+_backends = {}
+
+def getPackageBackend(name = None):
+    """
+    return the package backend of this system, the backend is created
+    only once per process
+
+    :type name: string
+    :param name: 'rpm' or 'dpkg' to force a backend, if None it is
+                 detected from /etc/issue.net
+
+    :rtype: :class:`PackageBackend`
+    :return: the package backend
+    """
+    if name is None:
+        name = "none"
+        if os.path.exists('/etc/issue.net'):
+            f = open('/etc/issue.net')
+            issues = f.read().lower()
+            f.close()
+            if any(i in issues for i in _rpmOSs):
+                name = "rpm"
+            elif any(i in issues for i in _dpkgOSs):
+                name = "dpkg"
+    if name not in _backends:
+        if name == "rpm":
+            _backends[name] = RpmBackend()
+        elif name == "dpkg":
+            _backends[name] = DpkgBackend()
+        else:
+            _backends[name] = NullBackend()
+    return _backends[name]
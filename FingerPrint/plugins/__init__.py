@@ -65,6 +65,10 @@ class PluginManager(object, metaclass=PluginMount):
     systemPath = []
     """list of string containing the paths we should look for dependencies"""
 
+    metaCache = None
+    """the :class:`FingerPrint.metacache.MetaCache` used by the plugins to
+    store the metadata of the analysed files, None if disabled"""
+
 
     @classmethod
     def addSystemPaths(self, paths):
@@ -77,6 +81,75 @@ class PluginManager(object, metaclass=PluginMount):
         if paths :
             self.systemPath += paths
 
+    @classmethod
+    def setMetaCache(cls, metaCache):
+        """
+        enable the persistent metadata cache for all the plugins
+
+        :type metaCache: :class:`FingerPrint.metacache.MetaCache`
+        :param metaCache: the cache to use or None to disable it
+        """
+        PluginManager.metaCache = metaCache
+
+    @classmethod
+    def getMetadata(cls, fileName, kind, function):
+        """
+        return function(fileName) looking it up first in the metadata
+        cache. Plugins should use this method before analysing a file.
+        Exceptions raised by function are not cached.
+
+        :type fileName: string
+        :param fileName: the path of the file to analyse
+
+        :type kind: string
+        :param kind: the type of metadata returned by function (the
+                     plugin name is a good choice)
+
+        :type function: callable
+        :param function: a function which takes fileName as argument and
+                         returns a picklable object
+
+        :rtype: object
+        :return: the value returned by function
+        """
+        cache = PluginManager.metaCache
+        if cache:
+            value = cache.get(fileName, kind)
+            if value is not None:
+                return value
+        value = function(fileName)
+        if cache and value is not None:
+            cache.set(fileName, kind, value)
+        return value
+
+    @classmethod
+    def prefetch(cls, fileList, jobs):
+        """
+        analyse in parallel the given files and all their static dependencies
+        before they are added to a swirl with :meth:`getSwirl`. This does not
+        change the resulting swirl, it only speeds up its creation.
+
+        :type fileList: list
+        :param fileList: a list of paths to the files that will be added to
+                         the swirl
+
+        :type jobs: int
+        :param jobs: the number of processes to use, with less than 2 this
+                     method does nothing
+        """
+        if not jobs or jobs < 2:
+            return
+        for key, plugin in cls.plugins.items():
+            plugin._prefetch(fileList, jobs)
+
+    @classmethod
+    def _prefetch(cls, fileList, jobs):
+        """
+        plugins can re-implement this method to analyse the given files
+        (see :meth:`prefetch`) with a pool of jobs processes
+        """
+        pass
+
     @classmethod
     def getSwirl(self, fileName, swirl, env = None):
         """
@@ -121,8 +194,8 @@ class PluginManager(object, metaclass=PluginMount):
         swirlFile = swirl.createSwirlFile(fileName)
         if os.path.isfile(fileName) and os.access(fileName, os.X_OK):
             # TODO this should be in his own plugin class
-            f = open(fileName)
-            if f.read(2) == '#!':
+            f = open(fileName, 'rb')
+            if f.read(2) == b'#!':
                 swirlFile.executable = True
             f.close()
         return swirlFile
@@ -152,6 +225,25 @@ class PluginManager(object, metaclass=PluginMount):
         plugin = cls.plugins[dependency.type]
         return plugin.getPathToLibrary(dependency, useCache, rpath)
 
+    @classmethod
+    def invalidateCaches(cls):
+        """
+        drop the library lookups cached by the plugins which may have been
+        changed by a modification of the file system (e.g. a library
+        installed in a directory already scanned). Long running users
+        should call it before reusing the caches.
+        """
+        for key, plugin in cls.plugins.items():
+            plugin._invalidateCaches()
+
+    @classmethod
+    def _invalidateCaches(cls):
+        """
+        plugins can re-implement this method to drop their out of date
+        caches (see :meth:`invalidateCaches`)
+        """
+        pass
+
 
 #
 # now let's import all the plugins aka all the .py file which are inside the
@@ -159,6 +251,7 @@ class PluginManager(object, metaclass=PluginMount):
 #
 
 import pkgutil
+import importlib
 import os
 import sys
 import logging
@@ -169,7 +262,7 @@ logger = logging.getLogger('fingerprint')
 if hasattr(pkgutil,'iter_modules'):              #line added
     for importer, package_name, _ in pkgutil.iter_modules(globals()["__path__"]):
         full_package_name = 'FingerPrint.plugins.%s' % package_name
-        module = importer.find_module(package_name).load_module(full_package_name)
+        module = importlib.import_module(full_package_name)
 else:
     # in python 2.4 pkgutil does not have a iter_modules function :-(
     for pth in globals()["__path__"]:
@@ -6,32 +6,26 @@
 #
 
 import os
-from subprocess import PIPE, Popen
-import io
-import re
 import logging
-import string
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 
 logger = logging.getLogger('fingerprint')
 
 import FingerPrint.utils
+import FingerPrint.sergeant
 from FingerPrint.swirl import SwirlFile, Dependency
 from FingerPrint.plugins import PluginManager
-from FingerPrint.utils import getOutputAsList
+from FingerPrint.loader import getLdSoCache, SearchPath
+from FingerPrint.elffile import ElfFile, ElfFormatError, ET_EXEC, ET_DYN
 
 """This is the implementation for ELF files
-Requirements:
- - /usr/lib/rpm/find-requires /usr/lib/rpm/find-provides from rpm
- - lsconfig in the path
-
 """
 
 
 class ElfPlugin(PluginManager):
     """
-    This plugin manages all ELF file format. This class requires the
-    find-provides and find-requires script present in this folder
-    which require: objdump, awk, sed, grep.
+    This plugin manages all ELF file format. The ELF objects are parsed
+    in process with :class:`FingerPrint.elffile.ElfFile`.
 
     For nicer documentation on this functions see
     :class:`FingerPrint.plugins.PluginManager`
@@ -40,65 +34,302 @@ class ElfPlugin(PluginManager):
     pluginName="ELF"
 
     #internal
-    _ldconfig_64bits = "x86-64"
     _pathCache = {}
-
-    #may in the future we could also use 
-    #objdump -p
-    _RPM_FIND_DEPS=os.path.dirname( globals()["__file__"] ) + "/find-requires"
-    _RPM_FIND_PROV=os.path.dirname( globals()["__file__"] ) + "/find-provides"
+    _searchPath = SearchPath()
+    # realpath -> frozenset of provided dependency names
+    _providesIndex = {}
+    # path -> parsed ElfFile or False if it is not an ELF
+    _elfIndex = {}
 
     @classmethod
     def getPathToLibrary(cls, dependency, useCache = True, rpath = []):
         """ given a dependency it find the path of the library which provides 
-        that dependency """
+        that dependency. Results (also negative ones) are cached by
+        dependency name and search path, so lookups done with different
+        RPATHs or LD_LIBRARY_PATHs do not interfere """
         soname = dependency.getMajor()
-        if useCache and dependency.getName() in cls._pathCache :
-            return cls._pathCache[dependency.getName()]
         #for each library we have in the system
-        pathToScan = cls.systemPath[:] + rpath
+        pathToScan = cls.systemPath + rpath
         if "LD_LIBRARY_PATH" in os.environ:
             #we need to scan the LD_LIBRARY_PATH too
-            pathToScan += os.environ["LD_LIBRARY_PATH"].split(':')
-        # remove duplicate
-        pathToScan = list(set(pathToScan))
-        for path in pathToScan:
-            path = os.path.normpath(path)
-            provider = path + '/' + soname
-            if os.path.isfile(provider) and \
-                cls._checkMinor(provider, dependency.getName()):
+            pathToScan = pathToScan + os.environ["LD_LIBRARY_PATH"].split(':')
+        key = (dependency.getName(), dependency.arch,
+                cls._searchPath.getKey(pathToScan))
+        if useCache and key in cls._pathCache :
+            return cls._pathCache[key]
+        cls._pathCache[key] = cls._findLibrary(dependency, soname, pathToScan)
+        return cls._pathCache[key]
+
+    @classmethod
+    def _invalidateCaches(cls):
+        """drop the lookups of getPathToLibrary if one of the scanned
+        directories changed"""
+        if cls._searchPath.invalidate():
+            cls._pathCache.clear()
+
+    @classmethod
+    def _findLibrary(cls, dependency, soname, pathToScan):
+        """uncached part of :meth:`getPathToLibrary`"""
+        for provider in cls._searchPath.getPaths(soname, pathToScan):
+            if cls._checkMinor(provider, dependency.getName()):
                 #we found the soname and minor are there return true
-                cls._pathCache[dependency.getName()] = provider
                 return provider
-        for line in getOutputAsList(["/sbin/ldconfig","-p"])[0]:
-            # TODO it needs to handle in a better way the hwcap field
-            # if dependency is 64 and library is 64 or
-            # dependency is 32 and library is 32:
-            if len(line) > 0 and soname in line and 'hwcap' not in line and \
-                ( (dependency.is64bits() and cls._ldconfig_64bits in line) or \
-                (dependency.is32bits() and not cls._ldconfig_64bits in line) ):
-                temp = line.split('=>')
-                if len(temp) == 2:
-                    provider=temp[1].strip()
-                    if cls._checkMinor(provider, dependency.getName()):
-                        cls._pathCache[dependency.getName()] = provider
-                        return provider
+        # TODO it needs to handle in a better way the hwcap field
+        for provider in getLdSoCache().getPaths(soname, dependency.arch):
+            if cls._checkMinor(provider, dependency.getName()):
+                return provider
         #the dependency could not be located
         return None
 
 
+    @classmethod
+    def _getProvidesIndex(cls, libPath):
+        """
+        return the set of dependency names (soname and symbol versions)
+        provided by libPath. The set is built only once for each library
+        and it is memoised by realpath.
+
+        :type libPath: string
+        :param libPath: the path to a shared library
+
+        :rtype: frozenset
+        :return: the set of names (see :meth:`FingerPrint.swirl.Dependency.getName`)
+        """
+        realProvider = os.path.realpath(libPath)
+        if realProvider not in cls._providesIndex:
+            try:
+                elf = cls._readElf(realProvider)
+            except IOError:
+                elf = None
+            provides = []
+            if elf:
+                provides = cls._getProvides(elf, realProvider)
+            cls._providesIndex[realProvider] = \
+                frozenset([dep.getName() for dep in provides])
+        return cls._providesIndex[realProvider]
+
+
+    @classmethod
+    def _parseElf(cls, fileName):
+        """return the ElfFile of fileName or False if it is not an ELF"""
+        try:
+            return ElfFile(fileName)
+        except ElfFormatError:
+            return False
+
+
+    @classmethod
+    def _readElf(cls, fileName):
+        """
+        return the parsed ELF object of fileName using the metadata cache
+
+        :type fileName: string
+        :param fileName: the path of the file to read
+
+        :rtype: :class:`FingerPrint.elffile.ElfFile`
+        :return: the ELF object or None if fileName is not an ELF
+        """
+        if fileName not in cls._elfIndex:
+            cls._elfIndex[fileName] = cls.getMetadata(fileName,
+                    cls.pluginName, cls._parseElf)
+        elf = cls._elfIndex[fileName]
+        if not elf:
+            return None
+        # the cache is keyed by inode so the same entry can be shared by
+        # different paths
+        elf.fileName = fileName
+        return elf
+
+
     @classmethod
     def _checkMinor(cls, libPath, depName):
         """ check if libPath provides the depName (major and minor) """
-        realProvider = os.path.realpath(libPath)
-        for line in getOutputAsList(['bash', cls._RPM_FIND_PROV], realProvider)[0]:
-            if len(line) > 0 and depName in line:
-                return True
-        return False
+        return depName in cls._getProvidesIndex(libPath)
+
+
+    @classmethod
+    def _checkVersions(cls, libPath, depNames):
+        """ check if libPath provides all the depNames (e.g. a DT_VERNEED list) """
+        return cls._getProvidesIndex(libPath).issuperset(depNames)
+
+
+    @classmethod
+    def _newDependency(cls, elf, major, minor = ""):
+        """ create a Dependency with the same bitness of the given elf """
+        newDep = Dependency(major, minor)
+        if elf.is64bits():
+            newDep.set64bits()
+        else:
+            newDep.set32bits()
+        return newDep
+
+
+    @classmethod
+    def _getRequires(cls, elf, fileName):
+        """
+        return the list of Dependency required by the given elf sorted by
+        name (same output of the old rpm find-requires script): the DT_NEEDED
+        sonames, the versions in the DT_VERNEED and the dynamic loader
+
+        :type elf: :class:`FingerPrint.elffile.ElfFile`
+        :param elf: the parsed ELF object
+
+        :type fileName: string
+        :param fileName: the path of the ELF object
+
+        :rtype: list
+        :return: a list of :class:`FingerPrint.swirl.Dependency`
+        """
+        if elf.type not in (ET_EXEC, ET_DYN):
+            return []
+        deps = {}
+        for soname in elf.needed:
+            newDep = cls._newDependency(elf, soname)
+            deps[newDep.getName()] = newDep
+        for soname in elf.versionNeeds:
+            for version in elf.versionNeeds[soname]:
+                newDep = cls._newDependency(elf, soname, version)
+                deps[newDep.getName()] = newDep
+        loader = elf.getLoaderName()
+        if loader and loader != elf.soname and os.access(fileName, os.X_OK):
+            newDep = cls._newDependency(elf, loader)
+            deps[newDep.getName()] = newDep
+        return [deps[name] for name in sorted(deps)]
+
+
+    @classmethod
+    def _getProvides(cls, elf, fileName):
+        """
+        return the list of Dependency provided by the given elf sorted by
+        name (same output of the old rpm find-provides script): the
+        DT_SONAME and the versions in the DT_VERDEF
+
+        :type elf: :class:`FingerPrint.elffile.ElfFile`
+        :param elf: the parsed ELF object
+
+        :type fileName: string
+        :param fileName: the path of the ELF object
+
+        :rtype: list
+        :return: a list of :class:`FingerPrint.swirl.Dependency`
+        """
+        if elf.type != ET_DYN or ".so" not in fileName or \
+                fileName.startswith("/lib/ld.so"):
+            return []
+        if not elf.soname:
+            return [cls._newDependency(elf, os.path.basename(fileName))]
+        deps = {}
+        newDep = cls._newDependency(elf, elf.soname)
+        deps[newDep.getName()] = newDep
+        for version in elf.versionDefinitions:
+            newDep = cls._newDependency(elf, elf.soname, version)
+            deps[newDep.getName()] = newDep
+        return [deps[name] for name in sorted(deps)]
+
+
+    @classmethod
+    def _getRpath(cls, elf, fileName):
+        """ return the RPATH (or RUNPATH) of elf as a list with $ORIGIN expanded """
+        rpath = elf.rpath or elf.runpath
+        if not rpath:
+            return []
+        origin = os.path.dirname(fileName)
+        rpath = rpath.replace("${ORIGIN}", origin).replace("$ORIGIN", origin)
+        return rpath.split(":")
+
+
+    @classmethod
+    def _analyse(cls, fileName):
+        """
+        parse fileName and search the libraries it requires. This is the
+        work done by each process of the pool in :meth:`_prefetch`
+
+        :type fileName: string
+        :param fileName: the path of the file to analyse
+
+        :rtype: tuple
+        :return: a tuple with fileName, its ElfFile (or False), the list of
+                 paths of the libraries it requires, the entries added
+                 to the provides index and the new metadata cache entries
+        """
+        known = set(cls._providesIndex)
+        elf = cls._readElf(fileName)
+        providers = []
+        if elf:
+            rpath = cls._getRpath(elf, fileName)
+            for dep in cls._getRequires(elf, fileName):
+                p = cls.getPathToLibrary(dep, useCache = True, rpath = rpath)
+                if p:
+                    providers.append(p)
+        newIndex = dict([(path, cls._providesIndex[path])
+                for path in cls._providesIndex if path not in known])
+        pending = None
+        if cls.metaCache:
+            pending = cls.metaCache.takePending()
+        return (fileName, elf or False, providers, newIndex, pending)
 
 
     @classmethod
-    def _setDepsRequs(cls, swirlFile, swirl):
+    def _prefetch(cls, fileList, jobs):
+        """
+        breadth first scan of the files in fileList and of all the libraries
+        they require using a pool of jobs processes. The parsed ELF objects
+        and the provides index computed by the workers are merged in the
+        indexes of this process, so that the following serial getSwirl
+        does not need to read the files again. The workers only read the
+        metadata cache, the entries they compute are written by this
+        process in a single transaction at the end.
+
+        Only memoised results of pure functions are merged, the swirl built
+        afterward is the same as without prefetching.
+        """
+        cacheFile = None
+        if cls.metaCache:
+            # workers can not share the sqlite connection of this process
+            cls.metaCache.flush()
+            cacheFile = cls.metaCache.fileName
+        seen = set()
+        pending = set()
+        pool = ProcessPoolExecutor(jobs, initializer = _initWorker,
+                initargs = (cls.systemPath, cacheFile))
+
+        def submit(fileName):
+            fileName = os.path.normpath(fileName)
+            if fileName in seen or fileName in cls._elfIndex or \
+                    not os.path.isfile(fileName) or \
+                    FingerPrint.sergeant.is_special_folder(fileName):
+                return
+            seen.add(fileName)
+            pending.add(pool.submit(_analyseWorker, fileName))
+
+        try:
+            for fileName in fileList:
+                submit(fileName)
+            while pending:
+                done, notDone = wait(pending, return_when = FIRST_COMPLETED)
+                pending.difference_update(done)
+                for future in done:
+                    try:
+                        (fileName, elf, providers, newIndex, newEntries) = \
+                                future.result()
+                    except Exception as e:
+                        # the serial scan will report it
+                        logger.debug("Unable to prefetch a file: %s" % e)
+                        continue
+                    cls._elfIndex[fileName] = elf
+                    cls._providesIndex.update(newIndex)
+                    if newEntries and cls.metaCache:
+                        cls.metaCache.merge(newEntries)
+                    for p in providers:
+                        submit(p)
+        finally:
+            pool.shutdown()
+            if cls.metaCache:
+                cls.metaCache.flush()
+
+
+    @classmethod
+    def _setDepsRequs(cls, swirlFile, swirl, elf):
         """
         given a SwirlFile object add all the dependency and all the provides
         to it
@@ -109,38 +340,47 @@ class ElfPlugin(PluginManager):
         :type swirl: :class:`FingerPrint.swirl.Swirl`
         :param swirl: the Swirl that will be used to first lookup already
                           discovered dependencies
+
+        :type elf: :class:`FingerPrint.elffile.ElfFile`
+        :param elf: the parsed ELF object of the swirlFile
         """
 
         # find rpath first
-        rpath = getOutputAsList(["bash","-c", "objdump -x %s |grep RPATH|awk '{print $2}'" % swirlFile.path ])[0]
-        if len( rpath ) > 0:
-            if "$ORIGIN" in rpath[0]:
-                rpath[0] = string.replace(rpath[0], "$ORIGIN", os.path.dirname(swirlFile.path))
-            swirlFile.rpaths = rpath[0].split(":")
-	# check LD_LIBRARY_PATH
-	ld_library = FingerPrint.utils.getLDLibraryPath(swirlFile.env)
+        rpath = cls._getRpath(elf, swirlFile.path)
+        if rpath:
+            swirlFile.rpaths = rpath
+        # check LD_LIBRARY_PATH
+        ld_library = FingerPrint.utils.getLDLibraryPath(swirlFile.env)
 
         #find deps
-        for line in getOutputAsList(['bash', cls._RPM_FIND_DEPS], swirlFile.path)[0]:
-            if len(line) > 0:
-                newDep = Dependency.fromString( line )
-                swirlFile.addDependency( newDep )
-                p = cls.getPathToLibrary( newDep , useCache = True,
-                        rpath = swirlFile.rpaths + ld_library)
-                if not p:
-                    # a dependency was not found complain loudly
-                    logger.error("Unable to find library %s" % newDep)
-                    continue
-                if p and not swirl.isFileTracked(p):
-                    # p not null and p is not already in swirl
-                    cls.getSwirl(p, swirl, swirlFile.env)
-        
+        requires = cls._getRequires(elf, swirlFile.path)
+        # soname -> list of required names (soname and versions)
+        versions = {}
+        for newDep in requires:
+            versions.setdefault(newDep.getMajor(), []).append(newDep.getName())
+        # soname -> library which satisfies all its versions
+        providers = {}
+        for newDep in requires:
+            swirlFile.addDependency( newDep )
+            if newDep.getMajor() in providers:
+                # already satisfied by the provider of the soname
+                continue
+            p = cls.getPathToLibrary( newDep , useCache = True,
+                    rpath = swirlFile.rpaths + ld_library)
+            if not p:
+                # a dependency was not found complain loudly
+                logger.error("Unable to find library %s" % newDep)
+                continue
+            if cls._checkVersions(p, versions[newDep.getMajor()]):
+                providers[newDep.getMajor()] = p
+            if p and not swirl.isFileTracked(p):
+                # p not null and p is not already in swirl
+                cls.getSwirl(p, swirl, swirlFile.env)
+
         #find provides
-        for line in getOutputAsList(['bash', cls._RPM_FIND_PROV], swirlFile.path)[0]:
-            if len(line) > 0 :
-                newProv = Dependency.fromString(line)
-                swirlFile.addProvide(newProv)
-        
+        for newProv in cls._getProvides(elf, swirlFile.path):
+            swirlFile.addProvide(newProv)
+
 
     @classmethod
     def getSwirl(cls, fileName, swirl, env = None):
@@ -150,36 +390,44 @@ class ElfPlugin(PluginManager):
 
         ATT: only one plugin should return a SwirlFile for a given file
         """
-        fd=open(fileName)
-        magic = fd.read(4)
-        if magic == '\x7f\x45\x4c\x46':
-            #it's an elf see specs
-            #http://www.sco.com/developers/gabi/1998-04-29/ch4.eheader.html#elfid
-            swirlFile = swirl.createSwirlFile( fileName )
-            if swirlFile.staticDependencies :
-                # we already did this file, do not do it again
-                return swirlFile
-            swirlFile.setPluginName( cls.pluginName )
-        else:
+        elf = cls._readElf(fileName)
+        if not elf:
             #not an elf
             return None
-        bitness = fd.read(1)
-        if bitness == '\x01':
+        #it's an elf see specs
+        #http://www.sco.com/developers/gabi/1998-04-29/ch4.eheader.html#elfid
+        swirlFile = swirl.createSwirlFile( fileName )
+        if swirlFile.staticDependencies :
+            # we already did this file, do not do it again
+            return swirlFile
+        swirlFile.setPluginName( cls.pluginName )
+        if elf.is32bits():
             swirlFile.set32bits()
-        elif bitness == '\x02':
+        elif elf.is64bits():
             swirlFile.set64bits()
-        fd.seek(11, 1)
-        execness = fd.read(2)
-        if execness == '\x02\x00':
+        if elf.type == ET_EXEC:
             # it is an executable
             swirlFile.executable = True
         else:
             swirlFile.executable = False
         swirlFile.type = 'ELF'
-        fd.close()
         if env:
             swirlFile.env = env
-        cls._setDepsRequs(swirlFile, swirl)
+        cls._setDepsRequs(swirlFile, swirl, elf)
         return swirlFile
 
-       
+
+
+def _initWorker(systemPath, cacheFile):
+    """initialize a process of the pool used by ElfPlugin._prefetch"""
+    PluginManager.systemPath = systemPath
+    if cacheFile:
+        from FingerPrint.metacache import MetaCache
+        PluginManager.setMetaCache(MetaCache(cacheFile))
+    else:
+        PluginManager.setMetaCache(None)
+
+
+def _analyseWorker(fileName):
+    """entry point of the processes used by ElfPlugin._prefetch"""
+    return ElfPlugin._analyse(fileName)
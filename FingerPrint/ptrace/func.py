@@ -103,6 +103,7 @@ PTRACE_O_TRACECLONE     = 0x00000008
 PTRACE_O_TRACEEXEC      = 0x00000010
 PTRACE_O_TRACEVFORKDONE = 0x00000020
 PTRACE_O_TRACEEXIT      = 0x00000040
+PTRACE_O_TRACESECCOMP   = 0x00000080
 
 # Wait extended result codes for the above trace options
 PTRACE_EVENT_FORK       = 1
@@ -111,6 +112,7 @@ PTRACE_EVENT_CLONE      = 3
 PTRACE_EVENT_EXEC       = 4
 PTRACE_EVENT_VFORK_DONE = 5
 PTRACE_EVENT_EXIT       = 6
+PTRACE_EVENT_SECCOMP    = 7
 
 #try:
 #    from cptrace import ptrace as _ptrace
@@ -7,20 +7,16 @@
 # 
 #
 
-import os, string, stat
+import os, string, stat, hashlib, subprocess, struct, time
+from concurrent.futures import ThreadPoolExecutor
 
 from .swirl import Swirl
 from . import utils
 from FingerPrint.plugins import PluginManager
 from FingerPrint.serializer import PickleSerializer
-
-#
-# compatibility with python2.4
-#
-try:
-    from hashlib import md5
-except ImportError:
-    from md5 import md5
+from FingerPrint.metacache import HashCache
+from FingerPrint.elffile import ElfFile, ElfFormatError
+from FingerPrint.modules import ModuleIndex
 
 #
 # compatibility with python2.4
@@ -39,14 +35,93 @@ def readFromPickle(fileName):
     :rtype: :class:`FingerPrint.swirl.Swirl`
     :return: the Swirl read from the file
     """
-    inputfd = open(fileName)
-    pickle = PickleSerializer(inputfd)
-    swirl = pickle.load()
-    inputfd.close()
+    inputfd = open(fileName, 'rb')
+    try:
+        pickle = PickleSerializer(inputfd)
+        swirl = pickle.load()
+    finally:
+        inputfd.close()
     serg = Sergeant(swirl)
     serg.setFilename(fileName)
     return serg
 
+
+def findSwirlFiles(paths):
+    """
+    expand a list of swirl files and directories into a list of swirl files
+
+    :type paths: list
+    :param paths: a list of paths, directories are searched recursively for
+                  files ending with .swirl
+
+    :rtype: list
+    :return: a list of swirl file names, the files found inside each
+             directory are sorted
+    """
+    fileNames = []
+    for path in paths:
+        if not os.path.isdir(path):
+            fileNames.append(path)
+            continue
+        found = []
+        for (dirPath, dirNames, files) in os.walk(path):
+            found += [os.path.join(dirPath, f) for f in files if f.endswith(".swirl")]
+        fileNames += sorted(found)
+    return fileNames
+
+
+def verifySwirls(fileNames, integrity=False, extraPath=None, paranoid=False,
+            width=None):
+    """
+    verify many swirl files in this process, the library resolution caches
+    of the plugins are shared among all the swirls. Results are returned as
+    soon as each swirl is verified.
+
+    :type fileNames: list
+    :param fileNames: a list of swirl file names (see :func:`findSwirlFiles`)
+
+    :type integrity: bool
+    :param integrity: if True the swirls which pass the verification are
+                      also checked with :meth:`Sergeant.checkHash`
+
+    :type extraPath: string
+    :param extraPath: extra paths separated by : (see
+                      :meth:`Sergeant.setExtraPath`)
+
+    :type paranoid: bool
+    :param paranoid: passed to :meth:`Sergeant.checkHash`
+
+    :type width: int
+    :param width: passed to :meth:`Sergeant.checkHash`
+
+    :rtype: generator
+    :return: it yields a dictionary for each swirl with the keys: swirl
+             (the file name), name, check ('verify' or 'integrity'), pass
+             (bool), errors (list of strings) and seconds
+    """
+    for fileName in fileNames:
+        start = time.time()
+        # the directories scanned may have changed since the last swirl
+        PluginManager.invalidateCaches()
+        result = {"swirl": fileName, "name": None, "check": "verify",
+                "pass": False, "errors": []}
+        try:
+            serg = readFromPickle(fileName)
+        except Exception as e:
+            # a broken swirl must not stop the verification of the others
+            result["errors"] = ["unable to read the swirl: %s" % e]
+        else:
+            result["name"] = serg.getSwirl().name
+            if extraPath:
+                serg.setExtraPath(extraPath)
+            result["pass"] = serg.check()
+            if result["pass"] and integrity:
+                result["check"] = "integrity"
+                result["pass"] = serg.checkHash(True, width, paranoid)
+            result["errors"] = sorted(serg.getError())
+        result["seconds"] = round(time.time() - start, 6)
+        yield result
+
 def getShortPath(path):
     """
     Given a full path it shorten it leaving only /bin/../filename
@@ -99,11 +174,103 @@ def is_special_folder(path):
     """
     return any([ path.startswith(i) for i in specialFolders ])
 
-def getHash(fileName, fileType):
+hashChunkSize = 1024 * 1024
+"""size of the blocks read by :func:`getHash`"""
+
+hashThreads = min(8, os.cpu_count() or 1)
+"""default number of threads used by :func:`getHashes`"""
+
+# prelink options which print the checksum of the original file
+_prelinkHashOptions = {"md5": "--md5", "sha1": "--sha"}
+
+def _readHash(fd, algorithm):
+    """return the hexdigest of the content of the file object fd"""
+    md = hashlib.new(algorithm)
+    chunk = fd.read(hashChunkSize)
+    while chunk:
+        md.update(chunk)
+        chunk = fd.read(hashChunkSize)
+    return md.hexdigest()
+
+
+def checksumFile(fileName, algorithm = "md5", fileType = None, elfDigest = "file"):
+    """
+    It return the checksum of the content of the given file as it is on
+    disk (special folders and the prelink command are not taken into
+    account)
+
+    :type fileName: string
+    :param fileName: a path to the file which we want to checksum
+
+    :type algorithm: string
+    :param algorithm: the name of the hashlib algorithm to use
+
+    :type fileType: string
+    :param fileType: the file type, if it is ELF and elfDigest is
+                     "sections" only the sections not modified by prelink
+                     are checksummed
+
+    :type elfDigest: string
+    :param elfDigest: "file" or "sections" (see
+                      :attr:`FingerPrint.swirl.Swirl.elfDigest`)
+
+    :rtype: string
+    :return: an hexdadeciaml representation of the checksum or None if
+             the file can not be read
+    """
+    try:
+        if fileType == 'ELF' and elfDigest == "sections":
+            try:
+                digest = ElfFile(fileName).getStableDigest(algorithm)
+                if digest:
+                    return digest
+            except (ElfFormatError, struct.error):
+                # not a valid ELF let's checksum the whole file
+                pass
+        fd=open(fileName, 'rb')
+        try:
+            return _readHash(fd, algorithm)
+        finally:
+            fd.close()
+    except IOError:
+        #file not found
+        return None
+
+
+def isPrelinked(fileName):
+    """
+    :rtype: bool
+    :return: True if fileName is an ELF file modified by prelink
+    """
+    try:
+        return ElfFile(fileName).isPrelinked()
+    except (ElfFormatError, IOError, struct.error):
+        return False
+
+
+def getHashKind(swirl, fileType, elfDigest = None):
+    """
+    :type elfDigest: string
+    :param elfDigest: how the ELF files are checksummed, if None the
+                      elfDigest of the swirl
+
+    :rtype: string
+    :return: the key used to cache the checksums of the files of fileType
+             computed for swirl (see :class:`FingerPrint.metacache.MetaCache`)
     """
-    It return a md5 checksum of the given file name. If we are running
-    on a system which prelink binaries (aka RedHat based) the command
-    prelink must be on the PATH
+    if fileType == 'ELF':
+        return "%s:%s:%s" % (swirl.hashAlgorithm, elfDigest or swirl.elfDigest,
+                fileType)
+    return "%s:%s" % (swirl.hashAlgorithm, fileType)
+
+
+def getHash(fileName, fileType, algorithm = "md5", elfDigest = "file"):
+    """
+    It return a checksum of the given file name. If elfDigest is "file"
+    and we are running on a system which prelink binaries (aka RedHat
+    based) the command prelink must be on the PATH. With "sections" ELF
+    files are checksummed without running prelink and the checksums are
+    the same on prelinked and non-prelinked systems.
 
     :type fileName: string
     :param fileName: a path to the file which we want to checksum
@@ -112,8 +279,16 @@ def getHash(fileName, fileType):
     :param fileType: the file type (the only recognized value is EFL for
                      triggering the prelink on RHEL base system)
 
+    :type algorithm: string
+    :param algorithm: the name of the hashlib algorithm to use (see
+                      :attr:`FingerPrint.swirl.Swirl.hashAlgorithm`)
+
+    :type elfDigest: string
+    :param elfDigest: "file" or "sections" (see
+                      :attr:`FingerPrint.swirl.Swirl.elfDigest`)
+
     :rtype: string
-    :return: an hexdadeciaml representation of the md5sum checksum
+    :return: an hexdadeciaml representation of the checksum
     """
     # let's skip weird stuff
     if is_special_folder(fileName):
@@ -122,25 +297,59 @@ def getHash(fileName, fileType):
         # probably a socket, fifo, or similar
         return ""
 
-    if fileType == 'ELF' and prelink:
-        #let's use prelink for the md5sum
+    if fileType == 'ELF' and prelink and elfDigest == "file":
+        #let's use prelink for the checksum of the original file
         #TODO what if isPrelink fails
-        (temp, returncode) = utils.getOutputAsList([prelink, '-y', '--md5', fileName])
-        if returncode == 0:
-            return temp[0].split()[0]
+        if algorithm in _prelinkHashOptions:
+            (temp, returncode) = utils.getOutputAsList([prelink, '-y',
+                    _prelinkHashOptions[algorithm], fileName])
+            if returncode == 0:
+                return temp[0].split()[0]
         else:
-            #undoing prelinking failed for some reasons
-            pass
-    try:
-        # ok let's do standard md5sum
-        fd=open(fileName)
-        md=md5()
-        md.update(fd.read())
-        fd.close()
-        return md.hexdigest()
-    except IOError:
-        #file not found
-        return None
+            # prelink -y prints the original file on the stdout
+            proc = subprocess.Popen([prelink, '-y', fileName],
+                    stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+            hash = _readHash(proc.stdout, algorithm)
+            proc.stdout.close()
+            if proc.wait() == 0:
+                return hash
+        #undoing prelinking failed for some reasons
+    # ok let's do standard checksum reading the file in chunks
+    return checksumFile(fileName, algorithm, fileType, elfDigest)
+
+
+def getHashes(fileList, width = None, algorithm = "md5", elfDigest = "file"):
+    """
+    It computes the checksums of a list of files using a pool of threads
+    (see :func:`getHash`)
+
+    :type fileList: list
+    :param fileList: a list of tuples (fileName, fileType) or (fileName,
+                     fileType, elfDigest) to override elfDigest for a file
+
+    :type width: int
+    :param width: the number of threads, if None :data:`hashThreads`
+
+    :type algorithm: string
+    :param algorithm: the name of the hashlib algorithm to use
+
+    :type elfDigest: string
+    :param elfDigest: how ELF files are checksummed ("file" or "sections")
+
+    :rtype: list
+    :return: a list with the checksums in the same order of fileList
+    """
+    if not width:
+        width = hashThreads
+    fileList = [args if len(args) > 2 else tuple(args) + (elfDigest,)
+            for args in fileList]
+    if width < 2 or len(fileList) < 2:
+        return [getHash(fileName, fileType, algorithm, fileDigest)
+                for (fileName, fileType, fileDigest) in fileList]
+    # hashlib and the prelink child processes release the GIL
+    with ThreadPoolExecutor(width) as pool:
+        return list(pool.map(lambda args: getHash(args[0], args[1], algorithm,
+                args[2]), fileList))
 
 
 class Sergeant:
@@ -165,6 +374,7 @@ class Sergeant:
         self.extraPath = extraPath
         self.error = []
         self.missingDeps = set()
+        self.filename = None
 
     def setFilename(self, filename):
         """TODO remove this function"""
@@ -194,7 +404,7 @@ class Sergeant:
         # this method of using rpath is not totaly correct but it's faster
         # so for the moment we have to live with this
         for swF in self.swirl.execedFiles:
-            rpath = swF.rpaths + self.extraPath + utils.getLDLibraryPath(swF.env)
+            rpath = self._getRPath(swF)
             for swf_dep in [swF] + self.swirl.getListSwirlFilesDependentStatic(swF):
                 for dep in swf_dep.staticDependencies:
                     if not PluginManager.getPathToLibrary(dep, rpath = rpath):
@@ -206,23 +416,52 @@ class Sergeant:
                     returnValue = False
         return returnValue
 
-    def checkHash(self, verbose=False):
+    def _getRPath(self, swF):
+        """return the paths searched for the dependencies of the execed
+        SwirlFile swF: its RPATH, the extra paths and its LD_LIBRARY_PATH"""
+        return swF.rpaths + self.extraPath + utils.getLDLibraryPath(swF.env)
+
+    def checkHash(self, verbose=False, width=None, paranoid=False):
         """
         It checks if any dependency was modified since the swirl file creation
-        (using checksumming) 
+        (using checksumming with the algorithm recorded in the swirl)
+
+        Checksums are saved in a sidecar file next to the swirl file
+        (swirl file name plus .hashes) and they are computed again only
+        for the files whose inode, size, mtime or ctime changed.
 
         :type verbose: bool
         :param verbose: if True it will generate more verbose error message
 
+        :type width: int
+        :param width: the number of threads used to compute the checksums
+                      (see :func:`getHashes`)
+
+        :type paranoid: bool
+        :param paranoid: if True all the checksums are computed again
+                         ignoring the sidecar file
+
         :rtype: bool
         :return: True if the check passes False otherwise. The list of
                  modified dependencies can be retrieved with :meth:getError()
         """
         self.error = []
-        pathCache = []
+        pathCache = set()
         returnValue = True
-        for dep in self.swirl.getDependencies():
-            path = PluginManager.getPathToLibrary(dep)
+        # list of (dependency, path, swirlProvider) to checksum
+        toCheck = []
+        # each dependency is resolved with the same paths used by check
+        dependencies = []
+        for swF in self.swirl.execedFiles:
+            rpath = self._getRPath(swF)
+            dependencies += [(dep, rpath) for dep in swF.staticDependencies]
+        depCache = set()
+        for (dep, rpath) in dependencies:
+            # executables with different RPATHs can use different providers
+            if (dep, tuple(rpath)) in depCache:
+                continue
+            depCache.add((dep, tuple(rpath)))
+            path = PluginManager.getPathToLibrary(dep, rpath = rpath)
             if not path:
                 # error `
                 tmpStr = str(dep)
@@ -234,61 +473,83 @@ class Sergeant:
             if path in pathCache:
                 #we already did this file
                 continue
-            hash = getHash(path, dep.type)
-            pathCache.append(path)
-            swirlProvider = self.swirl.getSwirlFileByProv(dep)
+            pathCache.add(path)
+            swirlProvider = self.swirl.getSwirlFileByPath(path)
+            if not swirlProvider or dep not in swirlProvider.provides:
+                swirlProvider = self.swirl.getSwirlFileByProv(dep)
             if not swirlProvider:
                 self.error.append("SwirlFile has unresolved dependency " + str(dep) \
                         + " the hash can not be verified")
                 returnValue = False
+                continue
+            toCheck.append((dep, path, swirlProvider))
+        algorithm = self.swirl.hashAlgorithm
+        hashCache = None
+        if self.filename:
+            hashCache = HashCache(self.filename + ".hashes")
+        hashes = [None] * len(toCheck)
+        keys = [HashCache.getKey(path) for (dep, path, swirlProvider) in toCheck]
+        # the files are checksummed as they were when the swirl was created
+        digests = [self.swirl.getElfDigest(swirlProvider.path)
+                for (dep, path, swirlProvider) in toCheck]
+        kinds = [getHashKind(self.swirl, dep.type, elfDigest) for
+                ((dep, path, swirlProvider), elfDigest) in zip(toCheck, digests)]
+        if hashCache and not paranoid:
+            hashes = [hashCache.get(path, kind, key) for
+                    ((dep, path, swirlProvider), kind, key) in zip(toCheck, kinds, keys)]
+        missing = [i for i in range(len(toCheck)) if hashes[i] is None]
+        newHashes = getHashes([(toCheck[i][1], toCheck[i][0].type, digests[i])
+                for i in missing], width, algorithm)
+        for (i, hash) in zip(missing, newHashes):
+            hashes[i] = hash
+            if hashCache:
+                hashCache.set(toCheck[i][1], kinds[i], keys[i], hash)
+        if hashCache:
+            hashCache.save()
+        for ((dep, path, swirlProvider), hash) in zip(toCheck, hashes):
             if hash != swirlProvider.md5sum :
                 tmpStr = str(dep)
                 if verbose:
-                    tmpStr += " wrong hash (computed " + hash + " originals " + \
-                            swirlProvider.md5sum + ")"
+                    tmpStr += " wrong hash (computed " + str(hash) + " originals " + \
+                            str(swirlProvider.md5sum) + ")"
                 self.error.append(tmpStr)
                 returnValue = False
         return returnValue
 
-    def searchModules(self):
+    def searchModules(self, moduleIndex = None):
         """
         It searches for missing dependencies using the 'module' command line.
         :meth:`check` should be called before this
 
+        :type moduleIndex: :class:`FingerPrint.modules.ModuleIndex`
+        :param moduleIndex: the index of the modules library paths, if None
+                            the default one is used
+
         :rtype: string
         :return: with a human readable list of module which can satisfy
                  missing dependencies
         """
-        # loop through all the modules
-        retDict = {}
-        (output, retval) = utils.getOutputAsList(["bash", "-c", "module -t avail 2>&1"])
-        if retval:
+        if moduleIndex is None:
+            moduleIndex = ModuleIndex()
+        modules = moduleIndex.getLibraryPaths()
+        PluginManager.invalidateCaches()
+        if modules is None:
             print("Unable to run module command, verify it\'s in the path.")
             return ""
-        for module in output :
-            # in the output there are some paths! remove them e.g. "/opt/module/blabla:"
-            if ':' in module:
+        # loop through all the modules
+        retDict = {}
+        for module in modules:
+            path = modules[module]
+            if not path:
                 continue
-            # remove (default)
-            module = module.split("(default)")[0]
-            (output, retval) = utils.getOutputAsList(["bash", "-c",
-                                                "module show " + module + " 2>&1"])
-            if retval:
-                #print "Unable to fetch module information: \'module show " + module + "\'"
-                # all module which depend on another module return 1
-                pass
-            for line in output:
-                if 'LD_LIBRARY_PATH' in line:
-                    # we found another path to scan
-                    path = line.split('LD_LIBRARY_PATH')[1]
-                    path = [i.strip() for i in path.split(":")] #strip
-                    PluginManager.systemPath = path # update path
-                    for dep in self.missingDeps:
-                        if PluginManager.getPathToLibrary(dep, False):
-                            #we found a candidate for this missing dependency
-                            if module not in retDict:
-                                retDict[module] = []
-                            retDict[module].append(dep.getName())
+            for dep in self.missingDeps:
+                # the cache is keyed by search path so modules
+                # with the same paths share the lookups
+                if PluginManager.getPathToLibrary(dep, rpath = path):
+                    #we found a candidate for this missing dependency
+                    if module not in retDict:
+                        retDict[module] = []
+                    retDict[module].append(dep.getName())
         retStr = ""
         for mod in retDict:
             retStr += "  " + mod + " satisfies "
@@ -411,7 +672,7 @@ class Sergeant:
         retString += '    rank=same;\n'
         retString += '    "Execution Domain" [shape=none fontsize=26];\n'
         retString += '    node [shape=hexagon fontsize=16];\n'
-        retString += '    ' + string.join(clusterExec, ';\n    ') + ";\n"
+        retString += '    ' + ';\n    '.join(clusterExec) + ";\n"
         retString += "  }\n"
         # linker section
         retString += '  subgraph cluster_linker {\n'
@@ -420,9 +681,9 @@ class Sergeant:
         retString += '    node [style=filled colorscheme=set312 fontsize=16];\n'
         retString += '    {rank=same;\n'
 
-        retString += '      ' + string.join(clusterSoname, ';\n    ') + ';\n'
+        retString += '      ' + ';\n    '.join(clusterSoname) + ';\n'
         retString += '    }\n    {rank=same;\n'
-        retString += '    ' + string.join(clusterLinker, ';\n    ') + ';\n'
+        retString += '    ' + ';\n    '.join(clusterLinker) + ';\n'
         retString += "    }\n  }\n"
 
         # pakcage section
@@ -430,7 +691,7 @@ class Sergeant:
         retString += '    rank=same;\n'
         retString += '    "Package Domain" [shape=none style="" fontsize=26];\n'
         retString += '    node [shape=box style=filled colorscheme=set312 fontsize=16];\n'
-        retString += '    ' + string.join(clusterPackage, ';\n    ') + ';\n'
+        retString += '    ' + ';\n    '.join(clusterPackage) + ';\n'
         retString += '  }\n'
 
         retString += '  "Execution Domain" -> "Linker Domain" -> "Package Domain" [style=invis];\n'
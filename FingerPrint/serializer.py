@@ -42,7 +42,8 @@ class PickleSerializer:
         :rtype: :class:`FingerPrint.swirl.Swirl`
         :return: the Swirl read from fd
         """
-        return pickle.load(self.fd)
+        # swirls written by python 2 contain byte strings
+        return pickle.load(self.fd, encoding = "latin1")
 
 
 class XmlSerializer:
@@ -172,6 +172,10 @@ trace_method(PyObject *self, PyObject* args)
 {
 
     int pid;
+    // if true stop at the first frame outside the library of the first frame
+    int first_caller_only = 0;
+    const char * first_library = NULL;
+    bool done = false;
     //initialize the buffer
     SFILE buffer;
     buffer.buffer = malloc(50);
@@ -181,11 +185,12 @@ trace_method(PyObject *self, PyObject* args)
     if ( ! buffer.buffer ) 
         perror_msg_and_die("Error allocating memory");
 
-    if (!PyArg_ParseTuple(args, "i", &pid))
+    if (!PyArg_ParseTuple(args, "i|i", &pid, &first_caller_only)) {
+        free(buffer.buffer);
         return NULL;
+    }
 
     int n = 0, ret;
-    char * return_val[MAX_STACK];
 
     unw_word_t ip;
     unw_cursor_t c;
@@ -217,10 +222,14 @@ trace_method(PyObject *self, PyObject* args)
                 unsigned long true_offset;
                 //watch out for binary non relocatable
                 true_offset = ip - cur->start_addr + cur->mmap_offset;
-                return_val[n] = malloc(sizeof(char) * MAX_STRING);
-                if ( ! return_val[n] )
-                    return perror_msg_and_die("Unable to allocate string memory");
                 custom_fprintf(&buffer, "%s:0x%lx:0x%lx\n", cur->binary_filename, true_offset, ip);
+                if (first_caller_only) {
+                    // the caller of the first library is all we need
+                    if ( ! first_library )
+                        first_library = cur->binary_filename;
+                    else if (strcmp(first_library, cur->binary_filename) != 0)
+                        done = true;
+                }
                 break;
             }
             else if (ip < cur->start_addr) {
@@ -237,12 +246,15 @@ trace_method(PyObject *self, PyObject* args)
             /* guard against bad unwind info in old libraries... */
             return perror_msg_and_die("libunwind warning: too deeply nested---assuming bogus unwind\n");
         }
-    } while (ret > 0);
+    } while (ret > 0 && ! done);
 
 
     buffer.buffer[buffer.pos] = '\0';
     PyObject * returnValue = Py_BuildValue("s", buffer.buffer);
     free(buffer.buffer);
+    delete_mmap_cache();
+    _UPT_destroy(libunwind_ui);
+    unw_destroy_addr_space(libunwind_as);
     return returnValue;
 }
 
@@ -251,16 +263,25 @@ trace_method(PyObject *self, PyObject* args)
 
 static PyMethodDef stracktracer_methods[] = {
     {"trace",             trace_method,      METH_VARARGS,
-     "Return the stack of the process specified by the PID."},
+     "Return the stack of the process specified by the PID, if the second "
+     "argument is true stop at the first frame outside the first library."},
     {NULL,              NULL}           /* sentinel */
 };
 
 
-void
-initstacktracer(void)
+static struct PyModuleDef stacktracer_module = {
+    PyModuleDef_HEAD_INIT,
+    "stacktracer",
+    "Backtrace the stack of a traced process with libunwind.",
+    -1,
+    stracktracer_methods
+};
+
+
+PyMODINIT_FUNC
+PyInit_stacktracer(void)
 {
-    PyImport_AddModule("stacktracer");
-    Py_InitModule("stacktracer", stracktracer_methods);
+    return PyModule_Create(&stacktracer_module);
 }
 
 
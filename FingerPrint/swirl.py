@@ -7,7 +7,23 @@
 # 
 
 from datetime import datetime
-import string, os, re
+import string, os, re, sys
+
+
+def _intern(value):
+    """intern value if it is a string, strings like sonames, architectures
+    or package names are repeated in thousands of objects"""
+    if type(value) is str:
+        return sys.intern(value)
+    return value
+
+
+defaultHashAlgorithm = "blake2b"
+"""the digest algorithm used for the checksums of new swirls"""
+
+defaultElfDigest = "file"
+"""how the ELF files of new swirls are checksummed (see
+:attr:`Swirl.elfDigest`)"""
 
 
 class Swirl(object):
@@ -21,10 +37,39 @@ class Swirl(object):
 
     :type creationDate: :class:`datetime.datetime`
     :param creationDate: the creation time of this Swirl
+
+    :type hashAlgorithm: string
+    :param hashAlgorithm: the name of the hashlib algorithm used for the
+                          checksums of the SwirlFiles, if None
+                          :data:`defaultHashAlgorithm` is used
+
+    :type elfDigest: string
+    :param elfDigest: how ELF files are checksummed (see :attr:`elfDigest`),
+                      if None :data:`defaultElfDigest` is used
     """
-    def __init__(self, name, creationDate):
+
+    hashAlgorithm = "md5"
+    """swirls saved by older versions do not have this attribute, their
+    checksums are all md5"""
+
+    elfDigest = "file"
+    """what is checksummed for ELF files: "file" for the whole file (after
+    undoing prelink where prelink is installed) like older versions did, or
+    "sections" for the sections which are not modified by prelink (see
+    :meth:`FingerPrint.elffile.ElfFile.getStableDigest`)"""
+
+    sectionDigests = frozenset()
+    """paths of the ELF files which were already prelinked when the swirl
+    was created: they are checksummed with their sections even if
+    elfDigest is "file" (swirls saved by older versions do not have this
+    attribute)"""
+
+    def __init__(self, name, creationDate, hashAlgorithm = None, elfDigest = None):
         self.name = name
         self.creationDate = creationDate
+        self.hashAlgorithm = hashAlgorithm or defaultHashAlgorithm
+        self.elfDigest = elfDigest or defaultElfDigest
+        self.sectionDigests = set()
         # list of file tracked
         self.swirlFiles = []
         # files used to track this project
@@ -32,6 +77,95 @@ class Swirl(object):
         # command line used for dynamic tracing
         self.cmdLine = None
         self.ldconf_paths = []
+        # indexes (not pickled) see _getIndexes
+        self._pathIndex = None
+        self._provIndex = None
+        # SwirlFile.path -> list of static dependencies (not pickled)
+        self._closureCache = {}
+
+
+    def __getstate__(self):
+        """the indexes are not saved, they are rebuilt when needed"""
+        state = self.__dict__.copy()
+        state.pop('_pathIndex', None)
+        state.pop('_provIndex', None)
+        state.pop('_closureCache', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._pathIndex = None
+        self._provIndex = None
+        self._closureCache = {}
+
+    def getElfDigest(self, path):
+        """
+        :type path: string
+        :param path: the path of an ELF SwirlFile of this swirl
+
+        :rtype: string
+        :return: how the file is checksummed, "file" or "sections" (see
+                 :attr:`elfDigest` and :attr:`sectionDigests`)
+        """
+        if self.elfDigest == "sections" or path in self.sectionDigests:
+            return "sections"
+        return "file"
+
+    def _getIndexes(self):
+        """
+        return the indexes of this swirl building them if needed (e.g.
+        after it was loaded from a pickle)
+
+        :rtype: tuple
+        :return: a tuple with a dictionary path (or link) -> SwirlFile and
+                 a dictionary Dependency -> SwirlFile which provides it
+        """
+        if self._pathIndex is None or self._provIndex is None:
+            self._pathIndex = {}
+            self._provIndex = {}
+            for swirlFile in self.swirlFiles:
+                self._indexSwirlFile(swirlFile)
+        return (self._pathIndex, self._provIndex)
+
+    def _indexSwirlFile(self, swirlFile):
+        """add the swirlFile to the indexes"""
+        swirlFile._swirl = self
+        self._indexPath(swirlFile, swirlFile.path)
+        self._indexLinks(swirlFile, swirlFile.links)
+        # swirlFile is the last one indexed so it can not take precedence
+        self._indexProvides(swirlFile, swirlFile.provides, True)
+
+    def _indexPath(self, swirlFile, path):
+        if self._pathIndex is not None:
+            # the real path of a file has precedence over the links
+            self._pathIndex[path] = swirlFile
+
+    def _indexLinks(self, swirlFile, links):
+        if self._pathIndex is not None:
+            for link in links:
+                self._pathIndex.setdefault(link, swirlFile)
+
+    def _invalidateClosures(self):
+        """called every time dependencies or provides change"""
+        self._closureCache = {}
+
+    def _position(self, swirlFile):
+        """position of swirlFile in self.swirlFiles (compared by identity)"""
+        for (i, swF) in enumerate(self.swirlFiles):
+            if swF is swirlFile:
+                return i
+        return len(self.swirlFiles)
+
+    def _indexProvides(self, swirlFile, provides, last = False):
+        self._invalidateClosures()
+        if self._provIndex is None:
+            return
+        for dependency in provides:
+            provider = self._provIndex.setdefault(dependency, swirlFile)
+            if provider is not swirlFile and not last and \
+                    self._position(swirlFile) < self._position(provider):
+                # the first SwirlFile of the list wins like in a linear scan
+                self._provIndex[dependency] = swirlFile
 
 
     def isFileTracked(self, fileName):
@@ -44,10 +178,7 @@ class Swirl(object):
         :rtype: bool
         :return: true if fileName is tracked by this swirl
         """
-        for f in self.swirlFiles:
-            if fileName in f.getPaths():
-                return True
-        return False
+        return fileName in self._getIndexes()[0]
 
 
     def createSwirlFile(self, fileName):
@@ -68,15 +199,27 @@ class Swirl(object):
                 p = os.path.join( os.path.dirname(fileName), p)
             links.append(os.path.normpath(fileName))
             fileName = os.path.normpath(p)
-        for swirlFile in self.swirlFiles:
-            if swirlFile.path == fileName:
-                #we found it
-                swirlFile.setLinks(links)
-                return swirlFile
+        swirlFile = self._getIndexes()[0].get(fileName)
+        if swirlFile and swirlFile.path == fileName:
+            #we found it
+            swirlFile.setLinks(links)
+            return swirlFile
         swirlFile = SwirlFile(fileName, links)
         self.swirlFiles.append(swirlFile)
+        self._indexSwirlFile(swirlFile)
+        self._invalidateClosures()
         return swirlFile
 
+    def getSwirlFileByPath(self, fileName):
+        """
+        :type fileName: string
+        :param fileName: the path (or one of the links) of a file
+
+        :rtype: :class:`FingerPrint.swirl.SwirlFile`
+        :return: the SwirlFile which tracks fileName or None
+        """
+        return self._getIndexes()[0].get(fileName)
+
     def getSwirlFileByProv(self, dependency):
         """
         find the swirl file which provides the given dependency
@@ -88,10 +231,7 @@ class Swirl(object):
         :return: a SwirlFile which provides the given dependency None if it
                  could not be found
         """
-        for swF in self.swirlFiles:
-            if dependency in swF.provides :
-                return swF
-        return None
+        return self._getIndexes()[1].get(dependency)
 
     def _get_all_rpaths(self):
         """ TODO unused """
@@ -149,6 +289,8 @@ class Swirl(object):
         loader start program 'a' which depend on lib 'b' which in its turn depends on
         lib 'c', the loader will load a, b, and c at the same time).  
 
+        Results are cached until the dependencies or the provides of any
+        SwirlFile of this Swirl change.
 
         :type swirlFile: :class:`FingerPrint.swirl.SwirlFile`
         :param swirlFile: a swirlFile which is part of this Swirl
@@ -157,27 +299,60 @@ class Swirl(object):
         :return: a list of :class:`FingerPrint.swirl.SwirlFile` which 
                  are all the static dependencies of the input swirlFile
         """
-        returnList = []
-        provides = set()
-
-        # verifySubDepList list of deps we need to verify in this loop
-        verifySubDepList = [swirlFile]
-        # new verifySubDepList list of deps we need to verify in the next loop
-        newVerifySubDepList = []
-        while verifySubDepList :
-            # I need another temporary list to accumulate the new dependency
-            for swF in verifySubDepList:
-                if not set(swF.staticDependencies).issubset( provides ):
-                    # we found an unmet dependency
-                    newDeps = self.getListSwirlFileProvide(swF.staticDependencies, returnList )
-                    # add the new dependencies to the return list and to the list for the new loop
-                    returnList += newDeps
-                    newVerifySubDepList += newDeps
-                    for newDep in newDeps:
-                        provides |= set(newDep.provides)
-            verifySubDepList = newVerifySubDepList
-            newVerifySubDepList = []
-        return returnList
+        if swirlFile.path not in self._closureCache:
+            self._getClosure(swirlFile, {}, [])
+        # callers are free to modify the returned list
+        return list(self._closureCache[swirlFile.path])
+
+
+    def _getClosure(self, swirlFile, visiting, stack):
+        """
+        depth first computation of the static closure of swirlFile which
+        reuses the closures already computed for its dependencies. The
+        direct dependencies come first followed by the closures of each of
+        them.
+
+        Dependency cycles (e.g. libc and the loader) are handled like in
+        the Tarjan algorithm: the closure of a SwirlFile which is part of
+        a cycle is complete, and hence cached, only if that SwirlFile is
+        the first of the cycle visited.
+
+        :type visiting: dict
+        :param visiting: SwirlFile.path -> position in the stack of the
+                         SwirlFiles being visited
+
+        :type stack: list
+        :param stack: SwirlFiles being visited
+
+        :rtype: tuple
+        :return: the closure of swirlFile and the lowest stack position of
+                 a SwirlFile being visited reachable from swirlFile
+        """
+        if swirlFile.path in self._closureCache:
+            return (self._closureCache[swirlFile.path], len(stack))
+        position = len(stack)
+        visiting[swirlFile.path] = position
+        stack.append(swirlFile)
+        lowLink = position
+        direct = self.getListSwirlFileProvide(swirlFile.staticDependencies)
+        returnList = list(direct)
+        seen = set([swF.path for swF in returnList])
+        for swF in direct:
+            if swF.path in visiting:
+                # cycle, swF is already taking care of its dependencies
+                lowLink = min(lowLink, visiting[swF.path])
+                continue
+            (closure, subLowLink) = self._getClosure(swF, visiting, stack)
+            lowLink = min(lowLink, subLowLink)
+            for dep in closure:
+                if dep.path not in seen:
+                    seen.add(dep.path)
+                    returnList.append(dep)
+        stack.pop()
+        del visiting[swirlFile.path]
+        if lowLink == position:
+            self._closureCache[swirlFile.path] = returnList
+        return (returnList, lowLink)
 
 
     def getListSwirlFileProvide(self, dependencies, excludeSwirlFile=[]):
@@ -247,6 +422,12 @@ class Swirl(object):
                 retStr += " Command line: " + self.cmdLine + "\n"
             if self.ldconf_paths :
                 retStr += " ls.so.conf path list:\n  " + '\n  '.join(self.ldconf_paths) + '\n'
+        if verbosity > 1:
+            retStr += " Checksum algorithm: " + self.hashAlgorithm + " (ELF " + \
+                    self.elfDigest
+            if self.sectionDigests:
+                retStr += ", sections for %d prelinked files" % len(self.sectionDigests)
+            retStr += ")\n"
         #file list
         retStr += " -- File List -- \n"
         for swF in self.execedFiles:
@@ -272,12 +453,44 @@ class Swirl(object):
         return retStr
 
 
-class Arch:
-    """ old style classes for backward compability"""
+class Arch(object):
+    """
+    Base class of SwirlFile and Dependency which holds the architecture.
+
+    Subclasses use __slots__ to keep their instances small. They are
+    pickled as a dictionary of attributes, like the __dict__ of the
+    original classes, so that swirl files written by older versions can
+    still be read and vice versa. The attributes listed in
+    :attr:`_stateSlots` are the one saved.
+    """
+
+    __slots__ = ('arch',)
+
+    _stateSlots = ('arch',)
 
     def __init__(self):
         self.arch = None
 
+    def __getstate__(self):
+        state = {}
+        for name in self._stateSlots:
+            if hasattr(self, name):
+                state[name] = getattr(self, name)
+        return state
+
+    def __setstate__(self, state):
+        if isinstance(state, tuple):
+            # (__dict__, slots) generated by the default protocol
+            newState = {}
+            for part in state:
+                if part:
+                    newState.update(part)
+            state = newState
+        for name, value in state.items():
+            if name in self._stateSlots:
+                # attributes of unknown versions are dropped
+                setattr(self, name, _intern(value))
+
     #this function are used by SwirlFile and Dependency
     def set64bits(self):
         """set 64 bit architecture"""
@@ -304,7 +517,11 @@ class Arch:
         # so I can do if depA in depList:
         if other is None:
             return False
-        return self.__dict__ == other.__dict__
+        if self is other:
+            return True
+        if not isinstance(other, Arch):
+            return False
+        return self.__getstate__() == other.__getstate__()
 
 
 class SwirlFile(Arch):
@@ -326,12 +543,18 @@ class SwirlFile(Arch):
                   to this SwirlFile
 
     """
+    __slots__ = ('path', 'links', 'staticDependencies', 'provides',
+            'dynamicDependencies', 'openedFiles', 'rpaths', 'md5sum',
+            'package', 'env', 'type', 'executable', '_swirl')
+
+    _stateSlots = Arch._stateSlots + __slots__[:-1]
+
     def __init__(self, path, links):
         """create a swirl file starting from a file name"""
         Arch.__init__(self)
-        self.path=path
+        self.path=_intern(path)
         #symbolic links
-        self.links=links
+        self.links=[_intern(link) for link in links]
         # list of Dependency this file depend on
         self.staticDependencies=[]
         # list of Dependency that this file provides
@@ -343,6 +566,9 @@ class SwirlFile(Arch):
         # shared libs
         self.openedFiles={}
         self.rpaths = []
+        # the checksum of the file computed with the hashAlgorithm and the
+        # elfDigest of the swirl (the name is kept for compatibility with
+        # old swirls)
         self.md5sum = None
         self.package = None
         # a reduced set of environment variables
@@ -350,6 +576,14 @@ class SwirlFile(Arch):
         # by default all files are data files (aka unknown type)
         self.type = "Data"
         self.executable = False
+        # the Swirl which indexes this SwirlFile (not pickled)
+        self._swirl = None
+
+    def __setstate__(self, state):
+        SwirlFile.__init__(self, None, [])
+        Arch.__setstate__(self, state)
+        self.links = [_intern(link) for link in self.links]
+        self.env = [_intern(var) for var in self.env]
 
     def isLoader(self):
         """
@@ -389,7 +623,9 @@ class SwirlFile(Arch):
         """
         for link in links:
             if link not in self.links:
-                self.links.append(link)
+                self.links.append(_intern(link))
+        if self._swirl:
+            self._swirl._indexLinks(self, links)
 
     def addDependency(self, dependency):
         """if dependency is not already in the static dependency of this swirl file it
@@ -403,6 +639,8 @@ class SwirlFile(Arch):
         else:
             dependency.type = self.type
             self.staticDependencies.append(dependency)
+            if self._swirl:
+                self._swirl._invalidateClosures()
 
     def addProvide(self, dependency):
         """
@@ -416,6 +654,8 @@ class SwirlFile(Arch):
         else:
             dependency.type = self.type
             self.provides.append(dependency)
+            if self._swirl:
+                self._swirl._indexProvides(self, [dependency])
 
     def isELFExecutable(self):
         """
@@ -520,8 +760,8 @@ class SwirlFile(Arch):
             for e in self.env:
                 retString += separator + "    " + e + "\n"
         if self.type not in "Data":
-            retString += separator + "    Deps: " + string.join(list(self.getDependenciesDict().keys()), ', ') + "\n"
-            retString += separator + "    Provs: " + string.join(list(self.getProvidesDict().keys()), ', ') + "\n"
+            retString += separator + "    Deps: " + ', '.join(list(self.getDependenciesDict().keys())) + "\n"
+            retString += separator + "    Provs: " + ', '.join(list(self.getProvidesDict().keys())) + "\n"
         return retString
 
 
@@ -579,15 +819,19 @@ class Dependency(Arch):
                   instruction set
     """
 
+    __slots__ = ('major', 'minor', 'hwcap', 'type')
+
+    _stateSlots = Arch._stateSlots + __slots__
+
     def __init__(self, major, minor = None, hwcap=None):
         Arch.__init__(self)
         # string representing the main dependency
         # for elf is the soname of the binary path
-        self.major = major
+        self.major = _intern(major)
         # a list of version supported by this dependency
         # for elf this is the simobl versions
         # http://tldp.org/HOWTO/Program-Library-HOWTO/miscellaneous.html#VERSION-SCRIPTS
-        self.minor = minor
+        self.minor = _intern(minor)
         # hwcap (shouldn't this be part of swirlfile)
         self.hwcap = hwcap
         # the type of this dependency for the moment is the same as the type of the 
@@ -597,11 +841,10 @@ class Dependency(Arch):
     @classmethod
     def fromString(cls, string):
         """
-        Create a dependency from a string returned by find-require find-provide
+        Create a dependency from a string in the format returned by getName
 
         :type string: string
-        :param string: a line of output from the FingerPrint/plugin/find-requires
-                       or FingerPrint/plugin/find-provides
+        :param string: a string in the format soname(minor_version)(arch)
 
         :rtype: :class:`FingerPrint.swirl.Dependency`
         :return: a new instance of Dependency which represent the given input
@@ -655,7 +898,7 @@ class Dependency(Arch):
     def getName(self):
         """
         return a string representation of this dependency which is the
-        same format used by the find-require find-provides (e.g.
+        same format used by the rpm find-requires find-provides (e.g.
         soname(minor_version)(arch)
 
         :rtype: string
@@ -668,6 +911,19 @@ class Dependency(Arch):
             retString += "(64bit)"
         return retString
 
+    def __setstate__(self, state):
+        Dependency.__init__(self, None)
+        Arch.__setstate__(self, state)
+
+    def __eq__(self, other):
+        # faster than comparing the whole state, it is called for every
+        # lookup in the lists of dependencies
+        if other is None or not isinstance(other, Dependency):
+            return False
+        return self.major == other.major and self.minor == other.minor and \
+            self.arch == other.arch and self.type == other.type and \
+            self.hwcap == other.hwcap
+
     def __hash__(self):
         return hash(str(self.arch) + str(self.major) + str(self.minor) + str(self.hwcap))
 
@@ -9,21 +9,361 @@
 
 import FingerPrint.blotter
 import FingerPrint.utils
-import FingerPrint.sergeant
-
-import tempfile
-import os, signal, re
+import FingerPrint.ptrace.cpu_info
+from FingerPrint.elffile import ElfFile, ElfFormatError, PF_X
+
+import bisect
+import collections
+import json
+import mmap
+import time
+import os, signal, errno, stat, struct
+import ctypes
 import logging
 
 logger = logging.getLogger('fingerprint')
 
 
+class _iovec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p), ("iov_len", ctypes.c_size_t)]
+
+class _sockFilter(ctypes.Structure):
+    _fields_ = [("code", ctypes.c_ushort), ("jt", ctypes.c_ubyte),
+            ("jf", ctypes.c_ubyte), ("k", ctypes.c_uint)]
+
+class _sockFprog(ctypes.Structure):
+    _fields_ = [("len", ctypes.c_ushort), ("filter", ctypes.POINTER(_sockFilter))]
+
+try:
+    _libc = ctypes.CDLL(None, use_errno=True)
+except OSError:
+    _libc = None
+
+try:
+    _process_vm_readv = _libc.process_vm_readv
+    _process_vm_readv.argtypes = [ctypes.c_int, ctypes.POINTER(_iovec),
+            ctypes.c_ulong, ctypes.POINTER(_iovec), ctypes.c_ulong, ctypes.c_ulong]
+    _process_vm_readv.restype = ctypes.c_ssize_t
+except AttributeError:
+    # old glibc (< 2.15)
+    _process_vm_readv = None
+
+try:
+    _prctl = _libc.prctl
+    _prctl.argtypes = [ctypes.c_int, ctypes.c_ulong, ctypes.c_ulong,
+            ctypes.c_ulong, ctypes.c_ulong]
+    _prctl.restype = ctypes.c_int
+except AttributeError:
+    _prctl = None
+
+
+# system calls handled by the tracer
+# taken from linux src arch/x86/syscalls/syscall_[32|64].tbl
+if FingerPrint.ptrace.cpu_info.CPU_X86_64:
+    _auditArch = 0xc000003e # AUDIT_ARCH_X86_64
+    _openSyscalls = (2,)
+    _openatSyscalls = (257,)
+    _mmapSyscalls = (9,)
+elif FingerPrint.ptrace.cpu_info.CPU_I386:
+    _auditArch = 0x40000003 # AUDIT_ARCH_I386
+    _openSyscalls = (5,)
+    _openatSyscalls = (295,)
+    # mmap and mmap2
+    _mmapSyscalls = (90, 192)
+else:
+    _auditArch = None
+    _openSyscalls = _openatSyscalls = _mmapSyscalls = ()
+
+tracedSyscalls = _openSyscalls + _openatSyscalls + _mmapSyscalls
+"""numbers of the system calls handled by :class:`SyscallTracer`"""
+
+# linux/filter.h and linux/seccomp.h
+_BPF_LD_W_ABS = 0x20
+_BPF_JEQ_K = 0x15
+_BPF_RET_K = 0x06
+_SECCOMP_RET_ALLOW = 0x7fff0000
+_SECCOMP_RET_TRACE = 0x7ff00000
+_PR_SET_SECCOMP = 22
+_PR_SET_NO_NEW_PRIVS = 38
+_SECCOMP_MODE_FILTER = 2
+_AT_FDCWD = -100
+# sys/mman.h
+_PROT_EXEC = 0x4
+_MAP_ANONYMOUS = 0x20
+
+
+def getSeccompFilter(syscalls):
+    """
+    build a seccomp BPF program which returns SECCOMP_RET_TRACE for the
+    given system calls and SECCOMP_RET_ALLOW for all the others (and for
+    the system calls of a different architecture, e.g. 32bit binaries on
+    a 64bit kernel)
+
+    :type syscalls: list
+    :param syscalls: the numbers of the system calls to trace
+
+    :rtype: list
+    :return: a list of (code, jt, jf, k) BPF instructions
+    """
+    count = len(syscalls)
+    # struct seccomp_data { int nr; __u32 arch; ... }
+    program = [(_BPF_LD_W_ABS, 0, 0, 4),
+            (_BPF_JEQ_K, 0, count + 1, _auditArch),
+            (_BPF_LD_W_ABS, 0, 0, 0)]
+    for i, number in enumerate(syscalls):
+        # jump to the last instruction
+        program.append((_BPF_JEQ_K, count - i, 0, number))
+    program.append((_BPF_RET_K, 0, 0, _SECCOMP_RET_ALLOW))
+    program.append((_BPF_RET_K, 0, 0, _SECCOMP_RET_TRACE))
+    return program
+
+
+def installSeccompFilter(syscalls):
+    """
+    install in the current process the filter returned by
+    :func:`getSeccompFilter`, it is inherited by all the children and it
+    survives exec. Once the filter is installed, if the process is not traced
+    with PTRACE_O_TRACESECCOMP, the given system calls fail with ENOSYS.
+
+    :type syscalls: list
+    :param syscalls: the numbers of the system calls to trace
+
+    :rtype: bool
+    :return: False if the filter could not be installed (e.g. the kernel is
+             older than 3.5)
+    """
+    if _prctl is None or _auditArch is None:
+        return False
+    program = getSeccompFilter(syscalls)
+    filters = (_sockFilter * len(program))(*program)
+    fprog = _sockFprog(len(program), filters)
+    # unprivileged processes can install a filter only with no_new_privs
+    if _prctl(_PR_SET_NO_NEW_PRIVS, 1, 0, 0, 0) != 0:
+        return False
+    return _prctl(_PR_SET_SECCOMP, _SECCOMP_MODE_FILTER,
+            ctypes.addressof(fprog), 0, 0) == 0
+
+
+def _getSyscallRegisters(regs):
+    """
+    :rtype: tuple
+    :return: the system call number, its first two arguments and its return
+             value (valid only at the syscall exit) from the given registers
+    """
+    if FingerPrint.ptrace.cpu_info.CPU_X86_64:
+        return (regs.orig_rax, regs.rdi, regs.rsi, regs.rax)
+    else:
+        return (regs.orig_eax, regs.ebx, regs.ecx, regs.eax)
+
+
+def _getMmapArguments(regs):
+    """
+    :rtype: tuple
+    :return: the prot, flags and fd arguments of mmap from the given
+             registers or None if they are not passed in registers (old_mmap
+             on 32bit)
+    """
+    if FingerPrint.ptrace.cpu_info.CPU_X86_64:
+        (prot, flags, fd) = (regs.rdx, regs.r10, regs.r8)
+    elif regs.orig_eax == 192:
+        # mmap2
+        (prot, flags, fd) = (regs.edx, regs.esi, regs.edi)
+    else:
+        return None
+    return (prot, flags, ctypes.c_int(fd).value)
+
+
+class ProcessMemory(object):
+    """
+    It reads the memory of a traced process. It uses the process_vm_readv
+    system call (one call for each page) and it falls back to reading
+    /proc/PID/mem, which is opened only once, if process_vm_readv is not
+    available.
+
+    :type pid: int
+    :param pid: the PID of the process
+    """
+
+    pageSize = 4096
+    """reads never cross a page boundary, the next page might not be mapped"""
+
+    maxStringLength = 4096 * 4
+    """strings longer than this are truncated (PATH_MAX is 4096)"""
+
+    useProcessVmReadv = _process_vm_readv is not None
+    """set to False the first time process_vm_readv is not supported"""
+
+    def __init__(self, pid):
+        self.pid = pid
+        self._mem = None
+        self._buffer = ctypes.create_string_buffer(self.pageSize)
+
+    def read(self, address, size):
+        """
+        read at most size bytes at address, the read stops at the end of
+        the page containing address
+
+        :rtype: bytes
+        :return: the bytes read (an empty string if address is not mapped)
+        """
+        size = min(size, self.pageSize - address % self.pageSize)
+        if ProcessMemory.useProcessVmReadv:
+            local = _iovec(ctypes.cast(self._buffer, ctypes.c_void_p), size)
+            remote = _iovec(address, size)
+            count = _process_vm_readv(self.pid, ctypes.byref(local), 1,
+                    ctypes.byref(remote), 1, 0)
+            if count >= 0:
+                return self._buffer.raw[:count]
+            error = ctypes.get_errno()
+            if error not in (errno.ENOSYS, errno.EPERM):
+                # EFAULT or ESRCH
+                return b""
+            logger.debug("process_vm_readv not available: %s" % os.strerror(error))
+            ProcessMemory.useProcessVmReadv = False
+        if self._mem is None:
+            self._mem = open("/proc/" + str(self.pid) + "/mem", 'rb', 0)
+        try:
+            self._mem.seek(address)
+            return self._mem.read(size)
+        except (IOError, OSError, OverflowError):
+            return b""
+
+    def readCString(self, address):
+        """
+        read the NULL terminated string at address
+
+        :type address: int
+        :param address: the address of the string in the traced process
+
+        :rtype: string
+        :return: the string decoded with the file system encoding
+        """
+        data = b""
+        while len(data) < self.maxStringLength:
+            chunk = self.read(address + len(data), self.maxStringLength - len(data))
+            if not chunk:
+                break
+            end = chunk.find(b'\0')
+            if end >= 0:
+                data += chunk[:end]
+                break
+            data += chunk
+        return os.fsdecode(data)
+
+    def close(self):
+        """close /proc/PID/mem, it must be called after an exec"""
+        if self._mem is not None:
+            self._mem.close()
+            self._mem = None
+
+
+
+class TracerStatistics(object):
+    """
+    Counters of the work done by :class:`SyscallTracer`, kept for each
+    traced pid and aggregated. The counters are:
+
+    - syscallStops, seccompStops: system call stops (PTRACE_SYSCALL) and
+      seccomp filter stops, with the seccomp filter the syscall stops are
+      only the exits of the traced system calls
+    - forkEvents, vforkEvents, cloneEvents, execEvents, exitEvents: ptrace
+      events
+    - signals: signals delivered to the traced processes
+    - opens: files recorded by open and openat
+    - mapsScans, mappingLookups: full /proc/PID/maps scans and executable
+      file mappings looked up after mmap
+    - stackTraces: calls of the stack tracer
+    - tracerSeconds: time spent in the tracer handling the stops of the pid
+
+    The time spent waiting in waitpid is only aggregated.
+    """
+
+    def __init__(self):
+        # pid -> collections.Counter
+        self.processes = {}
+        # pid -> list of the executables run by the pid
+        self.executables = {}
+        self.waitSeconds = 0.0
+        self.filtered = False
+
+    def getCounters(self, pid):
+        """
+        :type pid: int
+        :param pid: the PID of a traced process
+
+        :rtype: collections.Counter
+        :return: the counters of pid, they are created the first time
+        """
+        if pid not in self.processes:
+            self.processes[pid] = collections.Counter()
+        return self.processes[pid]
+
+    def addExecutable(self, pid, executable):
+        """record that pid is running executable"""
+        executables = self.executables.setdefault(pid, [])
+        if executable not in executables:
+            executables.append(executable)
+
+    def getTotal(self):
+        """
+        :rtype: collections.Counter
+        :return: the sum of the counters of all the pids
+        """
+        total = collections.Counter()
+        for counters in self.processes.values():
+            total.update(counters)
+        return total
+
+    def getSummary(self):
+        """
+        :rtype: dict
+        :return: a dictionary which can be serialized with json with the
+                 aggregated counters (total), the counters of each pid
+                 (processes), the time spent in waitpid and the tracing
+                 mode
+        """
+        processes = {}
+        for (pid, counters) in self.processes.items():
+            process = dict(counters)
+            process["executables"] = self.executables.get(pid, [])
+            processes[str(pid)] = process
+        return {"seccomp": self.filtered, "waitSeconds": self.waitSeconds,
+                "total": dict(self.getTotal()), "processes": processes}
+
+    def save(self, fileName):
+        """
+        write the summary (see :meth:`getSummary`) in fileName as json
+        """
+        f = open(fileName, 'w')
+        try:
+            json.dump(self.getSummary(), f, indent=1, sort_keys=True)
+        finally:
+            f.close()
+
+    def __str__(self):
+        total = self.getTotal()
+        tracerSeconds = total.pop("tracerSeconds", 0.0)
+        lines = ["Tracer statistics (%s, %d processes):" % ("seccomp filter"
+                if self.filtered else "PTRACE_SYSCALL", len(self.processes)),
+                " time in the tracer %.3fs, waiting in waitpid %.3fs" %
+                (tracerSeconds, self.waitSeconds)]
+        for key in sorted(total):
+            lines.append(" %-16s %d" % (key, total[key]))
+        return '\n'.join(lines)
+
+
 
 class SyscallTracer:
     """
     this class can spawn a process and trace its' execution to record 
     what are its dynamic dependency requirements
 
+    By default the traced process installs a seccomp filter (see
+    :func:`installSeccompFilter`) before calling exec so that the traced
+    processes stop only on the system calls handled by the tracer instead
+    of stopping twice on every system call (PTRACE_SYSCALL). If the filter
+    can not be installed the tracer falls back to PTRACE_SYSCALL.
+
     Usage:
 
     .. code:: python
@@ -34,8 +374,16 @@ class SyscallTracer:
         # output will in the TracerControlBlock static variables
         TracerControlBlock.[files|dependencies|env|cmdline]
 
+    :type useSeccomp: bool
+    :param useSeccomp: if False always use PTRACE_SYSCALL
     """
 
+    def __init__(self, useSeccomp = True):
+        self.useSeccomp = useSeccomp
+        # True if the traced processes run with the seccomp filter
+        self.filtered = False
+        self.statistics = TracerStatistics()
+
     def main(self, command): 
         """
         start the trace with the given command
@@ -49,7 +397,6 @@ class SyscallTracer:
 
         import ctypes
         from FingerPrint.ptrace import func as ptrace_func
-        import FingerPrint.ptrace.cpu_info
         import FingerPrint.ptrace.signames
         files={}
         #
@@ -66,12 +413,25 @@ class SyscallTracer:
         #logger = getLogger()
         #logger.setLevel(DEBUG)
         # creating the debugger and setting it up
+        executable = FingerPrint.utils.which(self.program[0])
+        useSeccomp = self.useSeccomp and bool(tracedSyscalls)
+        if useSeccomp:
+            # the child reports if it installed the seccomp filter
+            (readFd, writeFd) = os.pipe()
         child = os.fork()
         if child == 0:
             # we are in the child or traced process
             # traceme and execv
             ptrace_func.ptrace_traceme()
-            os.execl(FingerPrint.utils.which(self.program[0]), *self.program)
+            if useSeccomp:
+                os.close(readFd)
+                # wait for the tracer to set PTRACE_O_TRACESECCOMP, without
+                # it the filtered system calls fail with ENOSYS
+                os.kill(os.getpid(), signal.SIGSTOP)
+                if installSeccompFilter(tracedSyscalls):
+                    os.write(writeFd, b'1')
+                os.close(writeFd)
+            os.execl(executable, *self.program)
         else:
             # father or tracer process
             # we trace the execution here
@@ -80,25 +440,67 @@ class SyscallTracer:
             if pid != child :
                 logger.error("The process tracer could not bootstrap.")
                 return False
-            
-            ptrace_func.ptrace_setoptions(child, options);
-            ptrace_func.ptrace_syscall(child);
+            self.filtered = False
+            if useSeccomp:
+                # the child stopped itself before installing the filter
+                try:
+                    ptrace_func.ptrace_setoptions(child,
+                            options | ptrace_func.PTRACE_O_TRACESECCOMP)
+                except ptrace_func.PtraceError:
+                    # kernel older than 3.5, the filter can not be installed either
+                    ptrace_func.ptrace_setoptions(child, options)
+                ptrace_func.ptrace_cont(child)
+                os.close(writeFd)
+                # skip the system calls of the child before the exec
+                while True:
+                    pid, status = os.waitpid(child, 0x40000000)
+                    if not os.WIFSTOPPED(status):
+                        logger.error("The process tracer could not bootstrap.")
+                        return False
+                    if status >> 16 == ptrace_func.PTRACE_EVENT_EXEC:
+                        break
+                    signalValue = os.WSTOPSIG(status)
+                    if status >> 16 or signalValue == signal.SIGTRAP:
+                        signalValue = 0
+                    ptrace_func.ptrace_cont(child, signalValue)
+                # the pipe is closed by the exec
+                self.filtered = os.read(readFd, 1) == b'1'
+                os.close(readFd)
+                if not self.filtered:
+                    logger.debug("Unable to install the seccomp filter, tracing all the system calls")
+            else:
+                ptrace_func.ptrace_setoptions(child, options);
+            self.statistics.filtered = self.filtered
+            self._resume(child, None)
             files = TracerControlBlock.files
             TracerControlBlock.set_trace_function()
+            # counters of the last pid and end of the last waitpid
+            counters = None
+            lastWait = None
             while True: 
                 # main loop tracer
                 # 1. wait for syscall from the children
                 # 2. analyze what happen, if mmap syscall scan /proc/PID/maps
                 # 3. get ready to  wait for the next syscall
+                now = time.time()
+                if counters is not None:
+                    counters["tracerSeconds"] += now - lastWait
                 try:
                     # wait for all cloned children __WALL = 0x40000000
                     (pid, status) = os.waitpid(-1, 0x40000000 )
                 except OSError:
+                    self.statistics.waitSeconds += time.time() - now
                     logger.error("Tracing terminated successfully")
+                    cache = TracerControlBlock.callSiteCache
+                    logger.debug("Open call sites cache: %d hits %d misses" %
+                            (cache.hits, cache.misses))
                     return True
                 if not pid > 0:
                     logger.error("Catastrofic failure")
                     return False
+                lastWait = time.time()
+                self.statistics.waitSeconds += lastWait - now
+                counters = self.statistics.getCounters(pid)
 
                 event = status >> 16;
                 signalValue = os.WSTOPSIG(status)
@@ -106,93 +508,118 @@ class SyscallTracer:
                 if os.WIFEXITED(status):
                     # a process died, report it and go back to wait for syscall
                     logger.debug("The process " + str(pid) + " exited")
-                    processesStatus.pop(pid)
+                    if pid in processesStatus:
+                        processesStatus.pop(pid).memory.close()
                     continue
 
                 if os.WIFSIGNALED(status):
                     logger.debug("The process " + str(pid) + " exited because of a signal")
-                    processesStatus.pop(pid)
+                    if pid in processesStatus:
+                        processesStatus.pop(pid).memory.close()
                     continue
 
                 if os.WIFCONTINUED(status):
                     logger.debug("The process " + str(pid) + " continued")
-                elif os.WIFSTOPPED(status) and signalValue == (signal.SIGTRAP | 0x80 ):
+                elif os.WIFSTOPPED(status) and (signalValue == (signal.SIGTRAP | 0x80 ) or \
+                        (signalValue == signal.SIGTRAP and event == ptrace_func.PTRACE_EVENT_SECCOMP)):
                     #
-                    # we have a syscall
+                    # we have a syscall (with the seccomp filter the
+                    # PTRACE_EVENT_SECCOMP stop is the syscall entry)
                     # orig_rax or orig_eax contains the syscall number 
-                    # taken from linux src arch/x86/syscalls/syscall_[32|64].tbl
                     # switch on the syscal number to intercept mmap and open
+                    if event:
+                        counters["seccompStops"] += 1
+                    else:
+                        counters["syscallStops"] += 1
                     regs = ptrace_func.ptrace_getregs(pid)
                     if pid not in processesStatus :
                         #new pid
-                        tcb = TracerControlBlock( pid )
-                        processesStatus[pid] = tcb
-                    if (FingerPrint.ptrace.cpu_info.CPU_X86_64 and regs.orig_rax == 2) or \
-                            (FingerPrint.ptrace.cpu_info.CPU_I386 and regs.orig_eax == 5):# or regs.orig_rax == 257):
+                        processesStatus[pid] = self._newControlBlock(pid)
+                    tcb = processesStatus[pid]
+                    (syscall, firstArg, secondArg, retValue) = _getSyscallRegisters(regs)
+                    # cast from c_ulong to c_long
+                    retValue = ctypes.c_long(retValue).value
+                    if self.filtered and event == 0 and not tcb.enterCall and \
+                            retValue == -errno.ENOSYS:
+                        # before linux 4.8 the seccomp stop comes before the
+                        # syscall entry stop, the syscall did not run yet
+                        ptrace_func.ptrace_syscall(pid)
+                        continue
+                    if syscall in _openSyscalls or syscall in _openatSyscalls:
                         #
-                        # handle open (orig_rax == 2 on 64bit) or (orig_eax == 5 on 32bit)
+                        # handle open and openat
                         # 
-                        if processesStatus[pid].enterCall :
-                            # we are entering open, regs.rsi contains the first arguments for 64bit
+                        if tcb.enterCall :
+                            # we are entering open, rdi and rsi contain the first arguments for 64bit
                             # https://github.com/torvalds/linux/blob/master/arch/x86/kernel/entry_64.S#L585
-                            # ebx if for 32 bits http://man7.org/linux/man-pages/man2/syscall.2.html
-                            if FingerPrint.ptrace.cpu_info.CPU_X86_64:
-                                processesStatus[pid].firstArg = regs.rdi
+                            # ebx and ecx for 32 bits http://man7.org/linux/man-pages/man2/syscall.2.html
+                            if syscall in _openSyscalls:
+                                tcb.firstArg = firstArg
+                                tcb.dirFd = None
                             else:
-                                processesStatus[pid].firstArg = regs.ebx
-                            processesStatus[pid].enterCall = False
+                                # openat(dirfd, pathname, ...)
+                                tcb.firstArg = secondArg
+                                tcb.dirFd = ctypes.c_int(firstArg).value
+                            tcb.enterCall = False
                         else:
                             # we are exiting from a open
-                            processesStatus[pid].enterCall = True
-                            # cast from c_ulong to c_long
-                            if FingerPrint.ptrace.cpu_info.CPU_X86_64:
-                                ret_value = regs.rax
-                            else:
-                                ret_value = regs.eax
-                            returnValue = ctypes.c_long(ret_value).value
-                            if returnValue >= 0:
-                                openPath = self.readCString(processesStatus[pid].firstArg, pid)
-                                if openPath[0] != '/':
+                            tcb.enterCall = True
+                            if retValue >= 0:
+                                counters["opens"] += 1
+                                openPath = tcb.readCString(tcb.firstArg)
+                            # the path is empty if the tracee memory could not be read
+                            if retValue >= 0 and openPath:
+                                if not openPath.startswith('/'):
                                     #relative path we need to get the pwd
-                                    openPath = "$" + processesStatus[pid].getProcessCWD() + "$" + openPath
-                                libName = processesStatus[pid].getFileOpener()
+                                    openPath = "$" + tcb.getProcessCWD(tcb.dirFd) + "$" + openPath
+                                libName = tcb.getFileOpener(regs)
                                 if libName not in files:
                                     files[libName] = {}
-                                if processesStatus[pid].getProcessName() not in files[libName]:
-                                    files[libName][processesStatus[pid].getProcessName()] = set()
-                                files[libName][processesStatus[pid].getProcessName()].add(openPath)
+                                if tcb.getProcessName() not in files[libName]:
+                                    files[libName][tcb.getProcessName()] = set()
+                                files[libName][tcb.getProcessName()].add(openPath)
 
                             # else don't do anything
                             # TODO use close to check for used files (easier to trace full path)
 
-                    elif (FingerPrint.ptrace.cpu_info.CPU_X86_64 and regs.orig_rax == 9)\
-                            or (FingerPrint.ptrace.cpu_info.CPU_I386 and \
-                            (regs.orig_eax == 90 or regs.orig_eax == 192 ) ):
+                    elif syscall in _mmapSyscalls:
                         #
-                        # handle mmap (orig_rax == 9 64bit or orig_eax == 90 or 192 on 32bit)
+                        # handle mmap
                         #
-                        if processesStatus[pid].enterCall :
+                        if tcb.enterCall :
                             # we are entering mmap
-                            processesStatus[pid].enterCall = False
-                            #print "the process %d enter mmap" % pid
+                            tcb.enterCall = False
+                            tcb.mmapArgs = _getMmapArguments(regs)
                         else:
                             # we are returning from mmap
-                            processesStatus[pid].enterCall = True
-                            processesStatus[pid].updateSharedLibraries()
+                            tcb.enterCall = True
+                            # -4095 <= MAP_FAILED < 0
+                            if not -4096 < retValue < 0:
+                                tcb.addMapping(tcb.mmapArgs)
                 elif os.WIFSTOPPED(status) and (signalValue == signal.SIGTRAP) and event != 0:
                     # this is just to print some output to the users
                     subChild = ptrace_func.ptrace_geteventmsg(pid)
                     if event == ptrace_func.PTRACE_EVENT_FORK:
+                        counters["forkEvents"] += 1
                         logger.debug("The process %d forked a new process %d" % (pid, subChild))
                     elif event == ptrace_func.PTRACE_EVENT_VFORK:
+                        counters["vforkEvents"] += 1
                         logger.debug("The process %d vforked a new process %d" % (pid, subChild))
                     elif event == ptrace_func.PTRACE_EVENT_CLONE :
+                        counters["cloneEvents"] += 1
                         logger.debug("The process %d cloned a new process %d" % (pid, subChild))
                     elif event == ptrace_func.PTRACE_EVENT_EXEC :
+                        counters["execEvents"] += 1
                         logger.debug("The process %d run exec" % (pid))
-                        processesStatus[pid].updateProcessInfo()
+                        if pid in processesStatus:
+                            processesStatus[pid].updateProcessInfo()
+                            self.statistics.addExecutable(pid,
+                                    processesStatus[pid].getProcessName())
+                        else:
+                            # with the seccomp filter exec can be the first stop
+                            processesStatus[pid] = self._newControlBlock(pid)
                     elif event == ptrace_func.PTRACE_EVENT_EXIT:
-                        pass
+                        counters["exitEvents"] += 1
                         #print "the process %d is in a event exit %d" % (pid, subChild)
                 elif os.WIFSTOPPED(status):
                     # when a signal is delivered to one of the child and we get notified
@@ -201,28 +628,33 @@ class SyscallTracer:
                     # will never end)
                     logger.debug("Signal %s(%d) delivered to %d " % \
                         (FingerPrint.ptrace.signames.signalName(signalValue), signalValue, pid))
+                    counters["signals"] += 1
                     deliverSignal = signalValue
                 else:
                     logger.debug("This should not happen!!")
 
-                # set the ptrace option and wait for the next syscall notification
-                #ptrace_func.ptrace_setoptions(pid, options);
-                ptrace_func.ptrace_syscall(pid, deliverSignal);
-
+                # wait for the next syscall notification
+                self._resume(pid, processesStatus.get(pid), deliverSignal)
+
+    def _newControlBlock(self, pid):
+        """create the TracerControlBlock of pid which updates the pid
+        counters of :attr:`statistics`"""
+        tcb = TracerControlBlock(pid)
+        tcb.counters = self.statistics.getCounters(pid)
+        self.statistics.addExecutable(pid, tcb.getProcessName())
+        return tcb
+
+    def _resume(self, pid, tcb, deliverSignal = 0):
+        """restart the process pid so that it stops at the next traced
+        system call: with the seccomp filter PTRACE_SYSCALL is used only to
+        reach the exit of the current system call"""
+        from FingerPrint.ptrace import func as ptrace_func
+        if self.filtered and (tcb is None or tcb.enterCall):
+            ptrace_func.ptrace_cont(pid, deliverSignal)
+        else:
+            ptrace_func.ptrace_syscall(pid, deliverSignal)
 
 
-    def readCString(self, address, pid):
-        data = []
-        mem = open("/proc/" + str(pid) + "/mem", 'rb')
-        mem.seek(address)
-        while True:
-            b = mem.read(1)
-            if b == '\0':
-                break
-            data.append(b)
-        mem.close()
-        return ''.join(data)
-
 
     def test(self):
         a = {}
@@ -231,6 +663,56 @@ class SyscallTracer:
 
 
 
+class CallSiteCache(object):
+    """
+    Least recently used cache of the library attributed to an open call site,
+    the same code path calls open over and over (configuration readers,
+    plugin loaders, etc.) so each call site is classified only once. Keys are
+    (path of the object file, file offset of the return address) or the
+    stack keys of :meth:`TracerControlBlock.getFileOpener`.
+
+    :type maxSize: int
+    :param maxSize: the maximum number of call sites kept in the cache
+    """
+
+    def __init__(self, maxSize = 4096):
+        self.maxSize = maxSize
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+
+    def get(self, key):
+        """
+        :type key: tuple
+        :param key: the call site (object file, offset)
+
+        :rtype: string
+        :return: the library attributed to the call site or None if it is
+                 not in the cache
+        """
+        value = self._entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        """
+        store the library value attributed to the call site key evicting
+        the least recently used call site if the cache is full
+        """
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxSize:
+            self._entries.popitem(last = False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+
 class TracerControlBlock:
     """
     This class hold data needed for tracing a processes. Inspired by strace code (struct tcb).
@@ -269,6 +751,32 @@ class TracerControlBlock:
     all the token of the command line
     """
 
+    callSiteCache = CallSiteCache()
+    """
+    :class:`CallSiteCache` of the libraries which opened a file, shared by
+    all the traced processes
+    """
+
+    codeGeneration = 0
+    """
+    incremented each time a traced process maps new code: the threads of a
+    process share its mappings so the executable mappings cached by each
+    TracerControlBlock are read again after any mmap of code
+    """
+
+    stackScanSize = 2048
+    """number of bytes of the stack scanned to find the caller of open"""
+
+    callerDepths = {}
+    """
+    dictionary location of a system call (see
+    :meth:`TracerControlBlock._getCodeLocation`) -> list of the depths in
+    the stack where the unwinding found the caller of the first library
+    """
+
+    maxCallerDepths = 8
+    """maximum number of depths tried for each location of a system call"""
+
     @classmethod
     def get_env_variable(cls, process_name, variable_name):
         """
@@ -294,8 +802,36 @@ class TracerControlBlock:
         self.pid = pid
         self.enterCall = True
         self.firstArg = None
+        # directory file descriptor of openat
+        self.dirFd = None
+        # prot, flags and fd of the current mmap
+        self.mmapArgs = None
+        # (st_dev, st_ino) of the executable files mapped by this process
+        self.mappedFiles = set()
+        # True until /proc/PID/maps is scanned after an exec
+        self.scanMaps = True
+        # executable file mappings, see _getCodeMappings
+        self._codeMappings = None
+        self._codeGeneration = None
+        # see TracerStatistics
+        self.counters = collections.Counter()
+        # memory reader of this process, see readCString
+        self.memory = ProcessMemory(pid)
         self.updateProcessInfo()
 
+    def readCString(self, address):
+        """
+        read a string from the memory of this process (see
+        :meth:`ProcessMemory.readCString`)
+
+        :type address: int
+        :param address: the address of the string
+
+        :rtype: string
+        :return: the string read
+        """
+        return self.memory.readCString(address)
+
 
     def updateProcessInfo(self):
         """
@@ -304,6 +840,12 @@ class TracerControlBlock:
         This method is called only once when this instance is created (aka when the process
         is created).
         """
+        # after an exec the old /proc/PID/mem refers to the old memory
+        self.memory.close()
+        # and the binary and the loader are mapped by the kernel
+        self.mappedFiles = set()
+        self.scanMaps = True
+        self._codeMappings = None
         processName = self.getProcessName()
         if processName not in TracerControlBlock.dependencies:
             # new binary file let's add it to the dyctionary
@@ -322,20 +864,64 @@ class TracerControlBlock:
         This method scans the procfs to find the shared libraries loaded by this
         process and it updates the static
         :attr:`TracerControlBlock.dependencies` variable accordingly. This
-        function is called every time the process invoke the mmap system call.
+        function is called at the first mmap system call after an exec (to
+        find the files mapped by the kernel), after that
+        :meth:`addMapping` is used.
         """
-        binaryFile = self.getProcessName()
+        self.scanMaps = False
+        self.counters["mapsScans"] += 1
+        TracerControlBlock.codeGeneration += 1
         f=open('/proc/' + str(self.pid) + '/maps')
         maps = f.read()
         f.close()
         for i in maps.split('\n'):
             tokens = i.split()
-            if len(tokens) > 5 and 'x' in tokens[1] and os.path.isfile(tokens[5]):
+            if len(tokens) > 5 and 'x' in tokens[1]:
                 # assumption: if we have a memory mapped area to a file and it is
                 # executable then it is a shared library
-                libPath = tokens[5].strip()
-                if libPath not in TracerControlBlock.dependencies[binaryFile] and libPath != binaryFile:
-                    TracerControlBlock.dependencies[binaryFile].append( libPath )
+                self._addLibrary(tokens[5].strip())
+
+    def addMapping(self, mmapArgs):
+        """
+        This method is called after each successful mmap system call, if the
+        mmap mapped a new executable file it is added to the
+        :attr:`TracerControlBlock.dependencies`. Anonymous and not executable
+        mappings are skipped without looking at the procfs.
+
+        :type mmapArgs: tuple
+        :param mmapArgs: the prot, flags and fd arguments of the mmap or None
+                         if they are not known (in this case the whole
+                         /proc/PID/maps is scanned)
+        """
+        if self.scanMaps or mmapArgs is None:
+            self.updateSharedLibraries()
+            return
+        (prot, flags, fd) = mmapArgs
+        if not prot & _PROT_EXEC or flags & _MAP_ANONYMOUS or fd < 0:
+            return
+        self.counters["mappingLookups"] += 1
+        TracerControlBlock.codeGeneration += 1
+        self._addLibrary('/proc/' + str(self.pid) + '/fd/' + str(fd))
+
+    def _addLibrary(self, path):
+        """add the regular file at path to the dependencies of this process
+        unless this process already mapped it, path can be a /proc/PID/fd
+        link"""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return
+        key = (st.st_dev, st.st_ino)
+        if key in self.mappedFiles or not stat.S_ISREG(st.st_mode):
+            return
+        self.mappedFiles.add(key)
+        try:
+            libPath = os.readlink(path) if path.startswith('/proc/') else path
+        except OSError:
+            return
+        binaryFile = self.getProcessName()
+        if libPath not in TracerControlBlock.dependencies[binaryFile] and libPath != binaryFile:
+            TracerControlBlock.dependencies[binaryFile].append( libPath )
 
     @classmethod
     def set_trace_function(cls):
@@ -363,27 +949,153 @@ class TracerControlBlock:
         return os.readlink('/proc/' + str(self.pid) + '/exe')
 
 
-    def getProcessCWD(self):
+    def getProcessCWD(self, dirFd = None):
         """
+        :type dirFd: int
+        :param dirFd: the directory file descriptor passed to openat, if None
+                      or AT_FDCWD the current working directory is returned
+
         :rtype: string
         :return: return the current working directory of this process
         """
+        if dirFd is not None and dirFd != _AT_FDCWD:
+            return os.readlink('/proc/' + str(self.pid) + '/fd/' + str(dirFd))
         return os.readlink('/proc/' + str(self.pid) + '/cwd')
 
-    def getFileOpener(self):
+    def _getCodeMappings(self):
+        """
+        read the executable file mappings of this process from
+        /proc/PID/maps, the paths are parsed like the stacktracer module
+        does. They are cached until a process maps new code.
+
+        :rtype: tuple
+        :return: a sorted list of start addresses and a list of tuples
+                 (start, end, offset, path) in the same order
+        """
+        if self._codeMappings is None or \
+                self._codeGeneration != TracerControlBlock.codeGeneration:
+            self.counters["codeMapsScans"] += 1
+            mappings = []
+            f = open('/proc/' + str(self.pid) + '/maps')
+            try:
+                for line in f:
+                    tokens = line.split(None, 5)
+                    if len(tokens) < 6 or 'x' not in tokens[1]:
+                        continue
+                    path = tokens[5].rstrip('\n')
+                    if path.startswith('[') and path.endswith(']'):
+                        # [vdso], [vsyscall], etc.
+                        continue
+                    (start, end) = [int(i, 16) for i in tokens[0].split('-')]
+                    mappings.append((start, end, int(tokens[2], 16), path))
+            finally:
+                f.close()
+            mappings.sort()
+            self._codeMappings = ([i[0] for i in mappings], mappings)
+            self._codeGeneration = TracerControlBlock.codeGeneration
+        return self._codeMappings
+
+    def _getCodeLocation(self, address):
+        """
+        :rtype: tuple
+        :return: the path and the file offset of the code at address or None
+                 if address is not in an executable file mapping
+        """
+        (starts, mappings) = self._getCodeMappings()
+        i = bisect.bisect_right(starts, address) - 1
+        if i < 0 or address >= mappings[i][1]:
+            return None
+        (start, end, offset, path) = mappings[i]
+        return (path, address - start + offset)
+
+    def _readStack(self, regs):
+        """
+        :type regs: :class:`FingerPrint.ptrace.linux_struct.user_regs_struct`
+        :param regs: the registers of this process at the system call
+
+        :rtype: tuple
+        :return: the location of the program counter (see
+                 :meth:`_getCodeLocation`) and the list of the words at the
+                 top of the stack or None if the program counter is not in
+                 an object file
+        """
+        if FingerPrint.ptrace.cpu_info.CPU_X86_64:
+            (pc, sp, wordFormat) = (regs.rip, regs.rsp, "<Q")
+        else:
+            (pc, sp, wordFormat) = (regs.eip, regs.esp, "<I")
+        pcLocation = self._getCodeLocation(pc)
+        if pcLocation is None:
+            return None
+        stack = b""
+        while len(stack) < self.stackScanSize:
+            # the reads stop at the page boundaries
+            data = self.memory.read(sp + len(stack), self.stackScanSize - len(stack))
+            if not data:
+                break
+            stack += data
+        stack = stack[:len(stack) - len(stack) % struct.calcsize(wordFormat)]
+        return (pcLocation, [word for (word,) in struct.iter_unpack(wordFormat, stack)])
+
+    def _getStackKey(self, stack, depth):
+        """
+        :type stack: tuple
+        :param stack: the value returned by :meth:`_readStack`
+
+        :type depth: int
+        :param depth: the position in the stack of the return address of
+                      the caller
+
+        :rtype: tuple
+        :return: the key of the call site made of the location of the
+                 program counter, the depth and the location of the caller and
+                 the locations of all the code addresses found above it in
+                 the stack (the frames of the first library) or None if the
+                 caller is not in another object file
+        """
+        (pcLocation, words) = stack
+        if depth >= len(words):
+            return None
+        caller = self._getCodeLocation(words[depth])
+        if caller is None or caller[0] == pcLocation[0]:
+            return None
+        frames = [self._getCodeLocation(word) for word in words[:depth]]
+        return (pcLocation, depth, caller,
+                tuple(frame for frame in frames if frame is not None))
+
+    def getFileOpener(self, regs = None):
         """
         if Fingerprint is compiled with the stack tracer module it will find the
         file object who contains the code which initiated this open system call
         if not it will return the path to the current process. This function is
         called after each open system call.
 
+        When the registers are given the :attr:`callSiteCache` is looked up
+        first using the words of the stack at the depths where the caller
+        was found by the previous unwindings from the same program counter
+        (see :attr:`callerDepths` and :meth:`_getStackKey`), the stack is
+        unwound only on a miss.
+
+        :type regs: :class:`FingerPrint.ptrace.linux_struct.user_regs_struct`
+        :param regs: the registers of this process at the system call
+
         :rtype: string
         :return: the path of the library who triggered the current open system 
                  call
         """
         if not self.tracing:
             return self.getProcessName()
-        libname = self.trace(self.pid)
+        stack = None
+        if regs is not None:
+            stack = self._readStack(regs)
+        if stack is not None:
+            for depth in self.callerDepths.get(stack[0], ()):
+                stackKey = self._getStackKey(stack, depth)
+                opener = stackKey and self.callSiteCache.get(stackKey)
+                if opener:
+                    return opener
+        # stop unwinding at the first frame outside the first library
+        self.counters["stackTraces"] += 1
+        libname = self.trace(self.pid, 1)
         prev_lib = ""
         for line in libname.split('\n'):
             splitline = line.split(':')
@@ -401,170 +1113,191 @@ class TracerControlBlock:
                 else:
                     # that's it, we just got out of first lib in the stack, lets
                     # see if we have a open or not
-                    if current_lib not in objectFiles:
-                        objectFiles[current_lib] = ObjectFile(current_lib)
-                    if self._isOpen(objectFiles[current_lib], splitline[1], splitline[2]) :
-                        return current_lib
-                    else :
-                        return prev_lib
+                    key = (current_lib, int(splitline[1], 16))
+                    opener = self.callSiteCache.get(key)
+                    if opener is None:
+                        if self._isOpen(current_lib, splitline[1]) :
+                            opener = current_lib
+                        else :
+                            opener = prev_lib
+                        self.callSiteCache.set(key, opener)
+                    if stack is not None:
+                        self._addStackKey(stack, int(splitline[2], 16), key, opener)
+                    return opener
         #hmm probably we are in the loader
         return current_lib
 
-
-    def _isOpen(self, objectFile, offset, ip):
-        """return true if ip/offset are pointing to a open syscall for this 
-        object file
+    def _addStackKey(self, stack, returnAddress, caller, opener):
         """
-        if objectFile.isDynamic():
-            # offset and ip are in the form of 0x45a3f2
-            vma=offset[2:]
-        else:
-            vma=ip[2:]
-        instruction = objectFile.getPrevInstruction(vma)
-        #print "instruction ", instruction, " file ", objectFile.filename, " ", offset, ip
-        if len(instruction[2]) == 0:
-            # we don't know how to decode this situation
+        cache opener with the key of the stack (see :meth:`_getStackKey`) if
+        the returnAddress of the caller found unwinding the stack is in the
+        scanned words
+        """
+        (pcLocation, words) = stack
+        if returnAddress not in words:
+            return
+        depth = words.index(returnAddress)
+        stackKey = self._getStackKey(stack, depth)
+        if stackKey is None or stackKey[2] != caller:
+            return
+        depths = self.callerDepths.setdefault(pcLocation, [])
+        if depth not in depths:
+            if len(depths) >= self.maxCallerDepths:
+                return
+            depths.append(depth)
+        self.callSiteCache.set(stackKey, opener)
+
+
+    def _isOpen(self, fileName, offset):
+        """return true if the instruction before offset (the file offset of
+        a return address in the form of 0x45a3f2) calls one of the open
+        functions"""
+        if fileName not in callSites:
+            try:
+                callSites[fileName] = CallSiteClassifier(fileName)
+            except (IOError, OSError, ElfFormatError):
+                # e.g. [vdso] or a deleted file
+                callSites[fileName] = None
+        if not callSites[fileName]:
             return False
-        if '@' in instruction[2]:
-            #it's point to the plt just remove the @plt
-            callname = instruction[2].split('@')[0]
-        else :
-            #we have a function call but it's not pointing to the plt table yet
-            #so let's try to follow the code flow to see where it leads
-            called_instruction = objectFile.getInstruction(instruction[1])
-            if 'jmp' in called_instruction[0]:
-                # we have a jump let's hope it goes to the plt
-                if '@' in called_instruction[2]:
-                    callname = called_instruction[2].split('@')[0]
-                else:
-                    return False
-            else:
-                return False
         # these are the system call that we trace for the moment
-        if callname in ['fopen', '_IO_fopen', 'fopen64', 'open64', 'open', \
-                        '__open', 'open64', '__open64']:
-            return True
-        else:
-            return False
+        return callSites[fileName].getCalledFunction(int(offset, 16)) in openFunctions
 
 
 
-objectFiles = {}
+openFunctions = set(['fopen', '_IO_fopen', 'fopen64', 'open64', 'open', '__open',
+        '__open64', 'openat', 'openat64', '__openat64'])
+"""names of the functions which open a file"""
 
-class ObjectFile:
-    """
-    This class wraps an elf object file and its assembler code used by the
-    stack tracing facility. This class depend on objdump to disassemble
-    binaries. This class need several optimization (uses a lot of memory
-    and CPU time).
+callSites = {}
 
-    :type filename: string
-    :param filename: the path to the binary will be disassembled
+class CallSiteClassifier(object):
     """
+    It finds which imported function is called by the call instruction before
+    a return address found in the stack of a traced process. Instead of
+    disassembling the whole object, it reads its PLT and dynamic relocations
+    (see :meth:`FingerPrint.elffile.ElfFile.getPltSymbols`) and it decodes
+    only the call instruction (and the jmp of a local stub if the call does
+    not go straight to the PLT). Only x86 is supported.
 
-    def __init__(self, filename):
-        """ """
-        self.filename = filename
-        if FingerPrint.sergeant.prelink :
-            # we need to undo the prelink
-            # we could use also the IP instead of the offset in the _isOpen function
-            # instead of undoing the prelinking but then it would not work with prelinked
-            # and it would fail with non prelinked libraries (this way always works but is slower)
-            (fd, filename) = tempfile.mkstemp()
-            returncode = FingerPrint.utils.getOutputAsList(["prelink", "-u", "-o", \
-                                                              filename, self.filename])[1]
-            if returncode != 0 :
-                raise RuntimeError("unable to undo the prelink on " + self.filename)
-        (outputs, returncode) = FingerPrint.utils.getOutputAsList(["objdump", "-x", "-D", filename])
-        if returncode != 0 :
-            raise RuntimeError("objdump failed for file " + self.filename)
-        if FingerPrint.sergeant.prelink :
-            os.close(fd)
-            os.remove(filename)
-        self.assembler = outputs
+    The executable segments are indexed by virtual address and by file
+    offset so that each translation is a binary search, and the object is
+    mapped once so that reading an instruction does not open the file.
 
-    def isDynamic(self):
-        """
-        :rtype: bool
-        :return: true if this is a dynamic object aka a shared library
-        """
-        #we just check the first lines no need to scan the whole thing
-        for line in self.assembler[0:10]:
-            if "EXEC_P" in line:
-                return False
-            if "DYNAMIC" in line:
-                return True
-        raise RuntimeError("Unable to determine VMA for file " + self.filename)
-
-
-    def getInstruction(self, vma):
-        """
-        it decodes the instruction at the given virtual memory address
-
-        :type vma: string
-        :param vma: the virtual memory address in an hexadecimal format
-
-        :rtype: tuple
-        :return: a tuple of tree strings where the first string is the opcode
-                 at the given address vma, the second is the address referred
-                 by the instruction and the third is the symbolic name referred
-                 by the address
-        """
-        for line in self.assembler:
-            if re.match(" *" + vma + ":", line):
-                return self._decodeLine(line)
-        raise RuntimeError("Unable to determine VMA for file " + self.filename)
-
-
-    def getPrevInstruction(self, vma):
-        """
-        it decodes the previous instruction at the given virtual memory address
-
-        :type vma: string
-        :param vma: the virtual memory address in an hexadecimal format
-
-        :rtype: tuple
-        :return: a tuple of tree strings where the first string is the opcode
-                 at the given address vma, the second is the address referred
-                 by the instruction and the third is the symbolic name referred
-                 by the address
-        """
-        for line in self.assembler:
-            if re.match(" *" + vma + ":", line):
-                return self._decodeLine(prevLine)
-            prevLine = line
-        raise RuntimeError("Unable to determine VMA for file " + self.filename)
+    :type fileName: string
+    :param fileName: the path to the ELF object
 
+    :raise ElfFormatError: if the file is not an ELF object
+    """
 
-    def _decodeLine(self, line):
-        """
-        given a line of the disassemble code it returns a tuple
-        with (instruction, address, symbol)
-        """
-        # take out the address part
-        line = line[line.find(':') + 1:].lstrip()
-        while True:
-            if not re.match("[a-z0-9][a-z0-9] ", line[0:3]):
-                break
-            line = line[3:]
-        #we removed all the hex opcodes
-        line = line.lstrip()
-        tokens = line.split()
-        istr = tokens[0]
-        if len(tokens) > 1:
-            # we have an address
-            addr = tokens[1]
+    def __init__(self, fileName):
+        self.fileName = fileName
+        self._elf = ElfFile(fileName)
+        self._symbols = self._elf.getPltSymbols()
+        # addresses wrap around at the word size of the object
+        self._mask = 0xffffffffffffffff if self._elf.is64bits() else 0xffffffff
+        # calls and PLT stubs are only in the executable segments
+        code = [segment for segment in self._elf.getSegments()
+                if segment[3] & PF_X and segment[2]]
+        self._byVaddr = sorted(code)
+        self._vaddrs = [segment[0] for segment in self._byVaddr]
+        self._byOffset = sorted(code, key = lambda segment: segment[1])
+        self._offsets = [segment[1] for segment in self._byOffset]
+        self._data = None
+        if code and self._symbols:
+            f = open(fileName, 'rb')
+            try:
+                self._data = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+            finally:
+                f.close()
+
+    def _toOffset(self, vaddr):
+        """translate vaddr into a file offset or return None if it is not
+        in an executable segment"""
+        i = bisect.bisect_right(self._vaddrs, vaddr) - 1
+        if i < 0:
+            return None
+        (p_vaddr, p_offset, p_filesz, p_flags) = self._byVaddr[i]
+        if vaddr >= p_vaddr + p_filesz:
+            return None
+        return vaddr - p_vaddr + p_offset
+
+    def _toVaddr(self, offset):
+        """translate a file offset into a virtual address or return None if
+        it is not in an executable segment"""
+        i = bisect.bisect_right(self._offsets, offset) - 1
+        if i < 0:
+            return None
+        (p_vaddr, p_offset, p_filesz, p_flags) = self._byOffset[i]
+        if offset >= p_offset + p_filesz:
+            return None
+        return offset - p_offset + p_vaddr
+
+    def _readCode(self, vaddr, size):
+        """read size bytes at the given virtual address or return None"""
+        offset = self._toOffset(vaddr)
+        if offset is None or self._data is None:
+            return None
+        data = self._data[offset:offset + size]
+        if len(data) != size:
+            return None
+        return data
+
+    def _getCallTarget(self, code, returnAddress):
+        """decode the call in the 6 bytes of code before returnAddress and
+        return the address it calls (for an indirect call the address of
+        the pointer) or None"""
+        if code[1] == 0xe8:
+            # call rel32
+            target = returnAddress + struct.unpack_from("<i", code, 2)[0]
+        elif code[0:2] == b'\xff\x15':
+            # call *disp32(%rip) on 64bit or call *abs32 on 32bit
+            target = struct.unpack_from("<i", code, 2)[0]
+            if self._elf.is64bits():
+                target += returnAddress
         else:
-            addr = ""
-        if len(tokens) > 2:
-            # we have a symbol
-            sym = tokens[2]
-            sym = sym.rstrip('>')
-            sym = sym.lstrip('<')
+            return None
+        return target & self._mask
+
+    def _getJumpTarget(self, code, address):
+        """decode the jmp at the beginning of code (which is at address)
+        and return the address it jumps to (for an indirect jump the address
+        of the pointer) or None"""
+        if code[0] == 0xe9:
+            # jmp rel32
+            target = address + 5 + struct.unpack_from("<i", code, 1)[0]
+        elif code[0] == 0xeb:
+            # jmp rel8
+            target = address + 2 + struct.unpack_from("<b", code, 1)[0]
+        elif code[0:2] == b'\xff\x25':
+            # jmp *disp32(%rip) on 64bit or jmp *abs32 on 32bit
+            target = struct.unpack_from("<i", code, 2)[0]
+            if self._elf.is64bits():
+                target += address + 6
         else:
-            sym = ""
-        return (istr, addr, sym)
-
-
+            return None
+        return target & self._mask
 
+    def getCalledFunction(self, offset):
+        """
+        :type offset: int
+        :param offset: the file offset of a return address
 
+        :rtype: string
+        :return: the name of the imported function called by the instruction
+                 before the return address or None if it is not a call to an
+                 imported function
+        """
+        returnAddress = self._toVaddr(offset)
+        if not self._symbols or returnAddress is None or returnAddress < 6:
+            return None
+        code = self._readCode(returnAddress - 6, 6)
+        target = code and self._getCallTarget(code, returnAddress)
+        if target is None:
+            return None
+        if target in self._symbols:
+            return self._symbols[target]
+        # a call to a local stub which jumps to the PLT
+        code = self._readCode(target, 6)
+        target = code and self._getJumpTarget(code, target)
+        return self._symbols.get(target)
@@ -7,7 +7,7 @@ def getOutputAsList(binary, inputString=None):
     """ run popen pipe inputString and return a touple of
     (the stdout as a list of string, return value of the command)
     """
-    p = Popen(binary, stdin=PIPE, stdout=PIPE, stderr=PIPE)
+    p = Popen(binary, stdin=PIPE, stdout=PIPE, stderr=PIPE, universal_newlines=True)
     grep_stdout = p.communicate(input=inputString)[0]
     p.wait()
     return (grep_stdout.split('\n'), p.returncode)
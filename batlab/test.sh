@@ -3,21 +3,35 @@
 
 #TODO testing remove this
 cat /etc/issue
-python -V
+python3 -V
 
 
 cd FingerPrint/
-python setup.py test 2>&1
+# build the stack tracer against the libunwind of the system (libunwind-dev)
+if [ ! -f setup.cfg ]; then
+  echo "[build_ext]" > setup.cfg
+fi
+python3 setup.py build_ext --inplace 2>&1
+if [ "$?" -ne "0" ]; then
+  echo "Failed building the stack tracer. Exiting."
+  exit -1
+fi
+python3 -c "import FingerPrint.stacktracer" 2>&1
+if [ "$?" -ne "0" ]; then
+  echo "Failed loading the stack tracer. Exiting."
+  exit -1
+fi
+python3 setup.py test 2>&1
 if [ "$?" -ne "0" ]; then
   echo "Some unit test failed. Exiting."
   exit -1
 fi
-python setup.py bdist 2>&1
+python3 setup.py bdist 2>&1
 if [ "$?" -ne "0" ]; then
   echo "Failed creating binary distribution. Exiting."
   exit -1
 fi
-python setup.py sdist 2>&1
+python3 setup.py sdist 2>&1
 if [ "$?" -ne "0" ]; then
   echo "Failed creating source distribution. Exiting."
   exit -1
@@ -1,15 +1,18 @@
-#!/usr/bin/python
+#!/usr/bin/python3
 
-from distutils.core import setup, Extension
+try:
+    from setuptools import setup, Extension, Command
+except ImportError:
+    # distutils was removed in python 3.12
+    from distutils.core import setup, Extension, Command
 
 #
 # courtesy of Darren
 # http://da44en.wordpress.com/2002/11/22/using-distutils/
 #
-from distutils.core import Command
 from unittest import TextTestRunner, TestLoader
 from glob import glob
-from os.path import splitext, basename, join as pjoin, walk
+from os.path import splitext, basename, join as pjoin
 import os
 import sys
 
@@ -85,7 +88,6 @@ setup(
     license = license,
     #main package, most of the code is inside here
     packages = ['FingerPrint', 'FingerPrint.plugins', 'FingerPrint.ptrace'],
-    package_data = {'FingerPrint.plugins': ['find-requires', 'find-provides']},
     #package_dir = {'FingerPrint': 'FingerPrint'},
     #needs this for detecting file type
     #py_modules=['magic'],
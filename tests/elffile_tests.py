@@ -0,0 +1,139 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+from FingerPrint.elffile import ElfFile, ElfFormatError, ET_DYN
+import FingerPrint.plugins
+from FingerPrint.plugins import PluginManager
+from FingerPrint.plugins.elf import ElfPlugin
+from FingerPrint.swirl import Dependency
+
+
+class TestElfFile(unittest.TestCase):
+
+    def setUp(self):
+        """setup for your unittest"""
+        self.basedir = os.path.join(os.path.dirname( globals()["__file__"] ), 'files')
+        self.centos = os.path.join(self.basedir, 'centos_6.2_x86_64')
+
+    def test_header(self):
+        elf = ElfFile(os.path.join(self.centos, 'dbus-daemon'))
+        self.assertTrue(elf.is64bits())
+        # dbus is compiled as position independent executable
+        self.assertEqual(elf.type, ET_DYN)
+        self.assertEqual(elf.interpreter, '/lib64/ld-linux-x86-64.so.2')
+        self.assertRaises(ElfFormatError, ElfFile,
+                os.path.join(self.centos, 'README'))
+
+    def test_requires(self):
+        fileName = os.path.join(self.centos, 'dbus-daemon')
+        elf = ElfFile(fileName)
+        self.assertEqual(elf.rpath, None)
+        requires = [dep.getName() for dep in ElfPlugin._getRequires(elf, fileName)]
+        self.assertEqual(requires, ['ld-linux-x86-64.so.2()(64bit)',
+            'libaudit.so.1()(64bit)', 'libc.so.6()(64bit)',
+            'libc.so.6(GLIBC_2.2.5)(64bit)', 'libc.so.6(GLIBC_2.3.4)(64bit)',
+            'libc.so.6(GLIBC_2.4)(64bit)', 'libc.so.6(GLIBC_2.9)(64bit)',
+            'libcap-ng.so.0()(64bit)', 'libexpat.so.1()(64bit)',
+            'libpthread.so.0()(64bit)', 'libpthread.so.0(GLIBC_2.2.5)(64bit)',
+            'libpthread.so.0(GLIBC_2.3.2)(64bit)', 'libpthread.so.0(GLIBC_2.3.3)(64bit)',
+            'librt.so.1()(64bit)', 'librt.so.1(GLIBC_2.2.5)(64bit)',
+            'libselinux.so.1()(64bit)'])
+        self.assertEqual(ElfPlugin._getProvides(elf, fileName), [])
+
+    def test_provides(self):
+        fileName = os.path.join(self.centos, 'libgpilotd.so.2.2.0')
+        elf = ElfFile(fileName)
+        self.assertEqual(elf.type, ET_DYN)
+        self.assertEqual(elf.soname, 'libgpilotd.so.2')
+        provides = [dep.getName() for dep in ElfPlugin._getProvides(elf, fileName)]
+        self.assertEqual(provides, ['libgpilotd.so.2()(64bit)'])
+
+    def test_provides_index(self):
+        fileName = os.path.join(self.centos, 'libgpilotd.so.2.2.0')
+        self.assertTrue(ElfPlugin._checkMinor(fileName, 'libgpilotd.so.2()(64bit)'))
+        self.assertTrue(os.path.realpath(fileName) in ElfPlugin._providesIndex)
+        self.assertTrue(ElfPlugin._checkVersions(fileName, ['libgpilotd.so.2()(64bit)']))
+        self.assertFalse(ElfPlugin._checkVersions(fileName,
+                ['libgpilotd.so.2()(64bit)', 'libgpilotd.so.2(GLIBC_2.2.5)(64bit)']))
+
+    def test_prefetch(self):
+        fileName = os.path.join(self.centos, 'dbus-daemon')
+        readme = os.path.join(self.centos, 'README')
+        ElfPlugin._elfIndex.pop(fileName, None)
+        PluginManager.prefetch([fileName, readme], 2)
+        self.assertEqual(ElfPlugin._elfIndex[readme], False)
+        self.assertEqual(ElfPlugin._elfIndex[fileName].needed,
+                ElfFile(fileName).needed)
+
+    def test_path_cache(self):
+        tempDir = tempfile.mkdtemp()
+        try:
+            shutil.copy(os.path.join(self.centos, 'libgpilotd.so.2.2.0'),
+                    os.path.join(tempDir, 'libgpilotd.so.2'))
+            dep = Dependency.fromString('libgpilotd.so.2()(64bit)')
+            dep.type = 'ELF'
+            self.assertEqual(PluginManager.getPathToLibrary(dep), None)
+            # the RPATH is part of the cache key
+            self.assertEqual(PluginManager.getPathToLibrary(dep, rpath = [tempDir]),
+                    os.path.join(tempDir, 'libgpilotd.so.2'))
+            self.assertEqual(PluginManager.getPathToLibrary(dep), None)
+            self.assertEqual(PluginManager.getPathToLibrary(dep,
+                    rpath = [tempDir + '/']), os.path.join(tempDir, 'libgpilotd.so.2'))
+        finally:
+            shutil.rmtree(tempDir)
+
+    def _patch(self, fileName, offset):
+        f = open(fileName, 'r+b')
+        f.seek(offset)
+        byte = f.read(1)
+        f.seek(offset)
+        f.write(bytes([byte[0] ^ 0xff]))
+        f.close()
+
+    def test_stable_digest(self):
+        tempDir = tempfile.mkdtemp()
+        try:
+            fileName = os.path.join(tempDir, 'libgpilotd.so.2.2.0')
+            shutil.copy(os.path.join(self.centos, 'libgpilotd.so.2.2.0'), fileName)
+            elf = ElfFile(fileName)
+            sections = dict((i[0], i) for i in elf.getSections())
+            # this library was prelinked on the centos system
+            self.assertTrue(elf.isPrelinked())
+            self.assertFalse(ElfFile(os.path.join(self.centos, 'dbus-daemon')).isPrelinked())
+            digest = elf.getStableDigest('sha256')
+            self.assertEqual(len(digest), 64)
+            # prelink rewrites the values of the dynamic section (the
+            # DT_GNU_PRELINKED timestamp is its 60th entry) and the GOT
+            self._patch(fileName, sections['.dynamic'][3] + 59 * 16 + 8)
+            self._patch(fileName, sections['.got'][3])
+            self.assertEqual(ElfFile(fileName).getStableDigest('sha256'), digest)
+            # but it never touches the names of the needed libraries
+            f = open(fileName, 'rb')
+            data = f.read()
+            f.close()
+            self._patch(fileName, data.index(b'libcrypt.so.1\0'))
+            patched = ElfFile(fileName).getStableDigest('sha256')
+            self.assertNotEqual(patched, digest)
+            # nor the code
+            self._patch(fileName, sections['.text'][3])
+            self.assertNotEqual(ElfFile(fileName).getStableDigest('sha256'), patched)
+        finally:
+            shutil.rmtree(tempDir)
+
+
+    def test_plt_symbols(self):
+        elf = ElfFile(os.path.join(self.basedir, 'Ubuntu_12.04_x86_64', 'dbus-daemon'))
+        symbols = elf.getPltSymbols()
+        # PLT stubs
+        self.assertEqual(symbols[0x5320], 'open')
+        self.assertEqual(symbols[0x5350], 'fopen')
+        # and their GOT slots
+        self.assertEqual(symbols[0x262d60], 'open')
+        offset = elf.vaddrToOffset(0x3475a)
+        self.assertEqual(elf.offsetToVaddr(offset), 0x3475a)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,207 @@
+import unittest
+import os
+import sys
+import json
+import pickle
+import shutil
+import tempfile
+import subprocess
+
+import FingerPrint.utils
+import FingerPrint.sergeant
+import FingerPrint.swirl
+from FingerPrint.metacache import MetaCache
+
+
+class TestFingerprint(unittest.TestCase):
+
+    def setUp(self):
+        """setup for your unittest"""
+        self.fingerprint = os.path.abspath(os.path.join(os.path.dirname(
+                globals()["__file__"]), os.path.pardir, 'bin', 'fingerprint'))
+        # fingerprint.log and the swirls are written in the current directory
+        self.tempDir = tempfile.mkdtemp()
+        self.environ = os.environ.copy()
+        self.environ['XDG_CACHE_HOME'] = os.path.join(self.tempDir, 'cache')
+        self.binaries = [os.path.realpath(FingerPrint.utils.which(i))
+                for i in ['ls', 'cat']]
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def _run(self, args):
+        """run bin/fingerprint with args and return its return code and
+        its standard output"""
+        proc = subprocess.Popen([sys.executable, self.fingerprint] + args,
+                cwd = self.tempDir, env = self.environ, stdout = subprocess.PIPE,
+                stderr = subprocess.PIPE, universal_newlines = True)
+        (output, error) = proc.communicate()
+        return (proc.returncode, output)
+
+    def _create(self, fileName, args = []):
+        (retval, output) = self._run(['-c', '-f', fileName] + args + self.binaries)
+        self.assertEqual(retval, 0, msg = output)
+        return os.path.join(self.tempDir, fileName)
+
+    def test_fleet_verify(self):
+        fleet = os.path.join(self.tempDir, 'fleet')
+        os.mkdir(fleet)
+        self._create(os.path.join('fleet', 'a.swirl'))
+        self._create(os.path.join('fleet', 'b.swirl'))
+        broken = os.path.join(self.tempDir, 'broken.swirl')
+        f = open(broken, 'w')
+        f.write('garbage')
+        f.close()
+        # a directory is scanned for .swirl files
+        (retval, output) = self._run(['-y', 'fleet'])
+        self.assertEqual(retval, 0)
+        lines = [json.loads(line) for line in output.splitlines()]
+        self.assertEqual([i["swirl"] for i in lines[:-1]],
+                [os.path.join('fleet', 'a.swirl'), os.path.join('fleet', 'b.swirl')])
+        for line in lines[:-1]:
+            self.assertTrue(line["pass"])
+            self.assertEqual(line["check"], "verify")
+            self.assertEqual(line["errors"], [])
+        self.assertEqual(lines[-1]["summary"], True)
+        self.assertEqual((lines[-1]["swirls"], lines[-1]["passed"],
+                lines[-1]["failed"]), (2, 2, 0))
+        # a broken swirl fails without stopping the others
+        (retval, output) = self._run(['-y', '-i', 'broken.swirl', 'fleet'])
+        self.assertEqual(retval, 1)
+        lines = [json.loads(line) for line in output.splitlines()]
+        self.assertFalse(lines[0]["pass"])
+        self.assertEqual([i["check"] for i in lines[1:-1]], ["integrity", "integrity"])
+        self.assertEqual((lines[-1]["passed"], lines[-1]["failed"]), (2, 1))
+
+    def _load(self, fileName):
+        return FingerPrint.sergeant.readFromPickle(os.path.join(self.tempDir,
+                fileName)).getSwirl()
+
+    def test_parallel(self):
+        self._create('serial.swirl')
+        serial = self._load('serial.swirl')
+        self._create('parallel.swirl', ['-j', '2', '--cache'])
+        parallel = self._load('parallel.swirl')
+        # the first line holds the creation time
+        self.assertEqual(serial.printVerbose(2).splitlines()[1:],
+                parallel.printVerbose(2).splitlines()[1:])
+        self.assertEqual([(i.path, i.md5sum) for i in serial.swirlFiles],
+                [(i.path, i.md5sum) for i in parallel.swirlFiles])
+        # the entries computed by the workers were saved
+        cache = MetaCache(os.path.join(self.tempDir, 'cache', 'fingerprint',
+                'metadata.sqlite'))
+        self.assertTrue(cache._countEntries() > 0)
+        cache.close()
+
+    def test_paranoid(self):
+        self._create('a.swirl')
+        (retval, output) = self._run(['-y', '-i', '-f', 'a.swirl'])
+        self.assertEqual(retval, 0, msg = output)
+        sidecar = os.path.join(self.tempDir, 'a.swirl.hashes')
+        f = open(sidecar, 'rb')
+        hashes = pickle.load(f)
+        f.close()
+        self.assertTrue(len(hashes) > 0)
+        # the files did not change so the wrong checksums are trusted
+        for path in hashes:
+            (kind, key, checksum) = hashes[path]
+            hashes[path] = (kind, key, 'tampered')
+        f = open(sidecar, 'wb')
+        pickle.dump(hashes, f)
+        f.close()
+        (retval, output) = self._run(['-y', '-i', '-f', 'a.swirl'])
+        self.assertEqual(retval, 1)
+        (retval, output) = self._run(['-y', '-i', '--paranoid', '-f', 'a.swirl'])
+        self.assertEqual(retval, 0, msg = output)
+        # --paranoid saved the checksums it computed again
+        (retval, output) = self._run(['-y', '-i', '-f', 'a.swirl'])
+        self.assertEqual(retval, 0, msg = output)
+
+    def test_hash(self):
+        self._create('default.swirl')
+        self.assertEqual(self._load('default.swirl').hashAlgorithm,
+                FingerPrint.swirl.defaultHashAlgorithm)
+        self._create('sha256.swirl', ['--hash', 'sha256'])
+        swirl = self._load('sha256.swirl')
+        self.assertEqual(swirl.hashAlgorithm, 'sha256')
+        checksums = [i.md5sum for i in swirl.swirlFiles if i.md5sum]
+        self.assertTrue(len(checksums) > 0)
+        for checksum in checksums:
+            self.assertEqual(len(checksum), 64)
+        # the integrity check uses the algorithm recorded in the swirl
+        (retval, output) = self._run(['-y', '-i', '-f', 'sha256.swirl'])
+        self.assertEqual(retval, 0, msg = output)
+
+    def test_section_digest(self):
+        testDir = os.path.dirname(os.path.abspath(globals()["__file__"]))
+        # files in special folders like /tmp are not checksummed
+        libDir = tempfile.mkdtemp(dir = testDir)
+        try:
+            lib = os.path.join(libDir, 'libgpilotd.so.2')
+            shutil.copy(os.path.join(testDir, 'files', 'centos_6.2_x86_64',
+                    'libgpilotd.so.2.2.0'), lib)
+            (retval, output) = self._run(['-c', '-f', 'a.swirl', lib] + self.binaries)
+            self.assertEqual(retval, 0, msg = output)
+            swirl = self._load('a.swirl')
+            # only the file which is already prelinked is checksummed by sections
+            self.assertEqual(swirl.elfDigest, 'file')
+            self.assertEqual(swirl.sectionDigests, set([lib]))
+            libFile = [i for i in swirl.swirlFiles if i.path == lib][0]
+            self.assertEqual(libFile.md5sum,
+                    FingerPrint.sergeant.getHash(lib, 'ELF', swirl.hashAlgorithm,
+                    'sections'))
+        finally:
+            shutil.rmtree(libDir)
+        self._create('b.swirl', ['--section-digest'])
+        swirl = self._load('b.swirl')
+        self.assertEqual(swirl.elfDigest, 'sections')
+        (retval, output) = self._run(['-y', '-i', '-f', 'b.swirl'])
+        self.assertEqual(retval, 0, msg = output)
+
+    def test_statistics(self):
+        fileName = os.path.join(self.tempDir, 'input')
+        f = open(fileName, 'w')
+        f.write('input\n')
+        f.close()
+        (retval, output) = self._run(['-c', '-v', '-f', 'trace.swirl', '-x',
+                'cat ' + fileName])
+        self.assertEqual(retval, 0, msg = output)
+        self.assertIn('Tracer statistics', output)
+        f = open(os.path.join(self.tempDir, 'trace.swirl.trace.json'))
+        statistics = json.load(f)
+        f.close()
+        self.assertEqual(sorted(statistics.keys()),
+                ['processes', 'seccomp', 'total', 'waitSeconds'])
+        self.assertTrue(len(statistics['processes']) > 0)
+        # without -v the statistics are not saved
+        (retval, output) = self._run(['-c', '-f', 'quiet.swirl', '-x',
+                'cat ' + fileName])
+        self.assertEqual(retval, 0, msg = output)
+        self.assertNotIn('Tracer statistics', output)
+        self.assertFalse(os.path.exists(os.path.join(self.tempDir,
+                'quiet.swirl.trace.json')))
+
+    def test_binary_data(self):
+        # executable files which are not ELF are checked for a shebang
+        fileName = os.path.join(self.tempDir, 'binary')
+        shutil.copy(self.binaries[0], fileName)
+        (retval, output) = self._run(['-c', '-f', 'a.swirl', fileName])
+        self.assertEqual(retval, 0, msg = output)
+        swirlFile = self._load('a.swirl').swirlFiles[0]
+        self.assertEqual((swirlFile.type, swirlFile.executable), ('Data', False))
+
+    def test_display(self):
+        self._create('a.swirl')
+        (retval, output) = self._run(['-d', '-v', '-f', 'a.swirl'])
+        self.assertEqual(retval, 0)
+        self.assertIn('Deps: ', output)
+        (retval, output) = self._run(['-d', '-g', 'a.dot', '-f', 'a.swirl'])
+        self.assertEqual(retval, 0)
+        f = open(os.path.join(self.tempDir, 'a.dot'))
+        dot = f.read()
+        f.close()
+        self.assertTrue(dot.startswith('digraph FingerPrint {'), msg = dot)
+
+
+if __name__ == '__main__':
+    unittest.main()
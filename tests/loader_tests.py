@@ -0,0 +1,91 @@
+import unittest
+import os
+import shutil
+import struct
+import tempfile
+
+from FingerPrint.loader import LdSoCache, SearchPath
+
+
+class TestLoader(unittest.TestCase):
+
+    def _writeCache(self, data):
+        (fd, fileName) = tempfile.mkstemp()
+        os.write(fd, data)
+        os.close(fd)
+        return fileName
+
+    def test_old_format(self):
+        strings = b"libfoo.so.1\0/usr/lib/libfoo.so.1\0libfoo.so.1\0/usr/lib64/libfoo.so.1\0"
+        data = b"ld.so-1.7.0\0" + struct.pack("=I", 3)
+        data += struct.pack("=iII", 0x0003, 0, 12)
+        data += struct.pack("=iII", 0x0303, 33, 45)
+        # an AArch64 library is not an x86_64 one
+        data += struct.pack("=iII", 0x0a03, 33, 12)
+        fileName = self._writeCache(data + strings)
+        cache = LdSoCache(fileName)
+        os.remove(fileName)
+        self.assertEqual(cache.getPaths("libfoo.so.1", "i386"), ["/usr/lib/libfoo.so.1"])
+        self.assertEqual(cache.getPaths("libfoo.so.1", "x86_64"), ["/usr/lib64/libfoo.so.1"])
+        self.assertEqual(cache.getPaths("libbar.so.1", "x86_64"), [])
+
+    def test_ldconfig(self):
+        fileName = self._writeCache(b"glibc-ld.so.cache1.1" + struct.pack("<IIB3xI3I",
+                0, 0, 2, 0, 0, 0, 0))
+        cache = LdSoCache(fileName)
+        os.remove(fileName)
+        cache._parseLdconfig(["3 libs found in cache `/etc/ld.so.cache'",
+                "\tlibz.so.1 (libc6,x86-64, hwcap: 0x0000000000000004) => /lib64/tls/libz.so.1",
+                "\tlibz.so.1 (libc6,x86-64, OS ABI: Linux 2.6.32) => /lib64/libz.so.1",
+                "\tlibz.so.1 (libc6,AArch64) => /lib/aarch64/libz.so.1",
+                "\tlibz.so.1 (libc6) => /lib/libz.so.1"])
+        self.assertEqual(cache.getPaths("libz.so.1", "x86_64"), ["/lib64/libz.so.1"])
+        self.assertEqual(cache.getPaths("libz.so.1", "i386"), ["/lib/libz.so.1"])
+        self.assertEqual(len(cache.libraries["libz.so.1"]), 3)
+
+    def test_new_format(self):
+        strings = b"libfoo.so.1\0/lib64/libfoo.so.1\0/lib64/haswell/libfoo.so.1\0"
+        header = b"glibc-ld.so.cache1.1" + struct.pack("<IIB3xI3I", 2, len(strings), 2, 0, 0, 0, 0)
+        # string offsets are relative to the header
+        offset = len(header) + 2 * 24
+        entries = struct.pack("<iIIIQ", 0x0303, offset, offset + 12, 0, 0) + \
+                struct.pack("<iIIIQ", 0x0303, offset, offset + 32, 0, 4)
+        fileName = self._writeCache(header + entries + strings)
+        cache = LdSoCache(fileName)
+        os.remove(fileName)
+        self.assertEqual(len(cache.libraries["libfoo.so.1"]), 2)
+        # hwcap libraries are skipped
+        self.assertEqual(cache.getPaths("libfoo.so.1", "x86_64"), ["/lib64/libfoo.so.1"])
+
+    def test_search_path(self):
+        dirA = tempfile.mkdtemp()
+        dirB = tempfile.mkdtemp()
+        for d in [dirA, dirB]:
+            open(os.path.join(d, "libfoo.so.1"), 'w').close()
+        searchPath = SearchPath()
+        self.assertEqual(searchPath.getPaths("libfoo.so.1", [dirB, dirA, dirB + "/"]),
+                [os.path.join(dirB, "libfoo.so.1"), os.path.join(dirA, "libfoo.so.1")])
+        self.assertEqual(searchPath.getPaths("libbar.so.1", [dirA, "/nonexistent"]), [])
+        self.assertEqual(searchPath.getKey([dirB, dirA, dirB + "/"]), (dirB, dirA))
+        self.assertEqual(searchPath.getKey([dirA + "/.", dirB]), (dirA, dirB))
+        # new files are visible only after invalidating the directory
+        open(os.path.join(dirA, "libbar.so.1"), 'w').close()
+        os.utime(dirA, ns=(0, 0))
+        self.assertTrue(searchPath.invalidate())
+        self.assertFalse(searchPath.invalidate())
+        self.assertEqual(searchPath.getPaths("libbar.so.1", [dirA]),
+                [os.path.join(dirA, "libbar.so.1")])
+        # symlinks to files are found, dangling ones and directories are not
+        os.symlink(os.path.join(dirA, "libbar.so.1"), os.path.join(dirB, "libbar.so.1"))
+        os.symlink(os.path.join(dirA, "missing"), os.path.join(dirB, "libbaz.so.1"))
+        os.mkdir(os.path.join(dirA, "libbaz.so.1"))
+        searchPath = SearchPath()
+        self.assertEqual(searchPath.getPaths("libbar.so.1", [dirB]),
+                [os.path.join(dirB, "libbar.so.1")])
+        self.assertEqual(searchPath.getPaths("libbaz.so.1", [dirA, dirB]), [])
+        for d in [dirA, dirB]:
+            shutil.rmtree(d)
+
+
+if __name__ == '__main__':
+    unittest.main()
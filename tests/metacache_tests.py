@@ -0,0 +1,143 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+from FingerPrint.metacache import MetaCache, HashCache
+import FingerPrint.plugins
+from FingerPrint.plugins import PluginManager
+from FingerPrint.plugins.elf import ElfPlugin
+
+
+class TestMetaCache(unittest.TestCase):
+
+    def setUp(self):
+        """setup for your unittest"""
+        self.basedir = os.path.join(os.path.dirname( globals()["__file__"] ), 'files')
+        self.centos = os.path.join(self.basedir, 'centos_6.2_x86_64')
+        self.tmpdir = tempfile.mkdtemp()
+        self.cacheFile = os.path.join(self.tmpdir, 'cache', 'metadata.sqlite')
+
+    def tearDown(self):
+        PluginManager.setMetaCache(None)
+        shutil.rmtree(self.tmpdir)
+
+    def test_get_set(self):
+        fileName = os.path.join(self.tmpdir, 'data')
+        f = open(fileName, 'w')
+        f.write('some data')
+        f.close()
+        cache = MetaCache(self.cacheFile)
+        self.assertTrue(cache.isEnabled())
+        self.assertEqual(cache.get(fileName, 'md5'), None)
+        cache.set(fileName, 'md5', 'abcd')
+        cache.close()
+        cache = MetaCache(self.cacheFile)
+        self.assertEqual(cache.get(fileName, 'md5'), 'abcd')
+        self.assertEqual(cache.get(fileName, 'ELF'), None)
+        # a modified file is a miss
+        f = open(fileName, 'a')
+        f.write('more data')
+        f.close()
+        self.assertEqual(cache.get(fileName, 'md5'), None)
+        cache.close()
+
+    def test_eviction(self):
+        cache = MetaCache(self.cacheFile, maxEntries = 2)
+        fileNames = [os.path.join(self.centos, i) for i in
+                ['dbus-daemon', 'libgpilotd.so.2.2.0', 'README']]
+        for fileName in fileNames:
+            cache.set(fileName, 'md5', fileName)
+            cache.flush()
+        self.assertEqual(cache.get(fileNames[0], 'md5'), None)
+        self.assertEqual(cache.get(fileNames[2], 'md5'), fileNames[2])
+        cache.close()
+
+    def test_elf_plugin(self):
+        cache = MetaCache(self.cacheFile)
+        PluginManager.setMetaCache(cache)
+        fileName = os.path.join(self.centos, 'libgpilotd.so.2.2.0')
+        ElfPlugin._elfIndex.pop(fileName, None)
+        elf = ElfPlugin._readElf(fileName)
+        readme = os.path.join(self.centos, 'README')
+        ElfPlugin._elfIndex.pop(readme, None)
+        self.assertEqual(ElfPlugin._readElf(readme), None)
+        cache.close()
+        cache = MetaCache(self.cacheFile)
+        PluginManager.setMetaCache(cache)
+        # drop the in memory copy
+        ElfPlugin._elfIndex.pop(fileName)
+        cached = ElfPlugin._readElf(fileName)
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(cached.soname, elf.soname)
+        self.assertEqual(cached.needed, elf.needed)
+        self.assertEqual(cached.versionNeeds, elf.versionNeeds)
+        cache.close()
+
+    def test_merge(self):
+        fileName = os.path.join(self.centos, 'README')
+        worker = MetaCache(self.cacheFile, maxEntries = 2)
+        worker.set(fileName, 'md5', 'abcd')
+        pending = worker.takePending()
+        worker.flush()
+        cache = MetaCache(self.cacheFile, maxEntries = 2)
+        self.assertEqual(cache.get(fileName, 'md5'), None)
+        # merged entries are written only by the explicit flush
+        cache.flushInterval = 1
+        cache.merge(pending)
+        reader = MetaCache(self.cacheFile)
+        self.assertEqual(reader.get(fileName, 'md5'), None)
+        cache.flush()
+        self.assertEqual(reader.get(fileName, 'md5'), 'abcd')
+        reader.close()
+        self.assertEqual(worker.get(fileName, 'md5'), 'abcd')
+        # replacing an entry does not trigger the eviction
+        binary = os.path.join(self.centos, 'dbus-daemon')
+        for i in range(3):
+            cache.set(binary, 'md5', str(i))
+            cache.flush()
+        self.assertEqual(cache.get(fileName, 'md5'), 'abcd')
+        self.assertEqual(cache.get(binary, 'md5'), '2')
+        worker.close()
+        cache.close()
+
+    def test_prefetch(self):
+        cache = MetaCache(self.cacheFile)
+        PluginManager.setMetaCache(cache)
+        fileName = os.path.join(self.centos, 'dbus-daemon')
+        ElfPlugin._elfIndex.pop(fileName, None)
+        PluginManager.prefetch([fileName], 2)
+        # the entries computed by the workers are saved by this process
+        cache.close()
+        cache = MetaCache(self.cacheFile)
+        self.assertEqual(cache.get(fileName, 'ELF').needed,
+                ElfPlugin._elfIndex[fileName].needed)
+        cache.close()
+
+    def test_hash_cache(self):
+        fileName = os.path.join(self.tmpdir, 'data')
+        sidecar = os.path.join(self.tmpdir, 'test.swirl.hashes')
+        f = open(fileName, 'w')
+        f.write('some data')
+        f.close()
+        cache = HashCache(sidecar)
+        key = HashCache.getKey(fileName)
+        self.assertEqual(cache.get(fileName, 'md5:Data', key), None)
+        cache.set(fileName, 'md5:Data', key, 'abcd')
+        cache.save()
+        cache = HashCache(sidecar)
+        self.assertEqual(cache.get(fileName, 'md5:Data', key), 'abcd')
+        self.assertEqual(cache.get(fileName, 'md5:ELF', key), None)
+        os.utime(fileName, ns = (0, 0))
+        self.assertEqual(cache.get(fileName, 'md5:Data',
+                HashCache.getKey(fileName)), None)
+        # corrupted sidecar
+        f = open(sidecar, 'w')
+        f.write('garbage')
+        f.close()
+        self.assertEqual(HashCache(sidecar).get(fileName, 'md5:Data', key), None)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
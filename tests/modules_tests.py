@@ -0,0 +1,119 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+from FingerPrint.modules import ModuleIndex, ModulefileCache, parseLibraryPaths, \
+    libVersionMatch, versionKey
+
+
+# fake module command, every 'module show' is logged in calls
+_moduleScript = """#!/bin/sh
+if [ "$1" = "-t" ]; then
+    echo "$MODULEPATH:"
+    echo "gcc/4.8(default)"
+    echo "openmpi/1.6"
+    echo "gcc/4.8"
+    exit 0
+fi
+echo "$2" >> %(calls)s
+if [ "$2" = "openmpi/1.6" ]; then
+    echo "prepend-path	 LD_LIBRARY_PATH /opt/openmpi/lib:/opt/openmpi/lib64"
+    exit 1
+fi
+echo 'prepend_path("LD_LIBRARY_PATH","/opt/gcc/lib64")'
+echo "prepend-path PATH /opt/gcc/bin"
+"""
+
+
+class TestModules(unittest.TestCase):
+
+    def setUp(self):
+        """setup for your unittest"""
+        self.tempDir = tempfile.mkdtemp()
+        self.calls = os.path.join(self.tempDir, 'calls')
+        binDir = os.path.join(self.tempDir, 'bin')
+        self.modulePath = os.path.join(self.tempDir, 'modulefiles')
+        os.mkdir(binDir)
+        os.mkdir(self.modulePath)
+        os.mkdir(os.path.join(self.modulePath, 'gcc'))
+        script = os.path.join(binDir, 'module')
+        f = open(script, 'w')
+        f.write(_moduleScript % {'calls': self.calls})
+        f.close()
+        os.chmod(script, 0o755)
+        self.environ = os.environ.copy()
+        os.environ['PATH'] = binDir + ':' + os.environ['PATH']
+        os.environ['MODULEPATH'] = self.modulePath
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.environ)
+        shutil.rmtree(self.tempDir)
+
+    def _getCalls(self):
+        if not os.path.exists(self.calls):
+            return []
+        f = open(self.calls)
+        calls = f.read().split()
+        f.close()
+        return calls
+
+    def test_parse(self):
+        self.assertEqual(parseLibraryPaths(['setenv LD_LIBRARY_PATH /a:/b',
+                'prepend_path( "LD_LIBRARY_PATH", "/c")', 'append-path PATH /d']),
+                ['/a', '/b', '/c'])
+
+    def test_index(self):
+        fileName = os.path.join(self.tempDir, 'cache', 'modules.pickle')
+        expected = {'gcc/4.8': ['/opt/gcc/lib64'],
+                'openmpi/1.6': ['/opt/openmpi/lib', '/opt/openmpi/lib64']}
+        self.assertEqual(ModuleIndex(fileName, 2).getLibraryPaths(), expected)
+        self.assertEqual(sorted(self._getCalls()), ['gcc/4.8', 'openmpi/1.6'])
+        # the second index is read from disk
+        self.assertEqual(ModuleIndex(fileName).getLibraryPaths(), expected)
+        self.assertEqual(len(self._getCalls()), 2)
+        # a new modulefile invalidates the index
+        gccDir = os.path.join(self.modulePath, 'gcc')
+        open(os.path.join(gccDir, '4.9'), 'w').close()
+        os.utime(gccDir, ns=(0, 0))
+        self.assertEqual(ModuleIndex(fileName).getLibraryPaths(), expected)
+        self.assertEqual(len(self._getCalls()), 4)
+
+    def test_display_cache(self):
+        fileName = os.path.join(self.tempDir, 'cache', 'modulefiles.pickle')
+        gccDir = os.path.join(self.modulePath, 'gcc')
+        for version in ['4.8', '4.9']:
+            open(os.path.join(gccDir, version), 'w').close()
+        # dangling symlinks are skipped
+        os.symlink(os.path.join(gccDir, 'missing'), os.path.join(gccDir, '5.1'))
+        texts = ModulefileCache(fileName, 2).getTexts()
+        self.assertEqual(sorted(texts), ['gcc/4.8', 'gcc/4.9'])
+        self.assertTrue('/opt/gcc/lib64' in texts['gcc/4.8'])
+        self.assertEqual(sorted(self._getCalls()), ['gcc/4.8', 'gcc/4.9'])
+        # the second time only the modified modulefile is displayed
+        os.utime(os.path.join(gccDir, '4.9'), ns=(0, 0))
+        self.assertEqual(ModulefileCache(fileName).getTexts(), texts)
+        self.assertEqual(sorted(self._getCalls()), ['gcc/4.8', 'gcc/4.9', 'gcc/4.9'])
+        # directory listings are saved too
+        cache = ModulefileCache(fileName)
+        self.assertEqual(sorted(cache.listDirectory(gccDir)), ['4.8', '4.9', '5.1'])
+        self.assertEqual(cache.listDirectory(os.path.join(gccDir, '4.8')), None)
+        cache.save()
+        mtime = os.stat(gccDir).st_mtime_ns
+        open(os.path.join(gccDir, '5.2'), 'w').close()
+        os.utime(gccDir, ns=(mtime, mtime))
+        self.assertEqual(len(ModulefileCache(fileName).listDirectory(gccDir)), 3)
+        os.utime(gccDir, ns=(0, 0))
+        self.assertEqual(len(ModulefileCache(fileName).listDirectory(gccDir)), 4)
+
+    def test_version_match(self):
+        for (name, version) in [('libfoo.so.1.2', '1.2'), ('libfoo-1.2.so', '1.2'),
+                ('libfoo.so.1', '1')]:
+            self.assertEqual(libVersionMatch(name).group(1), version)
+        self.assertEqual(libVersionMatch('libfoo.so'), None)
+        self.assertTrue(versionKey('1.10') > versionKey('1.9'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+from FingerPrint.packages import DpkgBackend, getPackageBackend, NullBackend
+
+
+class TestPackages(unittest.TestCase):
+
+    def setUp(self):
+        """setup for your unittest"""
+        self.dpkgDir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.dpkgDir, "info"))
+        self._write("status",
+            "Package: libc6\nStatus: install ok installed\nArchitecture: amd64\n"
+            "Multi-Arch: same\nVersion: 2.36-9\nDescription: GNU C Library\n"
+            " the C library\n\n"
+            "Package: bash\nStatus: install ok installed\nArchitecture: amd64\n"
+            "Version: 5.2-2\n\n"
+            "Package: oldpkg\nStatus: deinstall ok config-files\n"
+            "Architecture: amd64\nVersion: 1.0\n")
+        self._write("info/libc6:amd64.list", "/lib/x86_64-linux-gnu\n"
+            "/lib/x86_64-linux-gnu/libc.so.6\n")
+        self._write("info/bash.list", "/bin/bash\n")
+        self._write("info/oldpkg.list", "/usr/bin/old\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.dpkgDir)
+
+    def _write(self, fileName, content):
+        f = open(os.path.join(self.dpkgDir, fileName), 'w')
+        f.write(content)
+        f.close()
+
+    def test_dpkg(self):
+        backend = DpkgBackend(self.dpkgDir)
+        self.assertEqual(backend.getPackage("/lib/x86_64-linux-gnu/libc.so.6"),
+                "libc6 2.36-9 amd64")
+        self.assertEqual(backend.getPackage("/bin/bash"), "bash 5.2-2 amd64")
+        self.assertEqual(backend.getPackage("/usr/bin/old"), None)
+        self.assertEqual(backend.getPackage("/usr/bin/ls"), None)
+
+    def test_backend(self):
+        self.assertTrue(getPackageBackend("dpkg") is getPackageBackend("dpkg"))
+        self.assertTrue(isinstance(getPackageBackend("unknown"), NullBackend))
+
+
+if __name__ == '__main__':
+    unittest.main()
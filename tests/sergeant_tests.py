@@ -0,0 +1,202 @@
+import unittest
+import os
+import hashlib
+import pickle
+import shutil
+import tempfile
+from datetime import datetime
+
+from FingerPrint import sergeant
+from FingerPrint.elffile import ElfFile
+from FingerPrint.swirl import Swirl, Dependency
+
+
+class TestSergeant(unittest.TestCase):
+
+    def setUp(self):
+        """setup for your unittest"""
+        self.basedir = os.path.join(os.path.dirname( globals()["__file__"] ), 'files')
+        self.files = [os.path.join(self.basedir, 'centos_6.2_x86_64', i)
+                for i in ['README', 'dbus-daemon', 'libgpilotd.so.2.2.0']]
+
+    def _md5(self, fileName, algorithm = "md5"):
+        f = open(fileName, 'rb')
+        md5sum = hashlib.new(algorithm, f.read()).hexdigest()
+        f.close()
+        return md5sum
+
+    def test_hash(self):
+        chunkSize = sergeant.hashChunkSize
+        try:
+            # force several reads
+            sergeant.hashChunkSize = 1000
+            for fileName in self.files:
+                self.assertEqual(sergeant.getHash(fileName, 'Data'), self._md5(fileName))
+        finally:
+            sergeant.hashChunkSize = chunkSize
+
+    def test_hashes(self):
+        fileList = [(fileName, 'Data') for fileName in self.files]
+        expected = [self._md5(fileName) for fileName in self.files]
+        self.assertEqual(sergeant.getHashes(fileList, 3), expected)
+        self.assertEqual(sergeant.getHashes(fileList, 1), expected)
+        self.assertEqual(sergeant.getHashes([]), [])
+
+    def test_algorithms(self):
+        fileList = [(fileName, 'Data') for fileName in self.files]
+        for algorithm in ["sha1", "sha256", "blake2b"]:
+            expected = [self._md5(fileName, algorithm) for fileName in self.files]
+            self.assertEqual(sergeant.getHashes(fileList, 2, algorithm), expected)
+            self.assertEqual(sergeant.getHash(self.files[1], 'Data', algorithm),
+                    expected[1])
+
+    def test_elf_digest(self):
+        (readme, binary, lib) = self.files
+        self.assertEqual(sergeant.getHash(lib, 'ELF', 'md5', 'sections'),
+                ElfFile(lib).getStableDigest('md5'))
+        self.assertNotEqual(sergeant.getHash(lib, 'ELF', 'md5', 'sections'),
+                self._md5(lib))
+        # not an ELF the whole file is checksummed
+        self.assertEqual(sergeant.getHash(readme, 'ELF', 'md5', 'sections'),
+                self._md5(readme))
+
+    def _saveSwirl(self, fileName, dependency = None):
+        swirl = Swirl("test", datetime.now())
+        if dependency:
+            swF = swirl.createSwirlFile(self.files[1])
+            swF.type = 'ELF'
+            swF.addDependency(Dependency.fromString(dependency))
+            swirl.execedFiles.append(swF)
+        f = open(fileName, 'wb')
+        pickle.dump(swirl, f)
+        f.close()
+
+    def test_verify_swirls(self):
+        tempDir = tempfile.mkdtemp()
+        try:
+            os.mkdir(os.path.join(tempDir, 'apps'))
+            self._saveSwirl(os.path.join(tempDir, 'apps', 'b.swirl'))
+            self._saveSwirl(os.path.join(tempDir, 'apps', 'a.swirl'),
+                    'libfingerprintmissing.so.9()(64bit)')
+            f = open(os.path.join(tempDir, 'apps', 'c.swirl'), 'wb')
+            f.write(b'garbage')
+            f.close()
+            fileNames = sergeant.findSwirlFiles([tempDir])
+            self.assertEqual([os.path.basename(i) for i in fileNames],
+                    ['a.swirl', 'b.swirl', 'c.swirl'])
+            results = list(sergeant.verifySwirls(fileNames))
+            self.assertEqual([r["pass"] for r in results], [False, True, False])
+            self.assertEqual(results[0]["errors"],
+                    ['libfingerprintmissing.so.9()(64bit)'])
+            self.assertEqual(results[1]["name"], "test")
+            self.assertEqual(results[2]["name"], None)
+        finally:
+            shutil.rmtree(tempDir)
+
+    def test_rpath(self):
+        # the provider is found only through the RPATH of the executable
+        tempDir = tempfile.mkdtemp()
+        try:
+            libDir = os.path.join(tempDir, 'lib')
+            os.mkdir(libDir)
+            libPath = os.path.join(libDir, 'libgpilotd.so.2')
+            shutil.copy(self.files[2], libPath)
+            swirl = Swirl("test", datetime.now())
+            swF = swirl.createSwirlFile(self.files[1])
+            swF.type = 'ELF'
+            swF.rpaths = [libDir]
+            swF.addDependency(Dependency.fromString('libgpilotd.so.2()(64bit)'))
+            swirl.execedFiles.append(swF)
+            provider = swirl.createSwirlFile(libPath)
+            provider.type = 'ELF'
+            provider.addProvide(Dependency.fromString('libgpilotd.so.2()(64bit)'))
+            provider.md5sum = sergeant.getHash(libPath, 'ELF',
+                    swirl.hashAlgorithm, swirl.elfDigest)
+            serg = sergeant.Sergeant(swirl)
+            self.assertTrue(serg.check())
+            self.assertTrue(serg.checkHash(True), msg=serg.getError())
+        finally:
+            shutil.rmtree(tempDir)
+
+    def test_rpath_providers(self):
+        # two executables with different RPATHs use two copies of a library
+        tempDir = tempfile.mkdtemp()
+        specialFolders = sergeant.specialFolders
+        # files in special folders are not checksummed
+        sergeant.specialFolders = [i for i in specialFolders
+                if not tempDir.startswith(i)]
+        try:
+            swirl = Swirl("test", datetime.now())
+            libs = []
+            for name in ['a', 'b']:
+                libDir = os.path.join(tempDir, name)
+                os.mkdir(libDir)
+                libPath = os.path.join(libDir, 'libgpilotd.so.2')
+                shutil.copy(self.files[2], libPath)
+                f = open(libPath, 'ab')
+                f.write(name.encode())
+                f.close()
+                swF = swirl.createSwirlFile('/usr/bin/' + name)
+                swF.type = 'ELF'
+                swF.rpaths = [libDir]
+                swF.addDependency(Dependency.fromString('libgpilotd.so.2()(64bit)'))
+                swirl.execedFiles.append(swF)
+                provider = swirl.createSwirlFile(libPath)
+                provider.type = 'ELF'
+                provider.addProvide(Dependency.fromString('libgpilotd.so.2()(64bit)'))
+                provider.md5sum = sergeant.getHash(libPath, 'ELF',
+                        swirl.hashAlgorithm, swirl.elfDigest)
+                libs.append(libPath)
+            serg = sergeant.Sergeant(swirl)
+            self.assertTrue(serg.checkHash(True), msg=serg.getError())
+            # the library of the second executable is checked too
+            f = open(libs[1], 'ab')
+            f.write(b'modified')
+            f.close()
+            self.assertFalse(serg.checkHash())
+            self.assertEqual(len(serg.getError()), 1)
+        finally:
+            sergeant.specialFolders = specialFolders
+            shutil.rmtree(tempDir)
+
+    def test_section_digests(self):
+        # prelinked files recorded in the swirl are verified with their sections
+        tempDir = tempfile.mkdtemp()
+        specialFolders = sergeant.specialFolders
+        # files in special folders are not checksummed
+        sergeant.specialFolders = [i for i in specialFolders
+                if not tempDir.startswith(i)]
+        try:
+            libPath = os.path.join(tempDir, 'libgpilotd.so.2')
+            shutil.copy(self.files[2], libPath)
+            swirl = Swirl("test", datetime.now())
+            self.assertEqual(swirl.elfDigest, "file")
+            swF = swirl.createSwirlFile(self.files[1])
+            swF.type = 'ELF'
+            swF.rpaths = [tempDir]
+            swF.addDependency(Dependency.fromString('libgpilotd.so.2()(64bit)'))
+            swirl.execedFiles.append(swF)
+            provider = swirl.createSwirlFile(libPath)
+            provider.type = 'ELF'
+            provider.addProvide(Dependency.fromString('libgpilotd.so.2()(64bit)'))
+            provider.md5sum = sergeant.getHash(libPath, 'ELF',
+                    swirl.hashAlgorithm, "sections")
+            serg = sergeant.Sergeant(swirl)
+            self.assertFalse(serg.checkHash())
+            swirl.sectionDigests.add(libPath)
+            self.assertEqual(swirl.getElfDigest(libPath), "sections")
+            self.assertTrue(serg.checkHash(True), msg=serg.getError())
+            # the GOT is rewritten by prelink
+            got = [i for i in ElfFile(libPath).getSections() if i[0] == '.got'][0]
+            f = open(libPath, 'r+b')
+            f.seek(got[3])
+            f.write(b'\xff')
+            f.close()
+            self.assertTrue(serg.checkHash(True), msg=serg.getError())
+        finally:
+            sergeant.specialFolders = specialFolders
+            shutil.rmtree(tempDir)
+
+
+if __name__ == '__main__':
+    unittest.main()
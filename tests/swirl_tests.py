@@ -0,0 +1,129 @@
+import unittest
+import os
+import pickle
+from datetime import datetime
+
+from FingerPrint.swirl import Swirl, SwirlFile, Dependency
+
+
+class TestSwirl(unittest.TestCase):
+
+    def setUp(self):
+        """setup for your unittest"""
+        self.basedir = os.path.join(os.path.dirname( globals()["__file__"] ), 'files')
+        self.centos = os.path.join(self.basedir, 'centos_6.2_x86_64')
+        self.swirl = Swirl("test", datetime.now())
+        self.binary = self.swirl.createSwirlFile(os.path.join(self.centos, 'dbus-daemon'))
+        self.lib = self.swirl.createSwirlFile(os.path.join(self.centos, 'libgpilotd.so.2.2.0'))
+        self.lib.setLinks(['/usr/lib64/libgpilotd.so.2'])
+        self.dep = Dependency.fromString('libgpilotd.so.2()(64bit)')
+        self.binary.addDependency(self.dep)
+        self.lib.addProvide(Dependency.fromString('libgpilotd.so.2()(64bit)'))
+
+    def test_indexes(self):
+        self.assertTrue(self.swirl.isFileTracked(self.lib.path))
+        self.assertTrue(self.swirl.isFileTracked('/usr/lib64/libgpilotd.so.2'))
+        self.assertFalse(self.swirl.isFileTracked('/usr/lib64/libgpilotd.so'))
+        self.assertTrue(self.swirl.createSwirlFile(self.lib.path) is self.lib)
+        self.assertTrue(self.swirl.getSwirlFileByProv(self.dep) is self.lib)
+        # the first provider in the swirl wins
+        self.binary.addProvide(Dependency.fromString('libgpilotd.so.2()(64bit)'))
+        self.assertTrue(self.swirl.getSwirlFileByProv(self.dep) is self.binary)
+        self.assertEqual(len(self.swirl.swirlFiles), 2)
+
+    def test_pickle(self):
+        state = self.swirl.__getstate__()
+        self.assertFalse('_pathIndex' in state)
+        # swirls saved by older version do not have indexes at all
+        del self.swirl.__dict__['_pathIndex']
+        del self.swirl.__dict__['_provIndex']
+        swirl = pickle.loads(pickle.dumps(self.swirl))
+        self.assertEqual(swirl._pathIndex, None)
+        lib = swirl.getSwirlFileByProv(self.dep)
+        self.assertEqual(lib.path, self.lib.path)
+        self.assertTrue(swirl.isFileTracked('/usr/lib64/libgpilotd.so.2'))
+        self.assertTrue(swirl.getSwirlFileByPath('/usr/lib64/libgpilotd.so.2') is lib)
+        self.assertEqual(swirl.getSwirlFileByPath('/usr/lib64/missing.so'), None)
+        newProv = Dependency.fromString('libgpilotd.so.2(VERS_1)(64bit)')
+        lib.addProvide(newProv)
+        self.assertTrue(swirl.getSwirlFileByProv(newProv) is lib)
+
+    def test_hash_algorithm(self):
+        self.assertEqual(self.swirl.hashAlgorithm, "blake2b")
+        self.assertEqual(Swirl("test", datetime.now(), "sha256").hashAlgorithm,
+                "sha256")
+        # swirls saved by older version used only md5
+        del self.swirl.__dict__['hashAlgorithm']
+        swirl = pickle.loads(pickle.dumps(self.swirl))
+        self.assertEqual(swirl.hashAlgorithm, "md5")
+
+    def test_elf_digest(self):
+        self.assertEqual(self.swirl.elfDigest, "file")
+        self.assertEqual(self.swirl.getElfDigest(self.lib.path), "file")
+        self.swirl.sectionDigests.add(self.lib.path)
+        self.assertEqual(self.swirl.getElfDigest(self.lib.path), "sections")
+        swirl = Swirl("test", datetime.now(), elfDigest = "sections")
+        self.assertEqual(swirl.getElfDigest(self.lib.path), "sections")
+        # swirls saved by older versions do not record prelinked files
+        del self.swirl.__dict__['sectionDigests']
+        swirl = pickle.loads(pickle.dumps(self.swirl))
+        self.assertEqual(swirl.getElfDigest(self.lib.path), "file")
+
+    def _addLib(self, path, soname):
+        swF = self.swirl.createSwirlFile(path)
+        swF.addProvide(Dependency.fromString(soname + '()(64bit)'))
+        return swF
+
+    def _addDep(self, swF, soname):
+        swF.addDependency(Dependency.fromString(soname + '()(64bit)'))
+
+    def test_closure(self):
+        libc = self._addLib('/lib64/libc.so.6', 'libc.so.6')
+        loader = self._addLib('/lib64/ld-linux-x86-64.so.2', 'ld-linux-x86-64.so.2')
+        libm = self._addLib('/lib64/libm.so.6', 'libm.so.6')
+        self._addDep(libc, 'ld-linux-x86-64.so.2')
+        self._addDep(loader, 'libc.so.6')
+        self._addDep(libm, 'libc.so.6')
+        self._addDep(self.lib, 'libm.so.6')
+        self.assertEqual(self.swirl.getListSwirlFilesDependentStatic(self.binary),
+                [self.lib, libm, libc, loader])
+        # libc and the loader depend on each other
+        self.assertEqual(self.swirl.getListSwirlFilesDependentStatic(loader),
+                [libc, loader])
+        self.assertEqual(self.swirl.getListSwirlFilesDependentStatic(libc),
+                [loader, libc])
+        self.assertEqual(self.swirl.getLoader(self.binary), loader)
+        # returned lists are copies
+        self.swirl.getListSwirlFilesDependentStatic(self.lib).append(self.binary)
+        self.assertEqual(self.swirl.getListSwirlFilesDependentStatic(self.lib),
+                [libm, libc, loader])
+        # new dependencies invalidate the cache
+        libz = self._addLib('/lib64/libz.so.1', 'libz.so.1')
+        self._addDep(libm, 'libz.so.1')
+        self.assertEqual(self.swirl.getListSwirlFilesDependentStatic(self.lib),
+                [libm, libc, libz, loader])
+
+
+    def test_slots(self):
+        self.assertFalse(hasattr(self.lib, '__dict__'))
+        self.assertFalse(hasattr(self.dep, '__dict__'))
+        # state saved by the old classes (a plain __dict__)
+        dep = Dependency.__new__(Dependency)
+        dep.__setstate__({'arch': 'x86_64', 'major': 'libgpilotd.so.2',
+                'minor': '', 'hwcap': None, 'type': 'Data'})
+        self.assertEqual(dep, self.dep)
+        self.assertTrue(dep.major is self.dep.major)
+        swF = SwirlFile.__new__(SwirlFile)
+        swF.__setstate__({'arch': 'x86_64', 'path': '/usr/lib64/libfoo.so.1',
+                'links': [], 'staticDependencies': [dep], 'provides': [],
+                'dynamicDependencies': [], 'openedFiles': {}, 'md5sum': None,
+                'package': None, 'type': 'ELF', 'unknown': 1})
+        self.assertEqual(swF.rpaths, [])
+        self.assertEqual(swF.executable, False)
+        self.assertEqual(pickle.loads(pickle.dumps(swF)), swF)
+        self.assertNotEqual(swF, self.lib)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
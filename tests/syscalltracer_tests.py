@@ -0,0 +1,267 @@
+import unittest
+import os
+import json
+import shutil
+import tempfile
+import mmap
+import ctypes
+import ctypes.util
+import types
+
+import FingerPrint.syscalltracer
+import FingerPrint.ptrace.cpu_info
+import FingerPrint.utils
+from FingerPrint.syscalltracer import ProcessMemory, SyscallTracer, TracerControlBlock, \
+        CallSiteClassifier, CallSiteCache
+from FingerPrint.elffile import ElfFile, ElfFormatError
+
+
+class TestSyscallTracer(unittest.TestCase):
+
+    def setUp(self):
+        """setup for your unittest"""
+        self.useProcessVmReadv = ProcessMemory.useProcessVmReadv
+        # a string which crosses a page boundary
+        self.path = "/usr/lib64/libfingerprint.so.1"
+        self.mm = mmap.mmap(-1, 2 * mmap.PAGESIZE)
+        self.offset = mmap.PAGESIZE - 10
+        self.mm[self.offset:self.offset + len(self.path) + 1] = \
+                self.path.encode() + b'\0'
+        self.char = ctypes.c_char.from_buffer(self.mm, self.offset)
+        self.address = ctypes.addressof(self.char)
+        # a library mapped by this process
+        self.library = ctypes.util.find_library("c")
+        for line in open("/proc/self/maps"):
+            if self.library in line:
+                self.library = line.split()[5]
+                break
+
+    def tearDown(self):
+        ProcessMemory.useProcessVmReadv = self.useProcessVmReadv
+        del self.char
+        self.mm.close()
+
+    def _readCString(self):
+        memory = ProcessMemory(os.getpid())
+        try:
+            return memory.readCString(self.address)
+        finally:
+            memory.close()
+
+    def test_read_cstring(self):
+        self.assertEqual(self._readCString(), self.path)
+
+    def test_read_cstring_proc(self):
+        # fall back to /proc/PID/mem
+        ProcessMemory.useProcessVmReadv = False
+        self.assertEqual(self._readCString(), self.path)
+
+    def test_read_page(self):
+        memory = ProcessMemory(os.getpid())
+        self.assertEqual(memory.read(self.address, 100), self.path.encode()[:10])
+        memory.close()
+
+    def _trace(self, useSeccomp):
+        for attr in (TracerControlBlock.files, TracerControlBlock.dependencies,
+                TracerControlBlock.env, TracerControlBlock.cmdline):
+            attr.clear()
+        tracer = SyscallTracer(useSeccomp)
+        self.assertTrue(tracer.main(["bash", "-c", "cat /etc/hostname > /dev/null"]))
+        cat = os.path.realpath(FingerPrint.utils.which("cat"))
+        self.assertIn("/etc/hostname", TracerControlBlock.files[cat][cat])
+        libs = [os.path.basename(i) for i in TracerControlBlock.dependencies[cat]]
+        self.assertIn("libc.so.6", libs)
+        return tracer
+
+    def test_trace(self):
+        self.assertFalse(self._trace(False).filtered)
+
+    def test_trace_seccomp(self):
+        self.assertTrue(self._trace(True).filtered)
+
+    def test_trace_seccomp_fallback(self):
+        install = FingerPrint.syscalltracer.installSeccompFilter
+        FingerPrint.syscalltracer.installSeccompFilter = lambda syscalls: False
+        try:
+            self.assertFalse(self._trace(True).filtered)
+        finally:
+            FingerPrint.syscalltracer.installSeccompFilter = install
+
+    def test_add_mapping(self):
+        TracerControlBlock.dependencies.clear()
+        tcb = TracerControlBlock(os.getpid())
+        binary = tcb.getProcessName()
+        tcb.scanMaps = False
+        fd = os.open(self.library, os.O_RDONLY)
+        try:
+            # not executable or anonymous
+            tcb.addMapping((mmap.PROT_READ, mmap.MAP_PRIVATE, fd))
+            tcb.addMapping((mmap.PROT_EXEC, mmap.MAP_PRIVATE | mmap.MAP_ANONYMOUS, -1))
+            self.assertEqual(TracerControlBlock.dependencies[binary], [])
+            tcb.addMapping((mmap.PROT_READ | mmap.PROT_EXEC, mmap.MAP_PRIVATE, fd))
+            tcb.addMapping((mmap.PROT_READ | mmap.PROT_EXEC, mmap.MAP_PRIVATE, fd))
+        finally:
+            os.close(fd)
+        self.assertEqual(TracerControlBlock.dependencies[binary],
+                [os.path.realpath(self.library)])
+        # the first mmap after an exec scans the maps
+        tcb.updateProcessInfo()
+        tcb.addMapping(None)
+        self.assertFalse(tcb.scanMaps)
+        self.assertIn(os.path.realpath(self.library),
+                TracerControlBlock.dependencies[binary])
+        tcb.memory.close()
+
+    def test_call_sites(self):
+        fileName = 'tests/files/Ubuntu_12.04_x86_64/dbus-daemon'
+        callSites = CallSiteClassifier(fileName)
+        elf = ElfFile(fileName)
+        # 34755: e8 c6 0b fd ff    call   5320 <open@plt>
+        self.assertEqual(callSites.getCalledFunction(elf.vaddrToOffset(0x3475a)), 'open')
+        self.assertEqual(callSites.getCalledFunction(elf.vaddrToOffset(0x34755)), None)
+        self.assertRaises(ElfFormatError, CallSiteClassifier,
+                'tests/files/Ubuntu_12.04_x86_64/README')
+
+    def test_call_sites_index(self):
+        tempDir = tempfile.mkdtemp()
+        try:
+            fileName = os.path.join(tempDir, 'dbus-daemon')
+            shutil.copy('tests/files/Ubuntu_12.04_x86_64/dbus-daemon', fileName)
+            elf = ElfFile(fileName)
+            callSites = CallSiteClassifier(fileName)
+            for (vaddr, offset, filesz, flags) in elf.getSegments():
+                for address in [vaddr, vaddr + filesz // 2, vaddr + filesz - 1]:
+                    if flags & 0x1:
+                        self.assertEqual(callSites._toOffset(address),
+                                elf.vaddrToOffset(address))
+                        self.assertEqual(callSites._toVaddr(
+                                elf.vaddrToOffset(address)), address)
+                    else:
+                        # data is never looked up
+                        self.assertEqual(callSites._toOffset(address), None)
+            self.assertEqual(callSites._toOffset(0xffffffffff), None)
+            # the lookups do not open the file again
+            os.remove(fileName)
+            self.assertEqual(callSites.getCalledFunction(elf.vaddrToOffset(0x3475a)),
+                    'open')
+        finally:
+            shutil.rmtree(tempDir)
+
+    def test_call_site_cache(self):
+        cache = CallSiteCache(2)
+        cache.set(('/lib/a.so', 1), '/lib/a.so')
+        cache.set(('/lib/b.so', 2), '/lib/libc.so.6')
+        self.assertEqual(cache.get(('/lib/a.so', 1)), '/lib/a.so')
+        # b is the least recently used
+        cache.set(('/lib/c.so', 3), '/lib/c.so')
+        self.assertEqual(cache.get(('/lib/b.so', 2)), None)
+        self.assertEqual(cache.get(('/lib/c.so', 3)), '/lib/c.so')
+        self.assertEqual(len(cache), 2)
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+
+    def test_file_opener(self):
+        fileName = 'tests/files/Ubuntu_12.04_x86_64/dbus-daemon'
+        offset = ElfFile(fileName).vaddrToOffset(0x3475a)
+        stack = "/lib/libc.so.6:0x10:0x7f0010\n/lib/libc.so.6:0x20:0x7f0020\n" \
+                "%s:0x%x:0x%x\n" % (fileName, offset, offset)
+        calls = []
+        def trace(pid, firstCallerOnly):
+            calls.append(firstCallerOnly)
+            return stack
+        tcb = TracerControlBlock(os.getpid())
+        tcb.tracing = True
+        tcb.trace = trace
+        cache = TracerControlBlock.callSiteCache
+        TracerControlBlock.callSiteCache = CallSiteCache()
+        try:
+            self.assertEqual(tcb.getFileOpener(), fileName)
+            self.assertEqual(tcb.getFileOpener(), fileName)
+            self.assertEqual(TracerControlBlock.callSiteCache.hits, 1)
+            self.assertEqual(TracerControlBlock.callSiteCache.misses, 1)
+            # the unwinding stops at the caller
+            self.assertEqual(calls, [1, 1])
+        finally:
+            TracerControlBlock.callSiteCache = cache
+            tcb.memory.close()
+
+    @unittest.skipUnless(FingerPrint.ptrace.cpu_info.CPU_X86_64, "x86_64 only")
+    def test_file_opener_stack(self):
+        tcb = TracerControlBlock(os.getpid())
+        (starts, mappings) = tcb._getCodeMappings()
+        library = [i for i in mappings if i[3] == self.library][0]
+        other = [i for i in mappings if i[3] != self.library][0]
+        # the program counter is in libc which is called by the other
+        # object, the first word pointing to the other object is stale
+        stack = (ctypes.c_uint64 * 5)(other[0] + 0x8, library[0] + 0x10, 0x1234,
+                0, other[0] + 0x20)
+        regs = types.SimpleNamespace(rip = library[0] + 8,
+                rsp = ctypes.addressof(stack))
+        lines = ["%s:0x%x:0x%x" % (self.library, library[2] + 8, library[0] + 8),
+                "%s:0x%x:0x%x" % (other[3], other[2] + 0x20, other[0] + 0x20)]
+        calls = []
+        def trace(pid, firstCallerOnly):
+            calls.append(firstCallerOnly)
+            return "\n".join(lines) + "\n"
+        tcb.tracing = True
+        tcb.trace = trace
+        cache = TracerControlBlock.callSiteCache
+        callerDepths = TracerControlBlock.callerDepths
+        TracerControlBlock.callSiteCache = CallSiteCache()
+        TracerControlBlock.callerDepths = {}
+        try:
+            opener = tcb.getFileOpener(regs)
+            self.assertEqual(TracerControlBlock.callerDepths,
+                    {(self.library, library[2] + 8): [4]})
+            self.assertEqual(tcb.getFileOpener(regs), opener)
+            # the second lookup does not unwind the stack
+            self.assertEqual(calls, [1])
+            self.assertEqual(tcb.counters["stackTraces"], 1)
+            # another caller at the same depth is unwound only once
+            stack[4] = other[0] + 0x28
+            lines[1] = "%s:0x%x:0x%x" % (other[3], other[2] + 0x28, other[0] + 0x28)
+            self.assertEqual(tcb.getFileOpener(regs), opener)
+            self.assertEqual(tcb.getFileOpener(regs), opener)
+            self.assertEqual(calls, [1, 1])
+            # a caller which is not in the scanned stack is never cached
+            lines[1] = "%s:0x%x:0x%x" % (other[3], other[2] + 0x30, other[0] + 0x30)
+            regs.rip += 1
+            tcb.getFileOpener(regs)
+            tcb.getFileOpener(regs)
+            self.assertEqual(calls, [1, 1, 1, 1])
+            # a new mapping of code invalidates the cached mappings
+            scans = tcb.counters["codeMapsScans"]
+            TracerControlBlock.codeGeneration += 1
+            tcb._getCodeLocation(0)
+            self.assertEqual(tcb.counters["codeMapsScans"], scans + 1)
+        finally:
+            TracerControlBlock.callSiteCache = cache
+            TracerControlBlock.callerDepths = callerDepths
+            tcb.memory.close()
+
+    def test_statistics(self):
+        tracer = self._trace(True)
+        statistics = tracer.statistics
+        total = statistics.getTotal()
+        self.assertTrue(total["opens"] >= 1)
+        self.assertEqual(total["seccompStops"], total["syscallStops"])
+        self.assertEqual(total["execEvents"], 1)
+        self.assertEqual(len(statistics.processes), 2)
+        cat = os.path.realpath(FingerPrint.utils.which("cat"))
+        self.assertIn([cat], [i[-1:] for i in statistics.executables.values()])
+        tempDir = tempfile.mkdtemp()
+        try:
+            fileName = os.path.join(tempDir, 'output.swirl.trace.json')
+            statistics.save(fileName)
+            f = open(fileName)
+            summary = json.load(f)
+            f.close()
+            self.assertTrue(summary["seccomp"])
+            self.assertEqual(summary["total"]["opens"], total["opens"])
+            self.assertEqual(len(summary["processes"]), 2)
+        finally:
+            shutil.rmtree(tempDir)
+        self.assertIn("seccomp filter, 2 processes", str(statistics))
+
+
+if __name__ == '__main__':
+    unittest.main()
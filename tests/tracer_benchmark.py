@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+#
+# LC
+#
+# measure the slowdown of a syscall heavy command traced by the
+# SyscallTracer with PTRACE_SYSCALL and with the seccomp filter
+#
+# usage: python tests/tracer_benchmark.py [-n runs] [command]
+#
+
+from optparse import OptionParser
+import os
+import shlex
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir)))
+from FingerPrint.syscalltracer import SyscallTracer, TracerControlBlock
+
+# a million read/write system calls and a few hundreds open/mmap
+defaultCommand = "bash -c 'dd if=/dev/zero of=/dev/null bs=1 count=500000 " \
+        "2> /dev/null; for i in $(seq 50); do ls / > /dev/null; done'"
+
+
+def runUntraced(command):
+    subprocess.call(command)
+
+
+def runTraced(command, useSeccomp):
+    for attr in (TracerControlBlock.files, TracerControlBlock.dependencies,
+            TracerControlBlock.env, TracerControlBlock.cmdline):
+        attr.clear()
+    tracer = SyscallTracer(useSeccomp)
+    if not tracer.main(command):
+        raise RuntimeError("Unable to trace " + str(command))
+    if useSeccomp and not tracer.filtered:
+        print("Warning: the seccomp filter could not be installed")
+
+
+def best(function, runs, *args):
+    """return the best wall clock time of runs executions of function"""
+    times = []
+    for i in range(runs):
+        start = time.time()
+        function(*args)
+        times.append(time.time() - start)
+    return min(times)
+
+
+if __name__ == '__main__':
+    parser = OptionParser(usage="usage: %prog [-n runs] [command]")
+    parser.add_option("-n", "--runs", type="int", dest="runs", default=3,
+            help="number of runs of each mode, the best time is reported")
+    (options, args) = parser.parse_args()
+    command = shlex.split(' '.join(args) if args else defaultCommand)
+    untraced = best(runUntraced, options.runs, command)
+    print("%-16s %8.2fs" % ("untraced", untraced))
+    for (name, useSeccomp) in (("PTRACE_SYSCALL", False), ("seccomp", True)):
+        seconds = best(runTraced, options.runs, command, useSeccomp)
+        print("%-16s %8.2fs  slowdown %6.1fx" % (name, seconds, seconds / untraced))